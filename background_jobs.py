@@ -0,0 +1,236 @@
+"""
+Expensive computations run in a background thread pool, so a page can be
+drawn straight away with provisional styling and redrawn when the results
+arrive.
+
+A page asks for a result with background_result, naming the group it
+belongs to (for example the betweenness of the threshold tab's graph) and
+the key of the current inputs. Results that arrive within
+PROVISIONAL_AFTER_SECONDS - cached ones, and anything quick - are returned
+straight away. Otherwise None is returned, the page draws its provisional
+version, and wait_for_jobs at the end of the fragment or page waits for the
+job and reruns it.
+
+Jobs are shared between sessions asking for the same key. When a session
+asks for a different key in the same group, because a slider moved before
+the job finished, it gives up its interest in the old job, which is
+cancelled if no other session wants it and it hasn't started. Jobs already
+running can't be interrupted and finish in the background, so their results
+still land in the caches they fill.
+
+The pool holds threads rather than processes, so jobs work on the graphs
+the page already has in memory. Betweenness of large graphs is spread over
+processes by parallel_centrality within the job.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from instrumentation import span
+
+# Number of background threads, overridden with the BACKGROUND_WORKERS
+# environment variable
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 2))
+
+# Results taking longer than this are shown provisionally first
+PROVISIONAL_AFTER_SECONDS = 0.1
+
+# How often wait_for_jobs checks on its jobs. Each check is also a point at
+# which streamlit can stop the run for a newer interaction.
+POLL_SECONDS = 0.2
+
+
+class JobPool:
+    """
+    Thread pool running one job per key, however many sessions ask for it.
+
+    Parameters:
+    ----------
+    workers: int
+        Number of threads
+    """
+
+    def __init__(self, workers):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="background-job")
+        # Key to the job's future and the set of owners waiting for it.
+        # Reentrant, as cancelling a future runs its callbacks straight away.
+        self._jobs = {}
+        self._lock = threading.RLock()
+
+    def submit(self, key, owner, compute):
+        """
+        Start compute() in the pool, or join the job already running it for
+        key.
+
+        Parameters:
+        ----------
+        key: hashable
+            Identifies the result, so only one job runs per key
+        owner: hashable
+            Who is waiting for the result, for example a session
+        compute: callable
+            Called with no arguments in a pool thread
+
+        Returns:
+        --------
+        concurrent.futures.Future
+        """
+        with self._lock:
+            if key in self._jobs:
+                future, owners = self._jobs[key]
+                owners.add(owner)
+                return future
+            future = self._executor.submit(compute)
+            self._jobs[key] = (future, {owner})
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if key in self._jobs and self._jobs[key][0] is future:
+                del self._jobs[key]
+
+    def release(self, key, owner):
+        """
+        Stop waiting for the job for key, cancelling it if no one else is
+        waiting for it and it hasn't started.
+        """
+        with self._lock:
+            if key not in self._jobs:
+                return
+            future, owners = self._jobs[key]
+            owners.discard(owner)
+            if not owners:
+                future.cancel()
+
+
+@st.cache_resource(show_spinner=False)
+def job_pool():
+    """
+    Return the process-wide pool of background jobs, shared by every
+    session.
+
+    Returns:
+    --------
+    JobPool
+    """
+    return JobPool(BACKGROUND_WORKERS)
+
+
+def _session_jobs():
+    # This session's job in each group, as [key, future, asked for since the
+    # page last ended]
+    if "background_jobs" not in st.session_state:
+        st.session_state["background_jobs"] = {}
+        st.session_state["background_jobs_owner"] = uuid.uuid4().hex
+    return st.session_state["background_jobs"], st.session_state["background_jobs_owner"]
+
+
+def background_result(group, key, compute):
+    """
+    The result of compute() for key if it is ready, starting it in the
+    background if it isn't.
+
+    Parameters:
+    ----------
+    group: str
+        What the result is for on the page. Asking for a new key in a group
+        gives up this session's interest in the group's previous job.
+    key: hashable
+        Identifies the inputs, for example the dataset's graph_key together
+        with the filter settings
+    compute: callable
+        Called with no arguments in a pool thread, which has no script run
+        context. It must not use streamlit elements, session state or
+        cached functions - look up anything it needs from st.cache_resource
+        before calling background_result - and must not depend on objects
+        the page changes later - pass it a copy of anything that is changed
+        in place.
+
+    Returns:
+    --------
+    object
+        compute()'s result, or None if it isn't ready yet. Exceptions raised
+        by compute are raised here.
+    """
+    jobs, owner = _session_jobs()
+    pool = job_pool()
+
+    if group in jobs and jobs[group][0] != key:
+        pool.release(jobs.pop(group)[0], owner)
+    if group not in jobs:
+        jobs[group] = [key, pool.submit(key, owner, compute), True]
+    jobs[group][2] = True
+
+    future = jobs[group][1]
+    wait([future], timeout=PROVISIONAL_AFTER_SECONDS)
+    if not future.done():
+        return None
+
+    del jobs[group]
+    pool.release(key, owner)
+    return future.result()
+
+
+def release_job(group):
+    """
+    Give up this session's job in a group, if it has one, for example when
+    the result has turned up in a cache without it.
+    """
+    jobs, owner = _session_jobs()
+    if group in jobs:
+        job_pool().release(jobs.pop(group)[0], owner)
+
+
+def wait_for_jobs(*groups, message="Calculating node sizes and colours..."):
+    """
+    Wait for this session's background jobs, then rerun so the page is
+    drawn with their results.
+
+    Call at the end of each fragment that asks for results, naming the
+    groups it asks for, and at the end of the page with no groups. When the
+    whole page is running, fragments leave the waiting to the end of the
+    page, so the rest of the page is drawn first. When a fragment reruns by
+    itself it waits, and reruns just the fragment if only its own jobs were
+    outstanding. Otherwise - for example if the page's graph was still being
+    enriched when the fragment ran - the whole page is rerun.
+
+    Parameters:
+    ----------
+    *groups: str
+        Groups the calling fragment asks for
+    message: str
+        Shown while waiting
+    """
+    jobs, owner = _session_jobs()
+    ctx = get_script_run_ctx()
+    fragment_run = bool(ctx and ctx.fragment_ids_this_run)
+    if groups and not fragment_run:
+        return
+
+    if not groups:
+        # Give up jobs the page no longer asks for, such as a tab's job from
+        # before a sidebar setting changed
+        for group in [group for group, (_, _, asked) in jobs.items() if not asked]:
+            job_pool().release(jobs.pop(group)[0], owner)
+        for job in jobs.values():
+            job[2] = False
+
+    if not jobs:
+        return
+
+    pending = [future for _, future, _ in jobs.values()]
+    status = st.empty()
+    with span("waiting for background jobs"):
+        while not all(future.done() for future in pending):
+            # Updating the element lets streamlit stop this run if the user
+            # changes something in the meantime
+            status.caption(message)
+            time.sleep(POLL_SECONDS)
+    status.empty()
+    st.rerun(scope="fragment" if fragment_run and set(jobs) <= set(groups) else "app")
@@ -0,0 +1,60 @@
+"""
+Compare graph construction time and peak memory between the original
+per-page create_graph and graph_pipeline.build_graph.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_create_graph
+    python -m benchmarks.bench_create_graph --sizes 10000 100000
+"""
+import argparse
+
+import networkx as nx
+import pandas as pd
+
+from benchmarks.synthetic import make_tables
+from benchmarks.timing import measure
+from graph_pipeline import build_graph
+
+
+def legacy_create_graph(nodeData, edgeData):
+    """
+    Graph construction as it was written in the pages before graph_pipeline.
+    """
+    G = nx.Graph()
+
+    idList = nodeData['ID'].tolist()
+    labels = pd.DataFrame(nodeData['Label'])
+    labelDicts = labels.to_dict(orient='records')
+    nodeTuples = [tuple(r) for r in zip(idList,labelDicts)]
+
+    sourceList = edgeData['Source'].tolist()
+    targetList = edgeData['Target'].tolist()
+    weights = pd.DataFrame(edgeData['Weight'])
+    weightDicts = weights.to_dict(orient='records')
+    edgeTuples = [tuple(r) for r in zip(sourceList,targetList,weightDicts)]
+
+    G.add_nodes_from(nodeTuples)
+    G.add_edges_from(edgeTuples)
+
+    return G
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000],
+                        help="Edge counts to benchmark")
+    args = parser.parse_args()
+
+    print(f"{'edges':>10} {'implementation':>15} {'time (s)':>10} {'peak (MB)':>10}")
+    for n_edges in args.sizes:
+        nodes, edges = make_tables(n_edges)
+        for name, func in [("legacy", legacy_create_graph),
+                           ("build_graph", build_graph)]:
+            _, elapsed, peak = measure(func, lambda: (nodes, edges))
+            print(f"{n_edges:>10} {name:>15} {elapsed:>10.3f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
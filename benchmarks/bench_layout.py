@@ -0,0 +1,71 @@
+"""
+Compare force-directed layout time and quality between nx.spring_layout and
+layouts.force_layout with exact and Barnes-Hut repulsion.
+
+Quality is reported as the mean length of an edge divided by the mean
+distance between two random nodes, so lower means linked nodes are drawn
+closer together.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_layout
+    python -m benchmarks.bench_layout --sizes 1000 100000 --networkx-max 2000
+"""
+import argparse
+
+import networkx as nx
+import numpy as np
+
+from benchmarks.synthetic import make_tables
+from benchmarks.timing import measure
+from graph_pipeline import build_graph
+from layouts import force_layout
+
+
+def edge_length_ratio(G, pos, pairs=10_000, seed=0):
+    """
+    Mean edge length over the mean distance between random pairs of nodes.
+    """
+    xy = {node: np.asarray(p) for node, p in pos.items()}
+    edge_length = np.mean([np.linalg.norm(xy[u] - xy[v]) for u, v in G.edges])
+
+    nodes = list(G)
+    rng = np.random.default_rng(seed)
+    a, b = rng.integers(len(nodes), size=(2, pairs))
+    points = np.array([xy[node] for node in nodes])
+    random_length = np.linalg.norm(points[a] - points[b], axis=1).mean()
+
+    return edge_length / random_length
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000],
+                        help="Node counts to benchmark")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--networkx-max", type=int, default=2_000,
+                        help="Largest graph to run nx.spring_layout on")
+    parser.add_argument("--exact-max", type=int, default=10_000,
+                        help="Largest graph to run exact repulsion on")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>8} {'edges':>8} {'implementation':>16} {'time (s)':>10} {'edge ratio':>11}")
+    for n_nodes in args.sizes:
+        nodes, edges = make_tables(n_nodes * 2, n_nodes=n_nodes)
+        G = build_graph(nodes, edges)
+
+        runs = [("barnes_hut", lambda: force_layout(G, iterations=args.iterations, method="barnes_hut"))]
+        if n_nodes <= args.exact_max:
+            runs.insert(0, ("exact", lambda: force_layout(G, iterations=args.iterations, method="exact")))
+        if n_nodes <= args.networkx_max:
+            runs.insert(0, ("nx.spring_layout", lambda: nx.spring_layout(G, iterations=args.iterations, seed=42)))
+
+        for name, func in runs:
+            pos, elapsed, _ = measure(func, memory=False)
+            print(f"{len(G):>8} {G.number_of_edges():>8} {name:>16} {elapsed:>10.3f} "
+                  f"{edge_length_ratio(G, pos):>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
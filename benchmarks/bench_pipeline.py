@@ -0,0 +1,239 @@
+"""
+Time every stage of the pages' pipelines on synthetic graphs of increasing
+size, reporting wall time and peak memory as a table and, optionally, JSON.
+
+The graphs come from benchmarks.synthetic, with heavy-tailed degrees and
+weights like got-s1-edges.csv. They are written to CSV and read back through
+data_ingest, so every later stage works on the same typed tables as the
+pages. Layouts are benchmarked separately (bench_layout), so the drawing
+stages place nodes at random.
+
+Stages slower than a few minutes at the largest sizes are skipped above the
+edge counts in STAGE_LIMITS. Raise or lift the limits with --limit and
+--no-limits.
+
+Runs headless, without a browser or a streamlit server. Run from the
+repository root:
+
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --sizes 1000 10000 --json results.json
+    python -m benchmarks.bench_pipeline --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import gravis as gv
+import networkx as nx
+import numpy as np
+import plotly.graph_objects as go
+
+from benchmarks.synthetic import make_tables
+from benchmarks.timing import measure
+from centrality import betweenness_pool, estimate_betweenness
+from communities import detect_communities
+from csr_graph import CSRGraph
+from data_ingest import read_edges, read_nodes
+from graph_filters import IncrementalThresholdFilter, WeightThresholdIndex, ego_network
+from graph_pipeline import add_total_interactions, build_graph
+from level_of_detail import reduce_graph, spatial_groups
+from plotly_traces import network_traces
+from raster import render_graph
+from static_render import render_network
+
+# Largest number of edges each stage is run on by default
+STAGE_LIMITS = {
+    "betweenness": 10_000,
+    "communities": 100_000,
+    "nx.cytoscape_data": 100_000,
+    "gravis HTML": 100_000,
+    "static image": 100_000,
+}
+
+
+def write_tables(nodes, edges, folder):
+    """
+    Write synthetic tables to CSV in the layout of the sample data.
+    """
+    edges_path = os.path.join(folder, "edges.csv")
+    nodes_path = os.path.join(folder, "nodes.csv")
+    edges.to_csv(edges_path, index=False)
+    nodes.rename(columns={"ID": "Id"}).to_csv(nodes_path, index=False)
+    return edges_path, nodes_path
+
+
+def run_pipeline(n_edges, folder, limits, memory=True, report=None):
+    """
+    Run every stage on a synthetic graph with n_edges edges, passing each
+    stage's row to report as it finishes.
+
+    Returns:
+    --------
+    list of dict
+        One row per stage, with the pages using it, the time and peak
+        memory, and the size of the output for serialisation stages
+    """
+    rows = []
+
+    def stage(name, pages, func, setup=None):
+        row = {"edges": n_edges, "stage": name, "pages": pages,
+               "seconds": None, "peak_mb": None, "output_mb": None, "skipped": False}
+        rows.append(row)
+        result = None
+        if n_edges > limits.get(name, np.inf):
+            row["skipped"] = True
+        else:
+            result, row["seconds"], row["peak_mb"] = measure(func, setup, memory)
+            if isinstance(result, (str, bytes)):
+                row["output_mb"] = len(result) / 1024 ** 2
+        if report:
+            report(row)
+        return result
+
+    edges_path, nodes_path = write_tables(*make_tables(n_edges), folder)
+    warm_cache = os.path.join(folder, "warm")
+    read_edges(edges_path, warm_cache), read_nodes(nodes_path, warm_cache)
+
+    stage("read CSV", "4, 5",
+          lambda cache: (read_edges(edges_path, cache), read_nodes(nodes_path, cache)),
+          setup=lambda: (tempfile.mkdtemp(dir=folder),))
+    edges, nodes = stage("read Feather cache", "4, 5",
+                         lambda: (read_edges(edges_path, warm_cache), read_nodes(nodes_path, warm_cache)))
+    nodes = stage("total interactions", "4, 5", lambda: add_total_interactions(nodes, edges))
+    G = stage("build graph", "1-5",
+              lambda: build_graph(nodes, edges, node_attributes=("Label", "TotalInteractions")))
+
+    stage("betweenness", "4, 5", lambda: estimate_betweenness(G, pool=betweenness_pool()))
+    stage("communities", "4, 5", lambda: detect_communities(G))
+
+    # The lowest weight is 2, so these thresholds drop the lightest links and
+    # the less active half of the nodes, as a user moving the sliders would
+    weight_threshold = 3
+    node_threshold = float(nodes["TotalInteractions"].median())
+    index = stage("threshold index", "4, 5", lambda: WeightThresholdIndex(G))
+    G_filtered = stage("threshold filter", "4, 5",
+                       lambda: IncrementalThresholdFilter(index).update(weight_threshold, node_threshold))
+
+    def filter_at_threshold():
+        threshold_filter = IncrementalThresholdFilter(index)
+        threshold_filter.update(weight_threshold, node_threshold)
+        return (threshold_filter,)
+
+    stage("threshold slider step", "4, 5",
+          lambda threshold_filter: threshold_filter.update(weight_threshold + 1, node_threshold),
+          setup=filter_at_threshold)
+
+    hub = max(G.degree, key=lambda item: item[1])[0]
+    stage("ego network, radius 1", "4", lambda: ego_network(G, hub, 1))
+    stage("ego network, radius 2", "4", lambda: ego_network(G, hub, 2))
+
+    stage("CSR metrics", "4", lambda: CSRGraph.from_tables(nodes, edges).metrics())
+
+    rng = np.random.default_rng(0)
+    pos = dict(zip(G, rng.uniform(size=(len(G), 2))))
+
+    view = stage("level of detail", "4", lambda: reduce_graph(G_filtered))
+    stage("cytoscape elements", "4", lambda: json.dumps(nx.cytoscape_data(view)))
+    stage("nx.cytoscape_data", "3", lambda: json.dumps(nx.cytoscape_data(G)))
+
+    plotly_view = reduce_graph(G, max_edges=5_000, max_nodes=20_000, groups=spatial_groups(pos))
+    stage("plotly figure", "2",
+          lambda: go.Figure(data=list(network_traces(plotly_view, pos))).to_json())
+    stage("gravis HTML", "5",
+          lambda: gv.d3(G_filtered, graph_height=800, node_hover_neighborhood=True,
+                        edge_size_data_source="Weight", use_node_size_normalization=True,
+                        node_size_factor=0.1).to_html())
+    stage("static image", "1", lambda: render_network(G, pos))
+    stage("raster image", "1", lambda: render_graph(G, pos))
+
+    return rows
+
+
+def environment():
+    """
+    Versions and hardware the results were measured on.
+    """
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "networkx": nx.__version__}
+
+
+def baseline_times(baseline):
+    """
+    Time of each stage at each size in the JSON results of an earlier run.
+    """
+    return {(row["edges"], row["stage"]): row["seconds"] for row in baseline["results"]}
+
+
+def print_row(row):
+    def number(value, width, digits):
+        return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+    print(f"{row['edges']:>9} {row['stage']:>22} {row['pages']:>6} "
+          + (f"{'skipped':>10}" if row["skipped"] else number(row["seconds"], 10, 3))
+          + f" {number(row['peak_mb'], 10, 1)} {number(row['output_mb'], 11, 2)}"
+          + (f" {number(row['vs_baseline'], 10, 2)}" if "vs_baseline" in row else ""), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000, 1_000_000],
+                        help="Edge counts to benchmark")
+    parser.add_argument("--limit", nargs="+", default=[], metavar="STAGE=EDGES",
+                        help="Change the largest graph a stage is run on, e.g. 'gravis HTML=1000000'")
+    parser.add_argument("--no-limits", action="store_true", help="Run every stage at every size")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip measuring peak memory, which runs every stage a second time")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare times against")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="With --compare, exit with an error if a stage is this many times slower")
+    parser.add_argument("--min-seconds", type=float, default=0.01,
+                        help="With --compare, ignore stages faster than this, as timer noise dominates them")
+    args = parser.parse_args()
+
+    limits = {} if args.no_limits else dict(STAGE_LIMITS)
+    for item in args.limit:
+        name, _, edges = item.rpartition("=")
+        limits[name] = int(edges)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = baseline_times(json.load(f))
+
+    def report(row):
+        if previous is not None:
+            before = previous.get((row["edges"], row["stage"]))
+            row["vs_baseline"] = row["seconds"] / before if row["seconds"] and before else None
+        print_row(row)
+
+    print(f"{'edges':>9} {'stage':>22} {'pages':>6} {'time (s)':>10} {'peak (MB)':>10} {'output (MB)':>11}"
+          + (f" {'vs before':>10}" if previous is not None else ""), flush=True)
+    results = []
+    for n_edges in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            results.extend(run_pipeline(n_edges, folder, limits, not args.no_memory, report))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment(), "limits": limits, "results": results}, f, indent=1)
+
+    if previous is not None:
+        regressions = [row for row in results
+                       if (row["vs_baseline"] or 0) > args.tolerance and row["seconds"] >= args.min_seconds]
+        for row in regressions:
+            print(f"Regression: {row['stage']} at {row['edges']:,} edges took {row['vs_baseline']:.2f}x "
+                  f"as long as before", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare the time to build plotly network traces between the original page 2
+loops and plotly_traces.network_traces, and the size of the figure sent to
+the browser.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_plotly_traces
+    python -m benchmarks.bench_plotly_traces --sizes 1000 100000
+"""
+import argparse
+
+import networkx as nx
+import numpy as np
+import plotly.graph_objects as go
+
+from benchmarks.synthetic import make_tables
+from benchmarks.timing import measure
+from graph_pipeline import build_graph
+from plotly_traces import network_traces
+
+
+def legacy_traces(G):
+    """
+    Traces built as page 2 built them before plotly_traces.
+    """
+    edge_x = []
+    edge_y = []
+    for edge in G.edges():
+        x0, y0 = G.nodes[edge[0]]['pos']
+        x1, y1 = G.nodes[edge[1]]['pos']
+        edge_x.append(x0)
+        edge_x.append(x1)
+        edge_x.append(None)
+        edge_y.append(y0)
+        edge_y.append(y1)
+        edge_y.append(None)
+
+    edge_trace = go.Scatter(
+        x=edge_x, y=edge_y,
+        line=dict(width=0.5, color='#888'),
+        hoverinfo='none',
+        mode='lines')
+
+    node_x = []
+    node_y = []
+    for node in G.nodes():
+        x, y = G.nodes[node]['pos']
+        node_x.append(x)
+        node_y.append(y)
+
+    node_trace = go.Scatter(
+        x=node_x, y=node_y,
+        mode='markers',
+        hoverinfo='text',
+        marker=dict(color=[], size=10))
+
+    node_adjacencies = []
+    node_text = []
+    for node, adjacencies in enumerate(G.adjacency()):
+        node_adjacencies.append(len(adjacencies[1]))
+        node_text.append('# of connections: '+str(len(adjacencies[1])))
+
+    node_trace.marker.color = node_adjacencies
+    node_trace.text = node_text
+
+    return edge_trace, node_trace
+
+
+def vectorised_traces(G):
+    return network_traces(G, node_marker=dict(size=10))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000, 1_000_000],
+                        help="Edge counts to benchmark")
+    args = parser.parse_args()
+
+    print(f"{'edges':>10} {'implementation':>15} {'trace':>8} {'build (s)':>10} {'to_json (s)':>12} {'JSON (MB)':>10}")
+    for n_edges in args.sizes:
+        nodes, edges = make_tables(n_edges)
+        G = build_graph(nodes, edges)
+        rng = np.random.default_rng(0)
+        nx.set_node_attributes(G, dict(zip(G, rng.uniform(size=(len(G), 2)).tolist())), 'pos')
+
+        for name, func in [("legacy", legacy_traces),
+                           ("network_traces", vectorised_traces)]:
+            traces, built, _ = measure(func, lambda: (G,), memory=False)
+            spec, serialised, _ = measure(lambda: go.Figure(data=list(traces)).to_json(), memory=False)
+
+            print(f"{G.number_of_edges():>10} {name:>15} {type(traces[0]).__name__:>8} {built:>10.3f} "
+                  f"{serialised:>12.3f} {len(spec) / 1024 ** 2:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
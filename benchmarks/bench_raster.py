@@ -0,0 +1,72 @@
+"""
+Compare the time to render a graph to an image between nx.draw on a
+matplotlib figure and raster.rasterize.
+
+Nodes are placed at random, so edges cross the whole canvas. This is the
+worst case for rasterize, whose time grows with the total length of the
+edges up to raster.MAX_EDGE_SAMPLES.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_raster
+    python -m benchmarks.bench_raster --sizes 10000 5000000 --matplotlib-max 10000
+"""
+import argparse
+import io
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+
+from benchmarks.synthetic import make_tables
+from benchmarks.timing import measure
+from csr_graph import CSRGraph
+from raster import rasterize
+
+
+def matplotlib_render(sources, targets, xy):
+    """
+    PNG of the graph drawn with nx.draw, as page 1 drew it.
+    """
+    G = nx.Graph()
+    G.add_nodes_from(range(len(xy)))
+    G.add_edges_from(zip(sources.tolist(), targets.tolist()))
+    fig, ax = plt.subplots(figsize=(8, 8), dpi=100)
+    nx.draw(G, dict(enumerate(xy)), ax=ax, node_size=2)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000, 5_000_000],
+                        help="Edge counts to benchmark")
+    parser.add_argument("--matplotlib-max", type=int, default=100_000,
+                        help="Largest graph to draw with matplotlib")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>9} {'edges':>9} {'implementation':>15} {'time (s)':>10}")
+    for n_edges in args.sizes:
+        nodes, edges = make_tables(n_edges)
+        sources, targets, weights = CSRGraph.from_tables(nodes, edges).edge_arrays()
+        xy = np.random.default_rng(0).uniform(size=(len(nodes), 2))
+        colors = np.array(["#fbf59a", "#674ea7", "#72a45d", "#f2600b", "#2986cc"],
+                          dtype=object)[np.arange(len(nodes)) % 5]
+
+        runs = [("raster", lambda: rasterize(xy, sources, targets, colors)),
+                ("raster weight", lambda: rasterize(xy, sources, targets, colors, edge_weights=weights))]
+        if n_edges <= args.matplotlib_max:
+            runs.insert(0, ("nx.draw", lambda: matplotlib_render(sources, targets, xy)))
+
+        for name, func in runs:
+            _, elapsed, _ = measure(func, memory=False)
+            print(f"{len(nodes):>9} {len(sources):>9} {name:>15} {elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
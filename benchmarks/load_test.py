@@ -0,0 +1,291 @@
+"""
+Load test the pages with concurrent simulated sessions, reporting rerun
+latency, throughput and the server's memory.
+
+Each session is a streamlit AppTest running the page script in this process,
+so sessions share the process-wide caches just as they do on a server. A
+session loads its page and then makes random interactions: dragging the
+filter sliders of pages 4 and 5 a step at a time, choosing characters on
+page 4, and plain reruns on the other pages. Every widget change reruns the
+whole script: AppTest doesn't rerun fragments on their own, so the slider
+reruns of pages 4 and 5 are timed as they would be without fragments.
+
+Latency is the wall time of each rerun as seen by the session, so it
+includes waiting on other sessions. Script time is the page's own total from
+instrumentation_panel. Memory is the resident set size of the process,
+sampled throughout, and the number of figures left open in pyplot's
+registry is reported to catch figures that are never closed.
+
+The browser isn't simulated, so the time taken to send elements to the
+browser and draw them isn't included. Run from the repository root:
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --pages 5 --sessions 8 --interactions 50 --json load.json
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+# AppTest resolves relative paths against the file calling it
+PAGES = {number: path for number, path in
+         ((int(os.path.basename(path).split("_")[0]), path) for path in glob.glob(os.path.abspath("pages/*.py")))}
+
+
+def rss_mb():
+    """
+    Current resident set size of this process in MB, or the peak so far
+    where the current size isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        # ru_maxrss is in bytes on macOS and KB elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class MemorySampler(threading.Thread):
+    """
+    Sample the process's RSS in the background until stopped.
+    """
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = [rss_mb()]
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.samples.append(rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append(rss_mb())
+
+
+def open_pyplot_figures():
+    """
+    Number of figures open in pyplot, or None if no page has imported it.
+    """
+    if "matplotlib.pyplot" not in sys.modules:
+        return None
+    return len(sys.modules["matplotlib.pyplot"].get_fignums())
+
+
+def widget(widgets, label):
+    """
+    The widget whose label starts with label.
+    """
+    return next(w for w in widgets if w.label.startswith(label))
+
+
+class Session:
+    """
+    One simulated user of a page.
+
+    Parameters:
+    ----------
+    path: str
+        Page script
+    timeout: float
+        Seconds to wait for a rerun before failing it
+    seed: int
+    """
+
+    def __init__(self, path, timeout, seed):
+        self.at = AppTest.from_file(path, default_timeout=timeout)
+        self.rng = np.random.default_rng(seed)
+        self.latencies = []
+        self.script_seconds = []
+        self.errors = []
+
+    def rerun(self, change=None):
+        """
+        Apply a widget change, if given, and rerun the page.
+
+        Returns:
+        --------
+        float
+            Wall time of the rerun in seconds
+        """
+        start = time.perf_counter()
+        try:
+            if change is not None:
+                change(self.at)
+            self.at.run()
+        except Exception as error:  # A timeout or a widget that wasn't found
+            self.errors.append(f"{type(error).__name__}: {error}")
+        elapsed = time.perf_counter() - start
+
+        if self.at.exception:
+            self.errors.append(self.at.exception[0].message)
+        elif "instrumentation_last_run" in self.at.session_state:
+            self.script_seconds.append(self.at.session_state["instrumentation_last_run"]["total_seconds"])
+        return elapsed
+
+    def drag(self, label, max_steps=5):
+        """
+        Drag a slider a few steps one way, rerunning at every step.
+        """
+        slider = widget(self.at.slider, label)
+        direction = self.rng.choice([-1, 1])
+        for _ in range(self.rng.integers(1, max_steps + 1)):
+            value = int(np.clip(slider.value + direction * slider.step, slider.min, slider.max))
+            self.latencies.append(self.rerun(lambda at: widget(at.slider, label).set_value(value)))
+            slider = widget(self.at.slider, label)
+
+    def select(self, label, top=20):
+        """
+        Choose one of the first options of a select box.
+        """
+        n_options = len(widget(self.at.selectbox, label).options)
+        index = int(self.rng.integers(min(top, n_options)))
+        self.latencies.append(self.rerun(lambda at: widget(at.selectbox, label).select_index(index)))
+
+    def refresh(self):
+        self.latencies.append(self.rerun())
+
+
+# Interactions for each page, chosen between at random. Pages not listed
+# are just rerun.
+INTERACTIONS = {
+    4: [lambda s: s.drag("Filter out edges"),
+        lambda s: s.drag("Filter out characters"),
+        lambda s: s.select("Select characters"),
+        lambda s: s.drag("Only follow links")],
+    5: [lambda s: s.drag("Filter out edges"),
+        lambda s: s.drag("Filter out characters")],
+}
+
+
+def simulate(path, interactions, n_interactions, timeout, seed):
+    """
+    Load a page and make n_interactions random interactions with it.
+
+    Returns:
+    --------
+    Session
+    """
+    session = Session(path, timeout, seed)
+    session.first_load = session.rerun()
+    for _ in range(n_interactions):
+        interactions[session.rng.integers(len(interactions))](session)
+    return session
+
+
+def percentiles(values):
+    values = np.asarray(values) * 1000
+    if not len(values):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+def load_test(page, n_sessions, n_interactions, timeout=120, warm=True):
+    """
+    Run n_sessions simulated sessions of a page at once.
+
+    Parameters:
+    ----------
+    page: int
+        Page number
+    n_sessions: int
+    n_interactions: int
+        Interactions per session. A slider drag counts once however many
+        reruns it makes.
+    timeout: float
+        Seconds to wait for a rerun
+    warm: bool
+        Load the page once before starting, so the process-wide caches are
+        filled as they would be on a server that has been up for a while
+
+    Returns:
+    --------
+    dict
+    """
+    path = PAGES[page]
+    interactions = INTERACTIONS.get(page, [Session.refresh])
+    if warm:
+        Session(path, timeout, seed=0).rerun()
+
+    sampler = MemorySampler()
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_sessions) as pool:
+        sessions = list(pool.map(lambda seed: simulate(path, interactions, n_interactions, timeout, seed),
+                                 range(1, n_sessions + 1)))
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    latencies = [latency for session in sessions for latency in session.latencies]
+    errors = [error for session in sessions for error in session.errors]
+    return {"page": page,
+            "sessions": n_sessions,
+            "reruns": len(latencies),
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            **percentiles(latencies),
+            "first_load_p50_ms": percentiles([session.first_load for session in sessions])["p50_ms"],
+            "script_p50_ms": percentiles([s for session in sessions for s in session.script_seconds])["p50_ms"],
+            "reruns_per_second": len(latencies) / elapsed,
+            "rss_start_mb": sampler.samples[0],
+            "rss_peak_mb": max(sampler.samples),
+            "rss_end_mb": sampler.samples[-1],
+            "pyplot_figures": open_pyplot_figures()}
+
+
+def print_result(result):
+    def number(value, width, digits=0):
+        return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+    print(f"{result['page']:>4} {result['sessions']:>8} {result['reruns']:>6} {result['errors']:>6} "
+          f"{number(result['p50_ms'], 8)} {number(result['p95_ms'], 8)} {number(result['p99_ms'], 8)} "
+          f"{number(result['script_p50_ms'], 10)} {number(result['reruns_per_second'], 9, 1)} "
+          f"{number(result['rss_start_mb'], 9)} {number(result['rss_peak_mb'], 9)} {number(result['rss_end_mb'], 9)} "
+          f"{result['pyplot_figures'] if result['pyplot_figures'] is not None else '-':>7}", flush=True)
+    if result["first_error"]:
+        print(f"     first error: {result['first_error']}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[4, 5], choices=sorted(PAGES),
+                        help="Page numbers to test")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16],
+                        help="Numbers of concurrent sessions to test")
+    parser.add_argument("--interactions", type=int, default=10, help="Interactions per session")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for a rerun")
+    parser.add_argument("--cold", action="store_true",
+                        help="Don't load each page before timing, so the first sessions fill the caches")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{'page':>4} {'sessions':>8} {'reruns':>6} {'errors':>6} {'p50 (ms)':>8} {'p95 (ms)':>8} "
+          f"{'p99 (ms)':>8} {'script p50':>10} {'reruns/s':>9} {'RSS (MB)':>9} {'peak':>9} {'end':>9} "
+          f"{'figures':>7}", flush=True)
+    results = []
+    for page in args.pages:
+        for n_sessions in args.sessions:
+            result = load_test(page, n_sessions, args.interactions, args.timeout, warm=not args.cold)
+            print_result(result)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "interactions": args.interactions, "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
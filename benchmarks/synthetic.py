@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+
+def make_tables(n_edges, n_nodes=None, seed=42):
+    """
+    Generate synthetic node and edge tables shaped like the Game of Thrones
+    sample data.
+
+    Node popularity follows a power law, so a handful of nodes have very high
+    degree, and weights are heavy tailed with a minimum of 2 (as in
+    got-s1-edges.csv). Each pair of nodes appears at most once.
+
+    Parameters:
+    ----------
+    n_edges: int
+        Number of edges to generate
+    n_nodes: int
+        Number of nodes. Defaults to a quarter of the number of edges.
+    seed: int
+        Seed for the random number generator
+
+    Returns:
+    --------
+    tuple of (pd.DataFrame, pd.DataFrame)
+        The node table (ID, Label) and edge table (Source, Target, Weight, Season)
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = n_nodes or max(10, n_edges // 4)
+
+    popularity = 1 / np.arange(1, n_nodes + 1) ** 0.8
+    popularity = popularity / popularity.sum()
+
+    # Oversample so there are still enough edges once self loops and repeated
+    # pairs are dropped
+    n_draws = int(n_edges * 1.5) + 10
+    source = rng.choice(n_nodes, n_draws, p=popularity)
+    target = rng.choice(n_nodes, n_draws, p=popularity)
+
+    pairs = pd.DataFrame({"a": np.minimum(source, target),
+                          "b": np.maximum(source, target)})
+    pairs = pairs[pairs["a"] != pairs["b"]].drop_duplicates().head(n_edges)
+
+    weights = np.minimum(rng.zipf(1.7, len(pairs)) + 1, 1000)
+
+    ids = np.array([f"NODE_{i}" for i in range(n_nodes)], dtype=object)
+
+    nodes = pd.DataFrame({"ID": ids,
+                          "Label": [f"Node {i}" for i in range(n_nodes)]})
+    edges = pd.DataFrame({"Source": ids[pairs["a"].to_numpy()],
+                          "Target": ids[pairs["b"].to_numpy()],
+                          "Weight": weights,
+                          "Season": 1})
+
+    return nodes, edges
@@ -0,0 +1,44 @@
+import gc
+import time
+import tracemalloc
+
+
+def measure(func, setup=None, memory=True):
+    """
+    Call func and return its result, wall time in seconds, and peak traced
+    memory in MB (None if memory is False).
+
+    Timing and memory are measured in separate calls, as tracemalloc slows
+    down allocation-heavy code considerably. setup is called before each
+    call, untimed, to give func fresh arguments when it changes them.
+
+    Parameters:
+    ----------
+    func: callable
+        Called with the arguments setup returns, or none
+    setup: callable
+        Returns a tuple of arguments for func
+    memory: bool
+        Whether to make a second call to measure the peak memory
+
+    Returns:
+    --------
+    tuple of (object, float, float)
+        The result of the timed call, its wall time and the peak memory
+    """
+    args = setup() if setup else ()
+    gc.collect()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        args = setup() if setup else ()
+        gc.collect()
+        tracemalloc.start()
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    return result, elapsed, peak
@@ -0,0 +1,284 @@
+import random
+
+import networkx as nx
+import numpy as np
+import streamlit as st
+
+from background_jobs import background_result, release_job
+from instrumentation import timed
+from parallel_centrality import betweenness_batches, parallel_betweenness_centrality, worker_pool
+from result_cache import ResultCache
+
+CENTRALITY_CACHE_MB = 64
+
+# Graphs larger than either of these use sampled betweenness in "auto" mode
+APPROXIMATE_NODE_THRESHOLD = 5_000
+APPROXIMATE_EDGE_THRESHOLD = 50_000
+
+BETWEENNESS_SEED = 42
+
+# Sampled betweenness is estimated from this many batches of pivots, each of
+# at least two so their spread gives a standard error
+BETWEENNESS_BATCHES = 4
+MIN_SAMPLE_SIZE = 2 * BETWEENNESS_BATCHES
+
+
+@st.cache_resource(show_spinner=False)
+def centrality_cache():
+    """
+    Return the process-wide cache of centrality results, shared by every
+    session and page.
+
+    Returns:
+    --------
+    ResultCache
+    """
+    return ResultCache(max_bytes=CENTRALITY_CACHE_MB * 1024 ** 2)
+
+
+@st.cache_resource(show_spinner=False)
+def betweenness_pool():
+    """
+    Return the process-wide pool of betweenness worker processes, started
+    once and shared by every session, or None if only one CPU is available.
+
+    Returns:
+    --------
+    parallel_centrality.WorkerPool
+    """
+    return worker_pool()
+
+
+def should_approximate(G):
+    """
+    Whether a graph is large enough for "auto" mode to sample betweenness.
+    """
+    return (G.number_of_nodes() > APPROXIMATE_NODE_THRESHOLD
+            or G.number_of_edges() > APPROXIMATE_EDGE_THRESHOLD)
+
+
+def auto_sample_size(G):
+    """
+    Choose how many source nodes to sample when approximating betweenness.
+
+    Grows with the square root of the number of nodes, which keeps the
+    standard error of the larger scores to a few percent on typical networks
+    while the cost stays well below the exact calculation.
+    """
+    n = G.number_of_nodes()
+    return min(n, max(100, int(10 * np.sqrt(n))))
+
+
+@timed("estimate betweenness")
+def estimate_betweenness(G, mode="auto", k=None, seed=BETWEENNESS_SEED, batches=BETWEENNESS_BATCHES, pool=None):
+    """
+    Betweenness centrality of every node, exact or estimated from a sample of
+    source nodes (pivots).
+
+    The sampled estimate is the mean of several independent batches of
+    pivots, which gives the standard error of each node's score from the
+    spread between the batches at no extra cost.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    mode: str
+        "exact", "approximate", or "auto" to approximate only graphs above
+        APPROXIMATE_NODE_THRESHOLD nodes or APPROXIMATE_EDGE_THRESHOLD edges
+    k: int
+        Number of pivots to sample. Defaults to auto_sample_size(G).
+    seed: int
+        Seed for the pivot sampling, so repeated runs give the same result
+    batches: int
+        Number of batches the pivots are split into for the error estimate.
+        Every batch is sent to the pool at once.
+    pool: parallel_centrality.WorkerPool
+        Worker processes to spread the calculation over, usually
+        betweenness_pool(). None calculates it in this thread.
+
+    Returns:
+    --------
+    tuple of (dict, dict)
+        Node to betweenness centrality, and details of how it was calculated:
+        approximate (bool), sample_size, and max_standard_error and
+        mean_standard_error across nodes (NaN if there were too few pivots)
+    """
+    approximate = mode == "approximate" or (mode == "auto" and should_approximate(G))
+    n = G.number_of_nodes()
+    k = k or auto_sample_size(G)
+
+    if not approximate or k >= n:
+        return parallel_betweenness_centrality(G, pool=pool), {"approximate": False, "sample_size": n,
+                                              "max_standard_error": 0.0,
+                                              "mean_standard_error": 0.0}
+
+    batches = max(1, min(batches, k // 2))
+    batch_sizes = [k // batches + (1 if i < k % batches else 0) for i in range(batches)]
+
+    nodes = list(G.nodes)
+    # Sampled the same way as nx.betweenness_centrality(G, k=size, seed=seed + i)
+    samples = [random.Random(seed + i).sample(nodes, size) for i, size in enumerate(batch_sizes)]
+    estimates = np.array([[values[node] for node in nodes]
+                          for values in betweenness_batches(G, samples, pool=pool)])
+
+    # Weight each batch by its size so the mean matches a single k-pivot run
+    mean = np.average(estimates, axis=0, weights=batch_sizes)
+    if batches > 1:
+        standard_error = estimates.std(axis=0, ddof=1) / np.sqrt(batches)
+        max_error, mean_error = float(standard_error.max()), float(standard_error.mean())
+    else:
+        max_error = mean_error = float("nan")
+
+    return dict(zip(nodes, mean.tolist())), {"approximate": True, "sample_size": k,
+                                            "max_standard_error": max_error,
+                                            "mean_standard_error": mean_error}
+
+
+def betweenness_task(G, key, mode="auto", k=None, seed=BETWEENNESS_SEED):
+    """
+    A function returning betweenness_centrality_with_error(G, key, ...), for
+    a background job to call.
+
+    The centrality cache and worker pool are looked up here, so call this
+    from the script thread. The returned function uses no streamlit caches
+    and can run in any thread.
+
+    Returns:
+    --------
+    callable
+        Called with no arguments, returns a tuple of (dict, dict) - see
+        estimate_betweenness
+    """
+    cache, pool = centrality_cache(), betweenness_pool()
+    cache_key = ("betweenness", mode, k, seed) + tuple(key)
+    return lambda: cache.get_or_compute(cache_key, lambda: estimate_betweenness(G, mode, k, seed, pool=pool))
+
+
+@timed("betweenness")
+def betweenness_centrality_with_error(G, key, mode="auto", k=None, seed=BETWEENNESS_SEED):
+    """
+    Betweenness centrality of every node with details of any approximation,
+    cached under key.
+
+    The key must identify the graph exactly, for example the dataset's
+    graph_key together with the filter settings that produced G. The
+    returned dicts are shared between sessions and must not be modified.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    key: tuple
+        Hashable key identifying G
+    mode, k, seed:
+        See estimate_betweenness
+
+    Returns:
+    --------
+    tuple of (dict, dict)
+        See estimate_betweenness
+    """
+    return betweenness_task(G, key, mode, k, seed)()
+
+
+def betweenness_centrality(G, key, mode="auto", k=None, seed=BETWEENNESS_SEED):
+    """
+    Betweenness centrality of every node, cached under key.
+
+    See betweenness_centrality_with_error.
+
+    Returns:
+    --------
+    dict
+        Node to betweenness centrality
+    """
+    return betweenness_centrality_with_error(G, key, mode, k, seed)[0]
+
+
+def background_betweenness(G, key, group, mode="auto", k=None, seed=BETWEENNESS_SEED):
+    """
+    Betweenness centrality with details of any approximation if it is
+    cached, otherwise calculated in the background.
+
+    The background job works on a copy of G unless it is frozen, as the
+    session's filtered graphs are changed in place when a slider moves.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    key: tuple
+        Hashable key identifying G
+    group: str
+        What the values are for on the page - see
+        background_jobs.background_result
+    mode, k, seed:
+        See estimate_betweenness
+
+    Returns:
+    --------
+    tuple of (dict, dict)
+        See estimate_betweenness, or None while the values are calculated
+    """
+    cache_key = ("betweenness", mode, k, seed) + tuple(key)
+    if cache_key in centrality_cache():
+        release_job(group)
+        return betweenness_centrality_with_error(G, key, mode, k, seed)
+
+    snapshot = G if nx.is_frozen(G) else G.copy()
+    return background_result(group, cache_key, betweenness_task(snapshot, key, mode, k, seed))
+
+
+def betweenness_settings():
+    """
+    Add sidebar controls for how betweenness is calculated.
+
+    Returns:
+    --------
+    dict
+        mode and k, to pass on to betweenness_centrality
+    """
+    with st.sidebar.expander("Betweenness calculation"):
+        mode = st.radio("Method", ["auto", "exact", "approximate"], horizontal=True,
+                        help=f"Auto samples betweenness for graphs with more than {APPROXIMATE_NODE_THRESHOLD:,} nodes "
+                             f"or {APPROXIMATE_EDGE_THRESHOLD:,} edges.")
+        k = st.number_input("Number of sampled source nodes (leave empty to choose automatically)",
+                            min_value=MIN_SAMPLE_SIZE, value=None, step=50)
+    return {"mode": mode, "k": int(k) if k is not None else None}
+
+
+def describe_approximation(info):
+    """
+    Describe an approximate betweenness calculation for display on the page.
+
+    Parameters:
+    ----------
+    info: dict
+        Details returned alongside the betweenness values
+
+    Returns:
+    --------
+    str
+        Empty if the values are exact. The standard error is left out if
+        there were too few pivots to estimate it.
+    """
+    if not info["approximate"]:
+        return ""
+    description = f"Node sizes use betweenness estimated from {info['sample_size']:,} sampled source nodes."
+    if np.isnan(info["mean_standard_error"]):
+        return description
+    return (f"{description} Standard error: {info['mean_standard_error']:.4f} on average, "
+            f"at most {info['max_standard_error']:.4f}.")
+
+
+def show_cache_stats():
+    """
+    Show the centrality cache's hit and miss counts in a sidebar expander.
+    """
+    stats = centrality_cache().stats()
+    with st.sidebar.expander("Centrality cache"):
+        st.markdown(f"""
+            {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)
+
+            {stats['entries']} results cached, using {stats['size_mb']:.1f} of {stats['max_size_mb']:.0f} MB
+
+            {stats['evictions']} results evicted
+            """)
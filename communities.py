@@ -0,0 +1,290 @@
+import colorsys
+
+import networkx as nx
+import numpy as np
+import streamlit as st
+
+from instrumentation import timed
+from result_cache import ResultCache
+
+COMMUNITY_SEED = 42
+
+COMMUNITY_CACHE_MB = 64
+
+# "auto" switches from greedy modularity to Louvain above this many nodes
+LOUVAIN_NODE_THRESHOLD = 5_000
+
+ALGORITHMS = {
+    "greedy_modularity": "Clauset-Newman-Moore greedy modularity maximisation",
+    "louvain": "Louvain modularity maximisation",
+    "label_propagation": "asynchronous label propagation",
+}
+
+# The original five community colours, used first so small graphs look as
+# they always have
+BASE_PALETTE = ["#fbf59a", "#674ea7", "#72a45d", "#f2600b", "#2986cc"]
+
+
+def choose_algorithm(G, algorithm="auto"):
+    """
+    Resolve "auto" to a community detection algorithm suited to the graph's
+    size. Any other name is returned unchanged.
+    """
+    if algorithm != "auto":
+        return algorithm
+    return "louvain" if G.number_of_nodes() > LOUVAIN_NODE_THRESHOLD else "greedy_modularity"
+
+
+@timed("detect communities")
+def detect_communities(G, algorithm="auto", seed=COMMUNITY_SEED):
+    """
+    Split a graph into communities.
+
+    Edge weights are ignored, as in the original greedy modularity
+    calculation. Louvain and label propagation are much faster than greedy
+    modularity on large graphs, and are seeded so they give the same
+    communities every time.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    algorithm: str
+        One of ALGORITHMS, or "auto" - see choose_algorithm
+    seed: int
+        Seed for the randomised algorithms
+
+    Returns:
+    --------
+    list of frozenset
+        Communities, largest first
+    """
+    algorithm = choose_algorithm(G, algorithm)
+    if algorithm == "greedy_modularity":
+        communities = nx.community.greedy_modularity_communities(G)
+    elif algorithm == "louvain":
+        communities = nx.community.louvain_communities(G, weight=None, seed=seed)
+    elif algorithm == "label_propagation":
+        communities = nx.community.asyn_lpa_communities(G, weight=None, seed=seed)
+    else:
+        raise ValueError(f"Unknown community detection algorithm '{algorithm}'. "
+                         f"Choose from {', '.join(ALGORITHMS)} or auto.")
+
+    return sorted((frozenset(c) for c in communities), key=len, reverse=True)
+
+
+@st.cache_resource(show_spinner=False)
+def community_cache():
+    """
+    Return the process-wide cache of detected communities, shared by every
+    session and page.
+
+    Returns:
+    --------
+    ResultCache
+    """
+    return ResultCache(max_bytes=COMMUNITY_CACHE_MB * 1024 ** 2)
+
+
+def communities_task(G, algorithm="auto", seed=COMMUNITY_SEED):
+    """
+    A function returning load_communities(G, algorithm, seed), for a
+    background job to call.
+
+    The community cache is looked up here, so call this from the script
+    thread. The returned function uses no streamlit caches and can run in
+    any thread.
+
+    Returns:
+    --------
+    callable
+        Called with no arguments, returns a list of frozenset
+    """
+    cache = community_cache()
+    algorithm = choose_algorithm(G, algorithm)
+    return lambda: cache.get_or_compute(("communities", G.graph["dataset_hash"], algorithm, seed),
+                                        lambda: detect_communities(G, algorithm, seed))
+
+
+def load_communities(G, algorithm="auto", seed=COMMUNITY_SEED):
+    """
+    Communities of a graph from graph_pipeline, detected once for each
+    algorithm and kept in community_cache.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph carrying a graph_pipeline.graph_key
+    algorithm, seed:
+        See detect_communities
+
+    Returns:
+    --------
+    list of frozenset
+    """
+    return communities_task(G, algorithm, seed)()
+
+
+def community_labels(nodes, communities):
+    """
+    Community number of each node, as an array aligned with nodes.
+
+    Parameters:
+    ----------
+    nodes: list
+        Nodes in the order the labels should be returned
+    communities: list of sets
+        Communities, numbered by their position in the list
+
+    Returns:
+    --------
+    np.ndarray of int
+        -1 for any node that isn't in a community
+    """
+    community_of = {node: i for i, members in enumerate(communities) for node in members}
+    return np.fromiter((community_of.get(node, -1) for node in nodes),
+                       dtype=np.int64, count=len(nodes))
+
+
+class CommunityIndex:
+    """
+    Lookups between nodes and their communities, built once alongside the
+    communities so that filtered views of the graph can be grouped by
+    community without searching the node list.
+
+    Parameters:
+    ----------
+    nodes: list
+        Every node of the graph
+    communities: list of sets
+        Communities, numbered by their position in the list
+
+    Attributes:
+    ----------
+    nodes: np.ndarray
+        The nodes, in the order given
+    labels: np.ndarray of int
+        Community number of each node, aligned with nodes (-1 for none)
+    members: list of np.ndarray
+        The nodes in each community
+    """
+
+    def __init__(self, nodes, communities):
+        self.nodes = np.empty(len(nodes), dtype=object)
+        self.nodes[:] = list(nodes)
+        self.labels = community_labels(self.nodes.tolist(), communities)
+        self._member_sets = [frozenset(members) for members in communities]
+        self.members = [np.array(list(members), dtype=object) for members in self._member_sets]
+        self._position = {node: i for i, node in enumerate(self.nodes.tolist())}
+
+    def __len__(self):
+        return len(self.members)
+
+    def community_of(self, node):
+        """
+        Community number of a node, -1 if it isn't in a community.
+        """
+        return int(self.labels[self._position[node]])
+
+    def clusters(self, nodes):
+        """
+        Members of each community that are among the given nodes, for
+        example the nodes left in a filtered graph.
+
+        Parameters:
+        ----------
+        nodes: iterable
+            Nodes to keep, e.g. a filtered nx.Graph
+
+        Returns:
+        --------
+        list of lists
+            One list per community, in community order (empty if none of
+            its members are among nodes)
+        """
+        present = nodes if isinstance(nodes, (set, frozenset)) else set(nodes)
+        return [list(members & present) for members in self._member_sets]
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_community_index(key, _G):
+    labels = [community for _, community in _G.nodes(data="Community")]
+    communities = [[] for _ in range(max(labels, default=-1) + 1)]
+    for node, community in _G.nodes(data="Community"):
+        if community >= 0:
+            communities[community].append(node)
+    return CommunityIndex(list(_G), communities)
+
+
+def community_index(G):
+    """
+    The CommunityIndex of an enriched graph from graph_pipeline, built from
+    its nodes' Community attribute once per process.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph returned by graph_pipeline.load_enriched_graph
+
+    Returns:
+    --------
+    CommunityIndex
+    """
+    return _cached_community_index(G.graph["dataset_hash"], G)
+
+
+def community_palette(n):
+    """
+    n distinct colours, starting with BASE_PALETTE.
+
+    Further colours step around the colour wheel by the golden angle, so
+    neighbouring community numbers get well separated hues however many
+    communities there are.
+
+    Parameters:
+    ----------
+    n: int
+
+    Returns:
+    --------
+    np.ndarray of str
+        Hex colour strings
+    """
+    colours = BASE_PALETTE[:n]
+    for i in range(n - len(colours)):
+        hue = (0.61803398875 * (i + 1)) % 1
+        lightness = (0.45, 0.6, 0.75)[i % 3]
+        r, g, b = colorsys.hls_to_rgb(hue, lightness, 0.65)
+        colours.append(f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}")
+    return np.array(colours, dtype=object)
+
+
+def community_settings():
+    """
+    Add a sidebar control for the community detection algorithm.
+
+    Returns:
+    --------
+    str
+        Algorithm name, to pass on to load_enriched_graph
+    """
+    with st.sidebar.expander("Community detection"):
+        return st.selectbox("Algorithm", ["auto"] + list(ALGORITHMS),
+                            format_func=lambda name: ALGORITHMS.get(name, name).capitalize(),
+                            help=f"Auto uses greedy modularity maximisation for graphs of up to "
+                                 f"{LOUVAIN_NODE_THRESHOLD:,} nodes and Louvain above that.")
+
+
+def describe_communities(G):
+    """
+    Describe how the communities of an enriched graph were detected, if it
+    wasn't the original greedy modularity method.
+
+    Returns:
+    --------
+    str
+        Empty for greedy modularity
+    """
+    algorithm = G.graph["communities"]["algorithm"]
+    if algorithm == "greedy_modularity":
+        return ""
+    return f"Communities on this page were detected using {ALGORITHMS[algorithm]} rather than the method above."
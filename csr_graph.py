@@ -0,0 +1,362 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import streamlit as st
+from scipy.sparse.csgraph import connected_components
+
+from graph_pipeline import hash_tables
+from instrumentation import timed
+
+
+class CSRGraph:
+    """
+    Weighted graph held as integer-coded nodes and a compressed sparse row
+    (CSR) adjacency matrix.
+
+    Uses a fraction of the memory of networkx's dict-of-dicts, and metrics are
+    computed with vectorised array operations. Undirected graphs store each
+    edge in both directions, except self loops, which are stored once on the
+    diagonal.
+
+    Parameters:
+    ----------
+    node_ids: np.ndarray
+        Node ID for each integer code, so node i has ID node_ids[i]
+    matrix: scipy.sparse.csr_array
+        n x n adjacency matrix of edge weights
+    directed: bool
+    """
+
+    def __init__(self, node_ids, matrix, directed=False):
+        self.node_ids = node_ids
+        self.matrix = matrix
+        self.directed = directed
+        self._metrics = None
+
+    @classmethod
+    def from_tables(cls, nodeData, edgeData, directed=False):
+        """
+        Build from the node and edge tables.
+
+        Nodes are numbered in the order networkx would add them: every ID in
+        nodeData, then any other nodes in the order they appear in the edges.
+        When a pair of nodes has several edges the last one's weight is kept,
+        as it is when building a networkx graph.
+
+        Parameters:
+        ----------
+        nodeData: pd.DataFrame
+            Node table with an ID column
+        edgeData: pd.DataFrame
+            Edge table with Source, Target and Weight columns
+        directed: bool
+
+        Returns:
+        --------
+        CSRGraph
+        """
+        sources = np.asarray(edgeData['Source'], dtype=object)
+        targets = np.asarray(edgeData['Target'], dtype=object)
+        endpoints = np.column_stack([sources, targets]).ravel()
+
+        codes, node_ids = pd.factorize(
+            np.concatenate([np.asarray(nodeData['ID'], dtype=object), endpoints])
+        )
+        edge_codes = codes[len(nodeData):].reshape(-1, 2)
+
+        rows, cols = edge_codes[:, 0], edge_codes[:, 1]
+        if not directed:
+            rows, cols = np.minimum(rows, cols), np.maximum(rows, cols)
+
+        edges = pd.DataFrame({"row": rows, "col": cols,
+                              "weight": np.asarray(edgeData['Weight'], dtype=np.float64)})
+        edges = edges.drop_duplicates(["row", "col"], keep="last")
+
+        return cls._from_edge_arrays(np.asarray(node_ids, dtype=object),
+                                     edges["row"].to_numpy(), edges["col"].to_numpy(),
+                                     edges["weight"].to_numpy(), directed)
+
+    @classmethod
+    def from_networkx(cls, G, weight="Weight"):
+        """
+        Build from a networkx graph, numbering the nodes in G.nodes order.
+
+        Parameters:
+        ----------
+        G: nx.Graph or nx.DiGraph
+        weight: str
+            Edge attribute holding the weight. Edges without it have weight 1.
+
+        Returns:
+        --------
+        CSRGraph
+        """
+        node_ids = np.empty(len(G), dtype=object)
+        node_ids[:] = list(G.nodes)
+        position = {node: i for i, node in enumerate(node_ids)}
+
+        edges = list(G.edges(data=weight, default=1))
+        rows = np.fromiter((position[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+        cols = np.fromiter((position[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+        weights = np.fromiter((w for _, _, w in edges), dtype=np.float64, count=len(edges))
+
+        return cls._from_edge_arrays(node_ids, rows, cols, weights, G.is_directed())
+
+    @classmethod
+    def _from_edge_arrays(cls, node_ids, rows, cols, weights, directed):
+        n = len(node_ids)
+        if not directed:
+            # Mirror every edge apart from self loops
+            mirror = rows != cols
+            rows, cols, weights = (np.concatenate([rows, cols[mirror]]),
+                                   np.concatenate([cols, rows[mirror]]),
+                                   np.concatenate([weights, weights[mirror]]))
+        matrix = sp.csr_array((weights, (rows, cols)), shape=(n, n))
+        matrix.sort_indices()
+        return cls(node_ids, matrix, directed)
+
+    def to_networkx(self, nodeData=None, node_attributes=("Label",)):
+        """
+        Convert to a networkx graph for rendering.
+
+        Parameters:
+        ----------
+        nodeData: pd.DataFrame
+            Optional node table to copy node attributes from
+        node_attributes: tuple of str
+            Columns of nodeData to attach to each node
+
+        Returns:
+        --------
+        nx.Graph or nx.DiGraph
+        """
+        G = nx.DiGraph() if self.directed else nx.Graph()
+
+        node_list = self.node_ids.tolist()
+        if nodeData is None:
+            G.add_nodes_from(node_list)
+        else:
+            attributes = nodeData.set_index('ID')[list(node_attributes)]
+            attributes = attributes[~attributes.index.duplicated(keep="last")]
+            attributes = attributes.reindex(node_list)
+            G.add_nodes_from(
+                (node, dict(zip(node_attributes, values)))
+                for node, values in zip(node_list, zip(*(attributes[col].tolist() for col in node_attributes)))
+            )
+
+        rows, cols, weights = self.edge_arrays()
+        G.add_edges_from(
+            (node_list[u], node_list[v], {'Weight': w})
+            for u, v, w in zip(rows.tolist(), cols.tolist(), weights.tolist())
+        )
+
+        return G
+
+    def edge_arrays(self):
+        """
+        Each edge once, as arrays of source and target codes and weights.
+        Undirected edges are listed with the lower code first.
+
+        Returns:
+        --------
+        tuple of (np.ndarray, np.ndarray, np.ndarray)
+        """
+        coo = self.matrix.tocoo()
+        rows, cols, weights = coo.row, coo.col, coo.data
+        if not self.directed:
+            keep = rows <= cols
+            rows, cols, weights = rows[keep], cols[keep], weights[keep]
+        return rows, cols, weights
+
+    @property
+    def n_nodes(self):
+        return self.matrix.shape[0]
+
+    @property
+    def n_edges(self):
+        if self.directed:
+            return self.matrix.nnz
+        return (self.matrix.nnz + self.matrix.diagonal().astype(bool).sum()) // 2
+
+    def _as_series(self, values):
+        return pd.Series(values, index=self.node_ids)
+
+    def degree(self):
+        """
+        Number of edges at each node, counting self loops twice (as networkx
+        does). For directed graphs this is in-degree plus out-degree.
+        """
+        structure = self.matrix.copy()
+        structure.data = np.ones_like(structure.data)
+        return self._as_series(self._sum_incident(structure).astype(np.int64))
+
+    def weighted_degree(self):
+        """
+        Total weight of the edges at each node, counting self loops twice (as
+        networkx does). In this app that is each node's total interactions.
+        """
+        return self._as_series(self._sum_incident(self.matrix))
+
+    def _sum_incident(self, matrix):
+        if self.directed:
+            return matrix.sum(axis=1) + matrix.sum(axis=0)
+        return matrix.sum(axis=1) + matrix.diagonal()
+
+    def pagerank(self, alpha=0.85, max_iter=100, tol=1.0e-6, weighted=True):
+        """
+        PageRank by power iteration, matching nx.pagerank.
+
+        Nodes with no outgoing edges share their rank between all nodes.
+
+        Parameters:
+        ----------
+        alpha: float
+            Damping factor
+        max_iter: int
+            Maximum number of iterations
+        tol: float
+            Convergence tolerance, as used by nx.pagerank
+        weighted: bool
+            Use the edge weights. If False every edge counts equally.
+
+        Returns:
+        --------
+        pd.Series
+            PageRank of each node, indexed by node ID
+        """
+        n = self.n_nodes
+        if n == 0:
+            return self._as_series(np.array([]))
+
+        A = self.matrix.copy()
+        if not weighted:
+            A.data = np.ones_like(A.data)
+
+        out_weight = np.asarray(A.sum(axis=1)).ravel()
+        is_dangling = out_weight == 0
+        inverse = np.divide(1.0, out_weight, out=np.zeros(n), where=~is_dangling)
+        Q = sp.diags_array(inverse) @ A
+
+        x = np.full(n, 1.0 / n)
+        p = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            x_last = x
+            x = alpha * (x @ Q + x[is_dangling].sum() * p) + (1 - alpha) * p
+            if np.abs(x - x_last).sum() < n * tol:
+                return self._as_series(x)
+
+        raise nx.PowerIterationFailedConvergence(max_iter)
+
+    def clustering(self):
+        """
+        Unweighted local clustering coefficient of each node, matching
+        nx.clustering on an undirected graph. Self loops are ignored.
+
+        Returns:
+        --------
+        pd.Series
+        """
+        if self.directed:
+            raise nx.NetworkXNotImplemented("clustering is only implemented for undirected graphs")
+
+        A = self.matrix.copy()
+        A.setdiag(0)
+        A.eliminate_zeros()
+        A.data = np.ones_like(A.data)
+
+        degree = np.asarray(A.sum(axis=1)).ravel()
+
+        # A @ A has an entry for every path of two links, which runs to
+        # billions through the hubs of heavy-tailed graphs. Instead each link
+        # is pointed from its lower to its higher degree end (ties broken by
+        # position), so no node has more than about sqrt(2 * links)
+        # out-links, and each triangle a -> b -> c with a -> c is found once.
+        rank = np.empty(self.n_nodes, dtype=np.int64)
+        rank[np.argsort(degree, kind="stable")] = np.arange(self.n_nodes)
+        rows, cols = A.nonzero()
+        forward = rank[rows] < rank[cols]
+        U = sp.csr_matrix((np.ones(forward.sum()), (rows[forward], cols[forward])),
+                          shape=A.shape)
+
+        # (a, c) entries count the middle nodes b, and (b, c) entries the
+        # first nodes a
+        ends = (U @ U).multiply(U)
+        middles = (U.T @ U).multiply(U)
+        triangles = (np.asarray(ends.sum(axis=1)).ravel() + np.asarray(ends.sum(axis=0)).ravel()
+                     + np.asarray(middles.sum(axis=1)).ravel())
+        possible = degree * (degree - 1) / 2
+
+        return self._as_series(np.divide(triangles, possible, out=np.zeros(self.n_nodes),
+                                         where=possible > 0))
+
+    def connected_components(self):
+        """
+        Label each node with the connected component it belongs to (weakly
+        connected, for directed graphs).
+
+        Components are numbered from 0 in descending order of size.
+
+        Returns:
+        --------
+        pd.Series
+        """
+        _, labels = connected_components(self.matrix, directed=self.directed, connection="weak")
+        sizes = np.bincount(labels)
+        # Renumber so component 0 is the largest
+        rank = np.empty_like(sizes)
+        rank[np.argsort(-sizes, kind="stable")] = np.arange(len(sizes))
+        return self._as_series(rank[labels])
+
+    @timed("network metrics")
+    def metrics(self):
+        """
+        Degree, weighted degree, PageRank, clustering and component of every
+        node in one table.
+
+        Computed on the first call and kept with the graph, so the table is
+        shared by everyone using the graph and must not be modified.
+
+        Returns:
+        --------
+        pd.DataFrame
+            Indexed by node ID
+        """
+        if self._metrics is not None:
+            return self._metrics
+        table = pd.DataFrame({"Degree": self.degree(),
+                              "WeightedDegree": self.weighted_degree(),
+                              "PageRank": self.pagerank(),
+                              "Component": self.connected_components()})
+        if not self.directed:
+            table["Clustering"] = self.clustering()
+        self._metrics = table
+        return table
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_csr_graph(dataset_hash, _nodeData, _edgeData, directed):
+    return CSRGraph.from_tables(_nodeData, _edgeData, directed)
+
+
+@timed("CSR graph")
+def load_csr_graph(nodeData, edgeData, directed=False, dataset_hash=None):
+    """
+    Return the CSRGraph for a dataset, building it only once per process.
+
+    The graph keeps its metrics once calculated, so they too are calculated
+    once per dataset.
+
+    Parameters:
+    ----------
+    nodeData, edgeData, directed:
+        See CSRGraph.from_tables
+    dataset_hash: str
+        Key identifying the tables, as returned by
+        graph_pipeline.load_dataset. If not given, the tables are hashed.
+
+    Returns:
+    --------
+    CSRGraph
+    """
+    return _cached_csr_graph(dataset_hash or hash_tables(nodeData, edgeData), nodeData, edgeData, directed)
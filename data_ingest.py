@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+from instrumentation import timed
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+CACHE_DIR = os.path.join("data", ".cache")
+
+
+def _source_signature(path):
+    """
+    Identify the current version of a source file by its modification time
+    and size.
+    """
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def file_key(*paths):
+    """
+    Key identifying the current version of one or more source files, from
+    their absolute paths, modification times and sizes.
+
+    Parameters:
+    ----------
+    *paths: str
+
+    Returns:
+    --------
+    str
+        Hex digest that changes whenever any of the files does
+    """
+    signatures = [[os.path.abspath(path), _source_signature(path)] for path in paths]
+    return hashlib.sha1(json.dumps(signatures).encode("utf-8")).hexdigest()
+
+
+def _cache_paths(path, cache_dir):
+    # Files with the same name in different directories get separate caches
+    path_hash = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    name = f"{os.path.splitext(os.path.basename(path))[0]}-{path_hash}"
+    return (os.path.join(cache_dir, f"{name}.feather"),
+            os.path.join(cache_dir, f"{name}.json"))
+
+
+def _convert_types(df, id_columns, integer_columns):
+    """
+    Give the raw CSV columns compact types.
+
+    ID columns become categoricals sharing a single set of categories, so
+    (for example) Source and Target can be concatenated without falling back
+    to object dtype. Integer columns are downcast to the smallest integer type
+    that holds them.
+    """
+    if id_columns:
+        categories = pd.unique(pd.concat([df[col].astype(str) for col in id_columns]))
+        id_dtype = pd.CategoricalDtype(sorted(categories))
+        for col in id_columns:
+            df[col] = df[col].astype(str).astype(id_dtype)
+
+    for col in integer_columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+
+    return df
+
+
+def _write_atomic(path, write):
+    # Several sessions may convert the same file at once, so write to a
+    # temporary file and move it into place
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, obj):
+    with open(path, "w") as f:
+        json.dump(obj, f)
+
+
+def read_table(path, id_columns=(), integer_columns=(), cache_dir=CACHE_DIR):
+    """
+    Read a CSV table via a typed columnar cache.
+
+    The first read of a CSV converts it to an uncompressed Feather file in
+    cache_dir. Later reads memory-map that file instead of parsing the CSV
+    again. The cache is rebuilt whenever the source file's modification time
+    or size changes, or the requested column types change.
+
+    If pyarrow is not installed the CSV is read directly.
+
+    Parameters:
+    ----------
+    path: str
+        Path to the source CSV
+    id_columns: list of str
+        Columns holding node IDs, stored as categoricals
+    integer_columns: list of str
+        Columns stored as downcast integers
+    cache_dir: str
+        Folder the columnar copies are kept in
+
+    Returns:
+    --------
+    pd.DataFrame
+    """
+    if feather is None:
+        return _convert_types(pd.read_csv(path), list(id_columns), list(integer_columns))
+
+    feather_path, meta_path = _cache_paths(path, cache_dir)
+    meta = {"source": _source_signature(path),
+            "id_columns": list(id_columns),
+            "integer_columns": list(integer_columns)}
+
+    try:
+        with open(meta_path) as f:
+            is_fresh = json.load(f) == meta
+    except (OSError, ValueError):
+        is_fresh = False
+
+    if is_fresh:
+        try:
+            table = feather.read_table(feather_path, memory_map=True)
+            return table.to_pandas(split_blocks=True)
+        except (OSError, pa.ArrowInvalid):
+            pass
+
+    df = _convert_types(pd.read_csv(path), list(id_columns), list(integer_columns))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_atomic(feather_path,
+                  lambda p: feather.write_feather(df, p, compression="uncompressed"))
+    _write_atomic(meta_path, lambda p: _write_json(p, meta))
+
+    return df
+
+
+@timed("read edges")
+def read_edges(path, cache_dir=CACHE_DIR):
+    """
+    Read an edge list with Source, Target and Weight columns.
+    """
+    return read_table(path, id_columns=["Source", "Target"], integer_columns=["Weight"], cache_dir=cache_dir)
+
+
+@timed("read nodes")
+def read_nodes(path, cache_dir=CACHE_DIR):
+    """
+    Read a node list with Id and Label columns, renaming Id to ID.
+    """
+    return read_table(path, id_columns=["Id"], cache_dir=cache_dir).rename(columns={"Id": "ID"})
@@ -0,0 +1,446 @@
+import networkx as nx
+import numpy as np
+import streamlit as st
+
+from graph_pipeline import graph_key
+from instrumentation import timed
+from result_cache import ResultCache, estimate_size
+
+NEIGHBOURHOOD_CACHE_MB = 32
+
+
+class WeightThresholdIndex:
+    """
+    Index of a graph's edges sorted by weight, for fast threshold filtering.
+
+    Filtering the graph to edges with a weight of at least some threshold
+    becomes a binary search into the sorted weights, and the nodes that keep
+    at least one edge are those whose heaviest incident edge meets the
+    threshold.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph to index. It must not be modified while the index is in use.
+    weight: str
+        Name of the edge attribute holding the weight
+    """
+
+    def __init__(self, G, weight="Weight"):
+        self.G = G
+        self.weight = weight
+
+        self.nodes = list(G.nodes)
+        node_position = {node: i for i, node in enumerate(self.nodes)}
+
+        edges = list(G.edges(data=weight))
+        sources = np.fromiter((node_position[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+        targets = np.fromiter((node_position[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+        weights = np.fromiter((w for _, _, w in edges), dtype=np.float64, count=len(edges))
+
+        # Ascending order, so the edges meeting a threshold are a suffix.
+        # The position of each edge in G.edges is kept so filtered graphs can
+        # list their edges in the same order as the original.
+        self.order = np.argsort(weights, kind="stable")
+        self.sorted_weights = weights[self.order]
+        self.sources = sources
+        self.targets = targets
+
+        self.node_max_weight = np.full(len(self.nodes), -np.inf)
+        np.maximum.at(self.node_max_weight, sources, weights)
+        np.maximum.at(self.node_max_weight, targets, weights)
+
+    def edge_positions(self, threshold):
+        """
+        Return the positions (in G.edges order) of edges with a weight of at
+        least threshold.
+
+        Parameters:
+        ----------
+        threshold: float
+
+        Returns:
+        --------
+        np.ndarray of int
+        """
+        start = np.searchsorted(self.sorted_weights, threshold, side="left")
+        return np.sort(self.order[start:])
+
+    def node_positions(self, threshold):
+        """
+        Return the positions (in G.nodes order) of nodes with at least one
+        incident edge with a weight of at least threshold.
+
+        Parameters:
+        ----------
+        threshold: float
+
+        Returns:
+        --------
+        np.ndarray of int
+        """
+        return np.flatnonzero(self.node_max_weight >= threshold)
+
+    def filtered_graph(self, threshold):
+        """
+        Return a new graph holding only the edges with a weight of at least
+        threshold, and the nodes that still have an edge.
+
+        This gives the same nodes, edges and attributes as filtering with
+        nx.subgraph_view, copying, and removing the isolates.
+
+        Parameters:
+        ----------
+        threshold: float
+
+        Returns:
+        --------
+        nx.Graph
+            A new, modifiable graph of the same type as the indexed graph
+        """
+        G = self.G
+        H = G.__class__()
+
+        H.add_nodes_from((self.nodes[i], G.nodes[self.nodes[i]])
+                         for i in self.node_positions(threshold).tolist())
+
+        positions = self.edge_positions(threshold)
+        H.add_edges_from((u, v, G[u][v])
+                         for u, v in zip(self._node_list(self.sources[positions]),
+                                         self._node_list(self.targets[positions])))
+
+        return H
+
+    def _node_list(self, positions):
+        nodes = self.nodes
+        return [nodes[i] for i in positions.tolist()]
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_threshold_index(key, _G, weight):
+    return WeightThresholdIndex(_G, weight)
+
+
+def load_threshold_index(G, weight="Weight"):
+    """
+    Return the WeightThresholdIndex for a graph from graph_pipeline, building
+    it only once per process.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph returned by load_graph or load_enriched_graph
+    weight: str
+        Name of the edge attribute holding the weight
+
+    Returns:
+    --------
+    WeightThresholdIndex
+    """
+    return _cached_threshold_index(graph_key(G), G, weight)
+
+
+class IncrementalThresholdFilter:
+    """
+    Filter a graph by edge weight and node value, updating the previous
+    result rather than starting again when the thresholds change.
+
+    The filtered graph holds the edges with a weight of at least the weight
+    threshold whose endpoints both have a node value of at least the node
+    threshold, plus every node that still has an edge at the weight threshold
+    and meets the node threshold. This is the same graph as filtering the
+    edges, removing the isolates and then filtering the nodes.
+
+    When a slider moves, only the edges and nodes whose weight or value lies
+    between the old and new thresholds are added or removed. Large jumps,
+    where that would touch more than full_rebuild_fraction of the edges, fall
+    back to building the filtered graph from scratch.
+
+    Parameters:
+    ----------
+    index: WeightThresholdIndex
+        Index of the graph to filter
+    node_attribute: str
+        Name of the node attribute the node threshold applies to
+    full_rebuild_fraction: float
+        Fraction of the edges above which a change is rebuilt from scratch
+    """
+
+    def __init__(self, index, node_attribute="TotalInteractions", full_rebuild_fraction=0.25):
+        self.index = index
+        self.full_rebuild_fraction = full_rebuild_fraction
+
+        G = index.G
+        self.node_values = np.array([G.nodes[node].get(node_attribute, np.nan)
+                                     for node in index.nodes], dtype=np.float64)
+        # NaN sorts to the end and never meets a threshold
+        self.value_order = np.argsort(self.node_values, kind="stable")
+        self.sorted_values = self.node_values[self.value_order]
+
+        self.graph = None
+        self.weight_threshold = None
+        self.node_threshold = None
+
+    @timed("threshold filter")
+    def update(self, weight_threshold, node_threshold):
+        """
+        Return the graph filtered to the given thresholds.
+
+        The returned graph is owned by the filter and is changed in place by
+        later calls to update, so it should not be modified.
+
+        Parameters:
+        ----------
+        weight_threshold: float
+            Minimum edge weight
+        node_threshold: float
+            Minimum node value
+
+        Returns:
+        --------
+        nx.Graph
+        """
+        if self.graph is None:
+            self._rebuild(weight_threshold, node_threshold)
+            return self.graph
+
+        edge_change = self._slice(self.index.sorted_weights, self.weight_threshold, weight_threshold)
+        node_change = self._slice(self.sorted_values, self.node_threshold, node_threshold)
+
+        changed = (edge_change[1] - edge_change[0]) + (node_change[1] - node_change[0])
+        if changed > self.full_rebuild_fraction * len(self.index.sorted_weights):
+            self._rebuild(weight_threshold, node_threshold)
+            return self.graph
+
+        self._update_weight_threshold(weight_threshold, edge_change)
+        self._update_node_threshold(node_threshold, node_change)
+
+        return self.graph
+
+    @staticmethod
+    def _slice(sorted_array, old, new):
+        # The entries whose value lies between the old and new thresholds
+        start, end = np.searchsorted(sorted_array, sorted([old, new]), side="left")
+        return start, end
+
+    def _rebuild(self, weight_threshold, node_threshold):
+        index = self.index
+        G = index.G
+
+        positions = index.edge_positions(weight_threshold)
+        self.degree = (np.bincount(index.sources[positions], minlength=len(index.nodes))
+                       + np.bincount(index.targets[positions], minlength=len(index.nodes)))
+        self.node_ok = self.node_values >= node_threshold
+
+        keep = self.node_ok[index.sources[positions]] & self.node_ok[index.targets[positions]]
+        positions = positions[keep]
+
+        H = G.__class__()
+        H.add_nodes_from((index.nodes[i], G.nodes[index.nodes[i]])
+                         for i in np.flatnonzero((self.degree > 0) & self.node_ok).tolist())
+        H.add_edges_from((u, v, G[u][v])
+                         for u, v in zip(index._node_list(index.sources[positions]),
+                                         index._node_list(index.targets[positions])))
+
+        self.graph = H
+        self.weight_threshold = weight_threshold
+        self.node_threshold = node_threshold
+
+    def _update_weight_threshold(self, weight_threshold, edge_change):
+        index = self.index
+        G = index.G
+        H = self.graph
+        nodes = index.nodes
+
+        start, end = edge_change
+        positions = index.order[start:end]
+        entering = weight_threshold < self.weight_threshold
+
+        sources = index.sources[positions]
+        targets = index.targets[positions]
+        np.add.at(self.degree, sources, 1 if entering else -1)
+        np.add.at(self.degree, targets, 1 if entering else -1)
+
+        for i, j in zip(sources.tolist(), targets.tolist()):
+            u, v = nodes[i], nodes[j]
+            if entering:
+                for k, node in ((i, u), (j, v)):
+                    if self.node_ok[k] and node not in H:
+                        H.add_node(node, **G.nodes[node])
+                if self.node_ok[i] and self.node_ok[j]:
+                    H.add_edge(u, v, **G[u][v])
+            else:
+                if H.has_edge(u, v):
+                    H.remove_edge(u, v)
+                for k, node in ((i, u), (j, v)):
+                    if self.degree[k] == 0 and node in H:
+                        H.remove_node(node)
+
+        self.weight_threshold = weight_threshold
+
+    def _update_node_threshold(self, node_threshold, node_change):
+        index = self.index
+        G = index.G
+        H = self.graph
+
+        start, end = node_change
+        positions = self.value_order[start:end]
+        entering = node_threshold < self.node_threshold
+
+        self.node_ok[positions] = entering
+
+        for i in positions.tolist():
+            node = index.nodes[i]
+            if not entering:
+                if node in H:
+                    H.remove_node(node)
+            elif self.degree[i] > 0:
+                H.add_node(node, **G.nodes[node])
+                self._add_surviving_edges(node)
+
+        self.node_threshold = node_threshold
+
+    def _add_surviving_edges(self, node):
+        # Reconnect a node that has just met the node threshold to its
+        # neighbours already in the filtered graph
+        G = self.index.G
+        H = self.graph
+        weight = self.index.weight
+
+        for neighbour, data in G.adj[node].items():
+            if data[weight] >= self.weight_threshold and (neighbour in H or neighbour == node):
+                H.add_edge(node, neighbour, **data)
+
+        if G.is_directed():
+            for neighbour, data in G.pred[node].items():
+                if data[weight] >= self.weight_threshold and neighbour in H:
+                    H.add_edge(neighbour, node, **data)
+
+
+def session_threshold_filter(G, key="threshold_filter", node_attribute="TotalInteractions"):
+    """
+    Return this session's IncrementalThresholdFilter for a graph from
+    graph_pipeline.
+
+    The session keeps one filter per key, replaced by a new one when it is
+    asked for a different graph, so filtered copies of graphs it has moved
+    on from aren't kept.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph returned by load_graph or load_enriched_graph
+    key: str
+        Name distinguishing separate filters within a session
+    node_attribute: str
+        Name of the node attribute the node threshold applies to
+
+    Returns:
+    --------
+    IncrementalThresholdFilter
+    """
+    if key not in st.session_state or st.session_state[key][0] != graph_key(G):
+        st.session_state[key] = (graph_key(G), IncrementalThresholdFilter(load_threshold_index(G), node_attribute))
+    return st.session_state[key][1]
+
+
+def ego_network(G, center, radius=1, weight_threshold=None, weight="Weight"):
+    """
+    Return the nodes within radius links of a node, and the links between
+    them, as a new graph.
+
+    Walks outwards from center through the adjacency dicts, so the time
+    taken depends on the size of the neighbourhood rather than the graph.
+    Links are followed in either direction in a directed graph. With radius
+    1 and no threshold this gives the same nodes and edges as filtering
+    with nx.subgraph_view on nx.all_neighbors.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    center: node
+        Node whose neighbourhood to return
+    radius: int
+        Number of links to follow out from center
+    weight_threshold: float
+        Only follow, and keep, links with a weight of at least this. None to
+        use every link.
+    weight: str
+        Name of the edge attribute holding the weight
+
+    Returns:
+    --------
+    nx.Graph
+        A new graph of the same type as G, with center as its first node
+    """
+    adjacencies = [G.succ, G.pred] if G.is_directed() else [G.adj]
+
+    def keep(data):
+        return weight_threshold is None or data[weight] >= weight_threshold
+
+    reached = {center: None}
+    frontier = [center]
+    for _ in range(radius):
+        next_frontier = []
+        for node in frontier:
+            for adjacency in adjacencies:
+                for neighbour, data in adjacency[node].items():
+                    if neighbour not in reached and keep(data):
+                        reached[neighbour] = None
+                        next_frontier.append(neighbour)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+
+    H = G.__class__()
+    H.add_nodes_from((node, G.nodes[node]) for node in reached)
+    H.add_edges_from((node, neighbour, data)
+                     for node in reached
+                     for neighbour, data in G.adj[node].items()
+                     if neighbour in reached and keep(data))
+    return H
+
+
+def _graph_size(G):
+    # estimate_size doesn't look inside graphs, so measure their node and
+    # adjacency dicts
+    return (estimate_size(dict(G.nodes(data=True)))
+            + sum(estimate_size(adjacency) for _, adjacency in G.adjacency()))
+
+
+@st.cache_resource(show_spinner=False)
+def neighbourhood_cache():
+    """
+    Return the process-wide cache of ego networks, shared by every session.
+
+    Returns:
+    --------
+    ResultCache
+    """
+    return ResultCache(max_bytes=NEIGHBOURHOOD_CACHE_MB * 1024 ** 2, sizeof=_graph_size)
+
+
+@timed("ego network")
+def load_ego_network(G, center, radius=1, weight_threshold=None):
+    """
+    Return the ego network of a node in a graph from graph_pipeline, cached
+    per node, radius and threshold.
+
+    The graph is shared between sessions, so it is frozen - take a copy
+    before modifying it.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph returned by load_graph or load_enriched_graph
+    center, radius, weight_threshold:
+        See ego_network
+
+    Returns:
+    --------
+    nx.Graph
+    """
+    return neighbourhood_cache().get_or_compute(
+        ("ego", graph_key(G), center, radius, weight_threshold),
+        lambda: nx.freeze(ego_network(G, center, radius, weight_threshold))
+    )
@@ -0,0 +1,424 @@
+import hashlib
+import itertools
+import networkx as nx
+import pandas as pd
+import streamlit as st
+
+from background_jobs import background_result, release_job
+from centrality import betweenness_centrality_with_error, betweenness_pool, betweenness_task, estimate_betweenness
+from data_ingest import file_key, read_edges, read_nodes
+from communities import (choose_algorithm, communities_task, community_labels, community_palette,
+                         detect_communities, load_communities)
+from instrumentation import timed
+
+
+def hash_tables(*tables):
+    """
+    Produce a content hash for one or more dataframes.
+
+    The hash covers column names, dtypes and every value, so two tables with
+    identical contents always give the same key regardless of where they were
+    loaded from.
+
+    Parameters:
+    ----------
+    *tables: pd.DataFrame
+        Tables to include in the hash, in order.
+
+    Returns:
+    --------
+    str
+        Hex digest identifying the dataset
+    """
+    digest = hashlib.sha1()
+    for table in tables:
+        digest.update(repr(list(zip(table.columns, table.dtypes.astype(str)))).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(table, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+@timed("total interactions")
+def add_total_interactions(nodeData, edgeData):
+    """
+    Add a TotalInteractions column to the node table.
+
+    A node's total interactions is the sum of the weights of every edge it
+    appears in, whether as the source or the target.
+
+    Parameters:
+    ----------
+    nodeData: pd.DataFrame
+        Node table with an ID column
+    edgeData: pd.DataFrame
+        Edge table with Source, Target and Weight columns
+
+    Returns:
+    --------
+    pd.DataFrame
+    """
+    # observed=True so categorical IDs only produce rows for nodes that appear
+    total_interactions_node = pd.concat([edgeData[['Source', 'Weight']].groupby('Source', observed=True).sum().reset_index(drop=False),
+                                         edgeData[['Target', 'Weight']].groupby('Target', observed=True).sum().reset_index(drop=False).rename(columns={'Target':'Source'})]
+                                         ).groupby('Source', observed=True).sum().rename(columns={'Weight':'TotalInteractions'})
+
+    return nodeData.merge(total_interactions_node, how="left", left_on="ID", right_on="Source")
+
+
+@timed("build graph")
+def build_graph(nodeData, edgeData, directed=False, node_attributes=("Label",)):
+    """
+    Build stage - turn the node and edge tables into a networkx graph.
+
+    Parameters:
+    ----------
+    nodeData: pd.DataFrame
+        Node table with an ID column plus any columns in node_attributes
+    edgeData: pd.DataFrame
+        Edge table with Source, Target and Weight columns
+    directed: bool
+        Build a nx.DiGraph rather than a nx.Graph
+    node_attributes: tuple of str
+        Columns of nodeData to attach to each node
+
+    Returns:
+    --------
+    nx.Graph or nx.DiGraph
+    """
+    ## Initiate the graph object
+    G = nx.DiGraph() if directed else nx.Graph()
+
+    # Work from whole columns converted to python lists in one step, rather
+    # than materialising a dataframe of records for every row. tolist also
+    # gives python rather than numpy scalars, which serialise cleanly to JSON.
+    idList = nodeData['ID'].tolist()
+    attributeColumns = [nodeData[col].tolist() for col in node_attributes]
+    attributeRows = zip(*attributeColumns) if attributeColumns else itertools.repeat(())
+
+    sourceList = edgeData['Source'].tolist()
+    targetList = edgeData['Target'].tolist()
+    weightList = edgeData['Weight'].tolist()
+
+    ## Add the nodes and edges to the graph, attaching attributes as each is
+    ## added. The generators mean no intermediate list of tuples is built.
+    G.add_nodes_from(
+        (node, dict(zip(node_attributes, values)))
+        for node, values in zip(idList, attributeRows)
+    )
+    G.add_edges_from(
+        (source, target, {'Weight': weight})
+        for source, target, weight in zip(sourceList, targetList, weightList)
+    )
+
+    return G
+
+
+@timed("enrich graph")
+def enrich_graph(G, color_attribute="CommunityColor", betweenness_mode="auto",
+                 community_algorithm="auto"):
+    """
+    Enrich stage - add betweenness and communities.
+
+    The graph is modified in place. Details of how betweenness was calculated
+    (see centrality.estimate_betweenness) are stored in G.graph["betweenness"],
+    and the community detection algorithm used in G.graph["communities"].
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        Graph produced by build_graph. If it carries a graph_key, the
+        communities are cached under it.
+    color_attribute: str
+        Name of the node attribute the community colour is written to
+    betweenness_mode: str
+        "exact", "approximate" or "auto" - see centrality.estimate_betweenness
+    community_algorithm: str
+        See communities.detect_communities
+
+    Returns:
+    --------
+    tuple of (nx.Graph, list of frozenset)
+        The enriched graph and the detected communities, largest first
+    """
+    bb, G.graph["betweenness"] = estimate_betweenness(G, mode=betweenness_mode, pool=betweenness_pool())
+    nx.set_node_attributes(G, bb, "Size")
+
+    if "dataset_hash" in G.graph:
+        c = load_communities(G, community_algorithm)
+    else:
+        c = detect_communities(G, community_algorithm)
+    G.graph["communities"] = {"algorithm": choose_algorithm(G, community_algorithm)}
+
+    nx.set_node_attributes(G, _community_attributes(list(G.nodes), c, color_attribute))
+
+    return G, c
+
+
+def _community_attributes(nodeList, c, color_attribute):
+    # Community number and colour of each node, as node attribute dicts
+    labels = community_labels(nodeList, c)
+    colors = community_palette(len(c))[labels]
+    return {node: {"Community": label, color_attribute: color}
+            for node, label, color in zip(nodeList, labels.tolist(), colors.tolist())}
+
+
+def _with_node_attributes(G, attributes):
+    """
+    A frozen graph sharing G's edges, with each node's attributes updated
+    from attributes (node to dict of attributes).
+
+    Only the node attribute dicts are copied, so this costs time and memory
+    in proportion to the number of nodes rather than a full copy.
+    """
+    H = nx.graphviews.generic_graph_view(G)
+    # The view shares G's node dict too, so give it its own
+    H._node = {node: {**data, **attributes.get(node, {})} for node, data in G.nodes(data=True)}
+    H.graph = dict(G.graph)
+    return H
+
+
+def graph_key(G):
+    """
+    Return the key identifying a graph returned by load_graph or
+    load_enriched_graph.
+
+    Other caches (filter indexes, centrality, layouts) use this to tie their
+    results to the dataset the graph was built from.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+
+    Returns:
+    --------
+    str
+    """
+    return G.graph["dataset_hash"]
+
+
+def built_graph_key(G):
+    """
+    Return the key of the built graph G was made from.
+
+    Unlike graph_key, this stays the same whatever betweenness, community
+    and colour settings an enriched graph was made with, so results that
+    depend only on the nodes and edges (centrality of filtered graphs, for
+    example) can be shared between them.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+        A graph returned by load_graph or load_enriched_graph
+
+    Returns:
+    --------
+    str
+    """
+    return G.graph["built_key"]
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_dataset(key, nodes_path, edges_path):
+    edges = read_edges(edges_path)
+    return add_total_interactions(read_nodes(nodes_path), edges), edges
+
+
+@timed("load dataset")
+def load_dataset(nodes_path, edges_path):
+    """
+    Read a node list and edge list (see data_ingest) and add TotalInteractions
+    to the nodes, only once per version of the files.
+
+    The key returned identifies the files by their paths, modification times
+    and sizes, so the tables don't need hashing. Pass it as dataset_hash to
+    the loaders below along with the tables. The tables are shared between
+    every session and page, so they must not be modified.
+
+    Parameters:
+    ----------
+    nodes_path: str
+        CSV with Id and Label columns
+    edges_path: str
+        CSV with Source, Target and Weight columns
+
+    Returns:
+    --------
+    tuple of (pd.DataFrame, pd.DataFrame, str)
+        Node table, edge table and the dataset key
+    """
+    key = file_key(nodes_path, edges_path)
+    nodeData, edgeData = _cached_dataset(key, nodes_path, edges_path)
+    return nodeData, edgeData, key
+
+
+# The leading underscore on the table arguments stops streamlit hashing them on
+# every call - the dataset hash already identifies their contents.
+@st.cache_resource(show_spinner=False)
+def _cached_graph(dataset_hash, _nodeData, _edgeData, directed, node_attributes):
+    G = build_graph(_nodeData, _edgeData, directed, node_attributes)
+    G.graph["dataset_hash"] = f"{dataset_hash}-{int(directed)}-{','.join(node_attributes)}"
+    # Copied to the sized and enriched graphs along with the rest of G.graph
+    G.graph["built_key"] = G.graph["dataset_hash"]
+    return nx.freeze(G)
+
+
+# Node attributes of the graph the enriched graphs are built on
+ENRICHED_NODE_ATTRIBUTES = ("Label", "TotalInteractions")
+
+
+@st.cache_resource(show_spinner=False)
+def _enriched_keys():
+    # Keys of the enriched graphs _cached_enriched_graph holds, so the page
+    # can tell whether a background job is needed. Cleared along with it.
+    return set()
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_sized_graph(dataset_hash, _nodeData, _edgeData, betweenness_mode, betweenness_k, _betweenness=None):
+    # The built graph with betweenness as each node's Size. Every community
+    # algorithm and colour attribute shares it, so it's calculated once per
+    # dataset and betweenness setting. _betweenness passes in values a
+    # background job has already calculated.
+    G = _cached_graph(dataset_hash, _nodeData, _edgeData, False, ENRICHED_NODE_ATTRIBUTES)
+    bb, betweenness = _betweenness or betweenness_centrality_with_error(G, (graph_key(G),), betweenness_mode,
+                                                                         betweenness_k)
+    H = _with_node_attributes(G, {node: {"Size": value} for node, value in bb.items()})
+    H.graph["betweenness"] = betweenness
+    H.graph["dataset_hash"] = f"{dataset_hash}-sized-{betweenness_mode}-{betweenness_k}"
+    return H
+
+
+@st.cache_resource(show_spinner=False)
+def _cached_enriched_graph(dataset_hash, _nodeData, _edgeData, color_attribute, community_algorithm,
+                           betweenness_mode, betweenness_k, _betweenness=None, _communities=None):
+    G = _cached_graph(dataset_hash, _nodeData, _edgeData, False, ENRICHED_NODE_ATTRIBUTES)
+    # Cached under the built graph's key, so the communities are detected
+    # once per algorithm whatever the betweenness setting and colour attribute
+    c = _communities or load_communities(G, community_algorithm)
+    sized = _cached_sized_graph(dataset_hash, _nodeData, _edgeData, betweenness_mode, betweenness_k, _betweenness)
+    H = _with_node_attributes(sized, _community_attributes(list(sized.nodes), c, color_attribute))
+    H.graph["communities"] = {"algorithm": community_algorithm}
+    H.graph["dataset_hash"] = f"{graph_key(sized)}-enriched-{color_attribute}-{community_algorithm}"
+    _enriched_keys().add((dataset_hash, color_attribute, community_algorithm, betweenness_mode, betweenness_k))
+    return H, c
+
+
+def _enriched_graph(dataset_hash, nodeData, edgeData, color_attribute, community_algorithm,
+                    betweenness_mode, betweenness_k):
+    # Resolve "auto" first, so it shares the graph of the algorithm it picks
+    G = _cached_graph(dataset_hash, nodeData, edgeData, False, ENRICHED_NODE_ATTRIBUTES)
+    return _cached_enriched_graph(dataset_hash, nodeData, edgeData, color_attribute,
+                                  choose_algorithm(G, community_algorithm), betweenness_mode, betweenness_k)
+
+
+@timed("load graph")
+def load_graph(nodeData, edgeData, directed=False, node_attributes=("Label",), dataset_hash=None):
+    """
+    Return the built graph for a dataset, building it only once per process.
+
+    The graph is shared between every session and page, so it is frozen -
+    take a copy before modifying it.
+
+    Parameters:
+    ----------
+    nodeData, edgeData, directed, node_attributes:
+        See build_graph
+    dataset_hash: str
+        Key identifying the tables, as returned by load_dataset. If not
+        given, the tables are hashed with hash_tables.
+
+    Returns:
+    --------
+    nx.Graph or nx.DiGraph
+    """
+    return _cached_graph(dataset_hash or hash_tables(nodeData, edgeData), nodeData, edgeData,
+                         directed, tuple(node_attributes))
+
+
+@timed("load enriched graph")
+def load_enriched_graph(nodeData, edgeData, color_attribute="CommunityColor", community_algorithm="auto",
+                        betweenness_mode="auto", betweenness_k=None, dataset_hash=None):
+    """
+    Return the built and enriched graph for a dataset, computing it only once
+    per process.
+
+    The graph is built once per dataset, and its betweenness calculated once
+    per dataset and betweenness setting. Each community algorithm and colour
+    attribute adds only its own node attributes, on a view sharing the edges.
+
+    The graph is shared between every session and page, so it is frozen -
+    take a copy before modifying it.
+
+    Parameters:
+    ----------
+    nodeData: pd.DataFrame
+        Node table with ID, Label and TotalInteractions columns
+    edgeData: pd.DataFrame
+        Edge table with Source, Target and Weight columns
+    color_attribute: str
+        Name of the node attribute the community colour is written to
+    community_algorithm: str
+        See communities.detect_communities
+    betweenness_mode, betweenness_k:
+        mode and k for centrality.estimate_betweenness, which sets each
+        node's Size
+    dataset_hash: str
+        See load_graph
+
+    Returns:
+    --------
+    tuple of (nx.Graph, list of frozenset)
+    """
+    return _enriched_graph(dataset_hash or hash_tables(nodeData, edgeData), nodeData, edgeData,
+                           color_attribute, community_algorithm, betweenness_mode, betweenness_k)
+
+
+def is_enriched(G):
+    """
+    Whether a graph has been through enrich_graph, rather than being the
+    built graph load_enriched_graph_in_background returns while it waits.
+    """
+    return "communities" in G.graph
+
+
+def load_enriched_graph_in_background(nodeData, edgeData, color_attribute="CommunityColor",
+                                      community_algorithm="auto", betweenness_mode="auto",
+                                      betweenness_k=None, dataset_hash=None):
+    """
+    Return the enriched graph for a dataset if it is ready, otherwise enrich
+    it in the background and return the built graph to draw in the meantime.
+
+    The built graph has the Label and TotalInteractions node attributes but
+    no Size, Community or colour, so pages draw it with uniform node sizes
+    and no community colours, then call background_jobs.wait_for_jobs to be
+    rerun with the enriched graph once it is ready.
+
+    Parameters:
+    ----------
+    See load_enriched_graph
+
+    Returns:
+    --------
+    tuple of (nx.Graph, list of frozenset)
+        The communities are None while the graph is provisional
+    """
+    dataset_hash = dataset_hash or hash_tables(nodeData, edgeData)
+    # The graph the enriched one is built on, so no extra copy is kept
+    G = _cached_graph(dataset_hash, nodeData, edgeData, False, ENRICHED_NODE_ATTRIBUTES)
+    algorithm = choose_algorithm(G, community_algorithm)
+    settings = (color_attribute, algorithm, betweenness_mode, betweenness_k)
+
+    if (dataset_hash,) + settings in _enriched_keys():
+        release_job("enriched graph")
+        return _cached_enriched_graph(dataset_hash, nodeData, edgeData, *settings)
+
+    # The job calculates the betweenness and communities without touching
+    # streamlit's caches, which only the script thread uses. The enriched
+    # graph is put together from its results here, which is quick.
+    betweenness = betweenness_task(G, (graph_key(G),), betweenness_mode, betweenness_k)
+    communities = communities_task(G, algorithm)
+    ready = background_result("enriched graph",
+                              ("enriched graph", graph_key(G), algorithm, betweenness_mode, betweenness_k),
+                              lambda: (betweenness(), communities()))
+    if ready is None:
+        return G, None
+    return _cached_enriched_graph(dataset_hash, nodeData, edgeData, *settings, *ready)
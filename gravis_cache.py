@@ -0,0 +1,68 @@
+"""
+Cache of rendered gravis HTML documents.
+
+gravis generates a complete standalone HTML document for every figure,
+which for a large graph runs to several megabytes. Documents are cached per
+graph, filter state and rendering options, so revisiting a filter setting
+reuses the document instead of rendering it again. As the cached document
+is byte-for-byte the same as last time, the browser also keeps the iframe
+it already has rather than reloading it.
+
+HTML compresses well, so documents are held gzipped by default.
+"""
+import gzip
+
+import gravis as gv
+import streamlit as st
+
+from instrumentation import span, timed
+from result_cache import ResultCache
+
+GRAVIS_CACHE_MB = 64
+
+# Fast compression is plenty for HTML, which is mostly repetitive JSON
+GZIP_LEVEL = 1
+
+
+@st.cache_resource(show_spinner=False)
+def gravis_cache():
+    """
+    Return the process-wide cache of rendered gravis documents, shared by
+    every session.
+
+    Returns:
+    --------
+    ResultCache
+    """
+    return ResultCache(max_bytes=GRAVIS_CACHE_MB * 1024 ** 2)
+
+
+@timed("gravis HTML")
+def d3_html(G, key, compress=True, **options):
+    """
+    HTML document for gv.d3(G, **options), cached under key and the options.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    key: tuple
+        Hashable key identifying G, for example the dataset's graph_key
+        together with the filter settings that produced G
+    compress: bool
+        Store the document gzipped, which cuts its memory use around four
+        times at the cost of decompressing it on every use
+    **options:
+        Passed on to gv.d3. Values must be hashable.
+
+    Returns:
+    --------
+    str
+    """
+    def render():
+        with span("gravis to_html"):
+            html = gv.d3(G, **options).to_html()
+        return gzip.compress(html.encode("utf-8"), GZIP_LEVEL) if compress else html
+
+    cache_key = ("d3", compress) + tuple(key) + tuple(sorted(options.items()))
+    document = gravis_cache().get_or_compute(cache_key, render)
+    return gzip.decompress(document).decode("utf-8") if compress else document
@@ -0,0 +1,294 @@
+"""
+Timing and memory instrumentation of the stages of a page run.
+
+Pages call start_run at the top and instrumentation_panel at the bottom.
+In between, every span opened - with the span context manager, or by
+calling a function decorated with timed - is recorded with its wall clock
+time and, when memory tracing is switched on in the panel, the peak memory
+allocated while it ran. Spans nest, so a cached stage shows the work inside
+it only on the runs that actually compute it.
+
+Functions decorated with timed_fragment run as streamlit fragments. When
+one reruns on its own it is recorded as a run of its own, which goes to the
+log but not the panel, as fragments can't write to the sidebar.
+
+Spans opened outside a page run (from benchmarks, or in another thread)
+are not recorded and cost next to nothing.
+
+If the TIMING_LOG environment variable names a file, every run is also
+appended to it as a line of JSON.
+"""
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+TIMING_LOG = os.environ.get("TIMING_LOG")
+
+# Streamlit runs each session's script in its own thread
+_local = threading.local()
+_log_lock = threading.Lock()
+
+# Sessions with memory tracing switched on. tracemalloc traces the whole
+# process, so it runs while any of them is still connected.
+_tracing_sessions = set()
+_tracing_lock = threading.Lock()
+
+
+class PageRun:
+    """
+    The spans recorded during one run of a page.
+
+    Parameters:
+    ----------
+    page: str
+        Name of the page
+    trace_memory: bool
+        Record the peak memory of each span with tracemalloc
+    """
+
+    def __init__(self, page, trace_memory=False):
+        self.page = page
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        self.timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+        self.spans = []
+        self.seconds = None
+        # Each open span's record and the highest peak seen by spans inside it
+        self._open = []
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def to_dict(self):
+        return {"time": self.timestamp,
+                "page": self.page,
+                "total_seconds": self.seconds,
+                "trace_memory": self.trace_memory,
+                "spans": self.spans}
+
+
+def current_run():
+    """
+    The run in progress in this thread, or None outside a page run.
+    """
+    return getattr(_local, "run", None)
+
+
+def start_run(page):
+    """
+    Start recording the spans of a page run, replacing any run this thread
+    didn't finish (for example because streamlit stopped it to rerun).
+
+    Memory tracing follows the checkbox in instrumentation_panel. tracemalloc
+    traces the whole process, so peaks include allocations by other sessions
+    running at the same time, and every session runs slower while it is on.
+    It is stopped once no connected session has it switched on.
+
+    Parameters:
+    ----------
+    page: str
+        Name of the page, for the log
+
+    Returns:
+    --------
+    PageRun
+    """
+    st.session_state["instrumentation_page"] = page
+    return _new_run(page)
+
+
+def _new_run(name):
+    trace_memory = bool(st.session_state.get("instrumentation_trace_memory", False))
+    _set_memory_tracing(trace_memory)
+    _local.run = PageRun(name, trace_memory)
+    return _local.run
+
+
+def _set_memory_tracing(trace_memory):
+    """
+    Switch memory tracing on or off for this session, starting tracemalloc
+    for the first session that wants it and stopping it when none are left.
+    """
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx else None
+    with _tracing_lock:
+        if trace_memory:
+            _tracing_sessions.add(session_id)
+        else:
+            _tracing_sessions.discard(session_id)
+        if runtime.exists():
+            # Forget sessions closed with tracing still switched on
+            _tracing_sessions.intersection_update(
+                {session for session in _tracing_sessions
+                 if session == session_id or runtime.get_instance().is_active_session(session)})
+
+        if _tracing_sessions and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not _tracing_sessions and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+@contextmanager
+def span(name):
+    """
+    Record the time taken by the enclosed block as a stage of the current
+    page run.
+
+    Parameters:
+    ----------
+    name: str
+        Stage name shown in the panel
+    """
+    run = current_run()
+    if run is None:
+        yield
+        return
+
+    record = {"name": name, "depth": len(run._open), "seconds": None, "peak_mb": None}
+    run.spans.append(record)
+    tracing = run.trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    run._open.append([record, 0])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _, inner_peak = run._open.pop()
+        if tracing and tracemalloc.is_tracing():
+            # Spans inside this one reset the peak, so take the highest of
+            # theirs as well
+            peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+            record["peak_mb"] = max(peak - baseline, 0) / 1024 ** 2
+            if run._open:
+                run._open[-1][1] = max(run._open[-1][1], peak)
+            tracemalloc.reset_peak()
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as a span.
+
+    Parameters:
+    ----------
+    name: str
+        Stage name shown in the panel
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_fragment(name):
+    """
+    Decorator turning a function into a streamlit fragment, recorded as a
+    span when it runs as part of the page and as a run of its own, named
+    after the page and the fragment, when it reruns by itself.
+
+    Parameters:
+    ----------
+    name: str
+        Stage name shown in the panel
+    """
+    def decorate(func):
+        @st.fragment
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_run() is not None:
+                with span(name):
+                    return func(*args, **kwargs)
+
+            run = _new_run(f"{st.session_state.get('instrumentation_page', '')} - {name}")
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _local.run = None
+                run.finish()
+                _record(run, TIMING_LOG)
+        return wrapper
+    return decorate
+
+
+def write_log(run, path):
+    """
+    Append a run to a JSON lines file.
+    """
+    line = json.dumps(run.to_dict())
+    with _log_lock, open(path, "a") as f:
+        f.write(line + "\n")
+
+
+def span_table(run):
+    """
+    A run's spans as a table, in the order they started, with nested spans
+    indented under the span they ran in.
+
+    Returns:
+    --------
+    pd.DataFrame
+    """
+    total = run.seconds
+    table = pd.DataFrame(run.spans, columns=["name", "depth", "seconds", "peak_mb"])
+    return pd.DataFrame({
+        "Stage": ["\u2003" * depth + name for name, depth in zip(table["name"], table["depth"])],
+        "Time (ms)": table["seconds"] * 1000,
+        "Share of run": table["seconds"] / total if total else 0.0,
+        "Peak memory (MB)": table["peak_mb"],
+    })
+
+
+def instrumentation_panel(log_path=TIMING_LOG):
+    """
+    Finish the current page run, showing its stages in a sidebar expander
+    and appending it to the log file if there is one.
+
+    The run is also kept in st.session_state["instrumentation_last_run"].
+
+    Parameters:
+    ----------
+    log_path: str
+        JSON lines file to append the run to, or None
+    """
+    run = current_run()
+    _local.run = None
+    if run is None:
+        return
+    run.finish()
+
+    with st.sidebar.expander("Performance"):
+        st.markdown(f"{run.page}: {run.seconds * 1000:,.0f} ms in total")
+        if run.spans:
+            st.dataframe(span_table(run), hide_index=True, use_container_width=True,
+                         column_config={"Time (ms)": st.column_config.NumberColumn(format="%.1f"),
+                                        "Share of run": st.column_config.NumberColumn(format="percent"),
+                                        "Peak memory (MB)": st.column_config.NumberColumn(format="%.2f")})
+        st.checkbox("Trace memory peaks", key="instrumentation_trace_memory",
+                    help="Applies from the next run. Tracing slows down every session while it is on.")
+
+    if run.trace_memory and not st.session_state.get("instrumentation_trace_memory", False):
+        # Switched off during this run
+        _set_memory_tracing(False)
+
+    _record(run, log_path)
+
+
+def _record(run, log_path):
+    st.session_state["instrumentation_last_run"] = run.to_dict()
+    if log_path:
+        write_log(run, log_path)
@@ -0,0 +1,517 @@
+"""
+Node positions computed on the server, for display with the cytoscape
+"preset" layout.
+
+Browser-side force layouts start from scratch on every render, give a
+different picture each time, and can freeze the browser on large graphs.
+These layouts are computed with NumPy, cached per graph and filter state,
+and warm-started from the previous positions when the filters change, so
+nodes stay roughly where they were.
+
+Positions are returned as dicts of node to (x, y), scaled to fit within
+[-1, 1].
+"""
+import numpy as np
+import streamlit as st
+
+from instrumentation import timed
+from result_cache import ResultCache
+
+LAYOUT_CACHE_MB = 32
+
+LAYOUT_SEED = 42
+
+LAYOUTS = {
+    "force": "Force-directed (Fruchterman-Reingold)",
+    "circular": "Circular",
+    "community": "Grouped by community",
+}
+
+# Prefix for the server-side layouts in the pages' layout options, to tell
+# them apart from the cytoscape.js layouts
+PRECOMPUTED_PREFIX = "precomputed "
+
+# force_layout's "auto" method switches from exact pairwise repulsion to the
+# Barnes-Hut approximation above this many nodes
+BARNES_HUT_NODE_THRESHOLD = 1_000
+
+# Rows of the pairwise repulsion calculated at a time, to bound the memory
+# used on large graphs
+_REPULSION_BLOCK = 1_024
+
+# The quadtree is made deep enough for about _LEAF_SIZE nodes per cell at
+# the deepest level, and deeper still while any cell there holds more than
+# _MAX_LEAF_NODES (nodes that drift away from the rest squash the others
+# into a few cells), up to _MAX_TREE_DEPTH levels
+_LEAF_SIZE = 4
+_MAX_LEAF_NODES = 32
+_MAX_TREE_DEPTH = 20
+
+# Padding around the dense quadtree cell lookup grid, wide enough for the
+# furthest cell in an interaction list, and the largest dense lookup grid
+# to build before switching to a binary search
+_LOOKUP_PADDING = 3
+_MAX_DENSE_LOOKUP = 4_000_000
+
+
+@st.cache_resource(show_spinner=False)
+def layout_cache():
+    """
+    Return the process-wide cache of computed layouts.
+
+    Returns:
+    --------
+    ResultCache
+    """
+    return ResultCache(max_bytes=LAYOUT_CACHE_MB * 1024 ** 2)
+
+
+def _rescale(positions):
+    """
+    Centre positions on the origin and scale them to fit within [-1, 1].
+    """
+    positions = positions - positions.mean(axis=0)
+    extent = np.abs(positions).max()
+    if extent > 0:
+        positions = positions / extent
+    return positions
+
+
+def _as_dict(nodes, positions):
+    return dict(zip(nodes, map(tuple, positions.tolist())))
+
+
+def _initial_positions(G, nodes, pos, rng):
+    """
+    Starting positions for a force layout: the given position of every node
+    that has one, the mean position of its placed neighbours for a node
+    that doesn't, and a random position otherwise.
+    """
+    positions = rng.uniform(-1, 1, size=(len(nodes), 2))
+    if not pos:
+        return positions, False
+
+    placed = np.array([node in pos for node in nodes])
+    if not placed.any():
+        return positions, False
+
+    positions[placed] = np.array([pos[node] for node, is_placed in zip(nodes, placed) if is_placed])
+    for i in np.flatnonzero(~placed).tolist():
+        neighbours = [pos[v] for v in G.adj[nodes[i]] if v in pos]
+        if neighbours:
+            positions[i] = np.mean(neighbours, axis=0) + rng.normal(scale=0.05, size=2)
+    return positions, True
+
+
+def _repulsion(positions, k):
+    """
+    Sum of the repulsive force on each node from every other node, k^2 / d,
+    calculated a block of rows at a time.
+    """
+    x, y = positions[:, 0], positions[:, 1]
+    displacement = np.empty_like(positions)
+    for start in range(0, len(positions), _REPULSION_BLOCK):
+        dx = x[start:start + _REPULSION_BLOCK, np.newaxis] - x
+        dy = y[start:start + _REPULSION_BLOCK, np.newaxis] - y
+        force = k * k / np.maximum(dx * dx + dy * dy, 1e-6)
+        displacement[start:start + len(dx), 0] = (dx * force).sum(axis=1)
+        displacement[start:start + len(dx), 1] = (dy * force).sum(axis=1)
+    return displacement
+
+
+def _cell_finder(cells, g):
+    """
+    Return a function mapping grid coordinates on a g x g grid to the index
+    of that cell in the sorted cell codes. Empty and off-grid cells (up to
+    _LOOKUP_PADDING cells off) map to len(cells), an extra cell with no mass.
+    """
+    m = len(cells)
+    size = g + 2 * _LOOKUP_PADDING
+    if size * size <= _MAX_DENSE_LOOKUP:
+        lookup = np.full(size * size, m, dtype=np.int64)
+        lookup[(cells // g + _LOOKUP_PADDING) * size + cells % g + _LOOKUP_PADDING] = np.arange(m)
+        return lambda x, y: lookup[(x + _LOOKUP_PADDING) * size + y + _LOOKUP_PADDING]
+
+    def find(x, y):
+        codes = x * g + y
+        index = np.minimum(np.searchsorted(cells, codes), m - 1)
+        found = (x >= 0) & (x < g) & (y >= 0) & (y < g) & (cells[index] == codes)
+        return np.where(found, index, m)
+    return find
+
+
+def _barnes_hut_repulsion(positions, k):
+    """
+    Repulsive force on each node as _repulsion, approximated with a
+    Barnes-Hut quadtree in O(n log n) rather than O(n^2).
+
+    The tree is built one level at a time by binning the nodes into a
+    2^L x 2^L grid. At each level, a cell feels the push of the cells that
+    are children of its parent's neighbours but not its own neighbours
+    (the standard well-separated interaction list), each treated as a
+    single mass at its centroid. The force at the receiving cell's centroid
+    and its gradient are then interpolated to each node in the cell. Nodes
+    in the same or neighbouring cells at the deepest level, where the
+    approximation would be poor, are summed pair by pair.
+    """
+    n = len(positions)
+    lower = positions.min(axis=0)
+    span = (positions.max(axis=0) - lower).max()
+    if span == 0:
+        return _repulsion(positions, k)
+
+    # Square bounding box, scaled to [0, 1)
+    unit = (positions - lower) / (span * (1 + 1e-9))
+    depth = int(np.clip(np.ceil(np.log(n / _LEAF_SIZE) / np.log(4)), 2, _MAX_TREE_DEPTH))
+    kk = k * k
+
+    displacement = np.zeros_like(positions)
+    level = 1
+    while True:
+        level += 1
+        g = 1 << level
+        grid = (unit * g).astype(np.int64)
+        cells, cell_of = np.unique(grid[:, 0] * g + grid[:, 1], return_inverse=True)
+        m = len(cells)
+
+        # Cell masses and centroids, plus the empty cell the lookup points to
+        # for missing neighbours, placed far enough away to have no effect
+        mass = np.bincount(cell_of, minlength=m + 1).astype(np.float64)
+        centroid = np.full((m + 1, 2), 1e9)
+        centroid[:m, 0] = np.bincount(cell_of, positions[:, 0], m) / mass[:m]
+        centroid[:m, 1] = np.bincount(cell_of, positions[:, 1], m) / mass[:m]
+
+        find = _cell_finder(cells, g)
+        cx, cy = cells // g, cells % g
+        px, py = cx & 1, cy & 1
+
+        # Force on each cell's centroid and its Jacobian (dFx/dx, dFx/dy = dFy/dx, dFy/dy)
+        fx, fy = np.zeros(m), np.zeros(m)
+        jxx, jxy, jyy = np.zeros(m), np.zeros(m), np.zeros(m)
+        for a in range(-2, 4):
+            ox = a - px
+            for b in range(-2, 4):
+                oy = b - py
+                other = find(cx + ox, cy + oy)
+                # Neighbouring cells are handled at the next level down
+                other[(np.abs(ox) <= 1) & (np.abs(oy) <= 1)] = m
+
+                rx = centroid[:m, 0] - centroid[other, 0]
+                ry = centroid[:m, 1] - centroid[other, 1]
+                distance_sq = rx * rx + ry * ry
+                scale = kk * mass[other] / distance_sq
+                slope = 2 * scale / distance_sq
+                fx += rx * scale
+                fy += ry * scale
+                jxx += scale - slope * rx * rx
+                jxy -= slope * rx * ry
+                jyy += scale - slope * ry * ry
+
+        dx = positions[:, 0] - centroid[cell_of, 0]
+        dy = positions[:, 1] - centroid[cell_of, 1]
+        displacement[:, 0] += fx[cell_of] + jxx[cell_of] * dx + jxy[cell_of] * dy
+        displacement[:, 1] += fy[cell_of] + jxy[cell_of] * dx + jyy[cell_of] * dy
+
+        if level >= _MAX_TREE_DEPTH or (level >= depth and mass.max() <= _MAX_LEAF_NODES):
+            break
+
+    # Exact forces between nodes in the same or neighbouring leaf cells. Nodes
+    # are sorted by cell, so each cell's nodes are a contiguous range. Each
+    # pair of neighbouring cells is visited once, from the cell to its left
+    # or below, and the force applied to both nodes.
+    order = np.argsort(cell_of, kind="stable")
+    x, y = positions[order, 0], positions[order, 1]
+    sorted_cells = cell_of[order]
+    counts = mass.astype(np.int64)
+    starts = np.cumsum(counts) - counts
+
+    near_x, near_y = np.zeros(n), np.zeros(n)
+    for ox, oy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        neighbour = find(cx + ox, cy + oy)[sorted_cells]
+        pairs = counts[neighbour]
+        i = np.repeat(np.arange(n), pairs)
+        j = (np.repeat(starts[neighbour], pairs)
+             + np.arange(len(i)) - np.repeat(np.cumsum(pairs) - pairs, pairs))
+        if ox == oy == 0:
+            # Within a cell, count each pair once
+            keep = i < j
+            i, j = i[keep], j[keep]
+
+        dx, dy = x[i] - x[j], y[i] - y[j]
+        strength = kk / np.maximum(dx * dx + dy * dy, 1e-6)
+        dx *= strength
+        dy *= strength
+        near_x += np.bincount(i, dx, n) - np.bincount(j, dx, n)
+        near_y += np.bincount(i, dy, n) - np.bincount(j, dy, n)
+
+    near = np.column_stack([near_x, near_y])
+    displacement[order] += near
+    return displacement
+
+
+def force_layout(G, pos=None, iterations=50, weight=None, seed=LAYOUT_SEED, tol=1e-4, method="auto"):
+    """
+    Force-directed layout using the Fruchterman-Reingold algorithm, as
+    nx.spring_layout, with every step vectorised in NumPy.
+
+    The positions are returned in the same form as the networkx layout
+    functions, so they can be drawn with nx.draw or plotted with plotly as
+    well as passed to cytoscape with preset_layout.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos: dict
+        Node to (x, y) to start from, e.g. the layout before the filters
+        changed. Nodes without a position start next to their neighbours.
+        When given, the layout starts cooler so that nodes move less.
+    iterations: int
+        Maximum number of iterations
+    weight: str
+        Edge attribute that strengthens the pull between nodes. None to
+        treat every edge equally.
+    seed: int
+        Seed for the random starting positions
+    tol: float
+        Stop once the average distance moved by a node in an iteration is
+        below this
+    method: str
+        "exact" to sum the repulsion between every pair of nodes,
+        "barnes_hut" to approximate it with a quadtree, or "auto" to use
+        Barnes-Hut above BARNES_HUT_NODE_THRESHOLD nodes
+
+    Returns:
+    --------
+    dict
+        Node to (x, y)
+    """
+    nodes = list(G)
+    n = len(nodes)
+    if n == 0:
+        return {}
+    if n == 1:
+        return {nodes[0]: (0.0, 0.0)}
+
+    if method == "auto":
+        method = "barnes_hut" if n > BARNES_HUT_NODE_THRESHOLD else "exact"
+    if method not in ("exact", "barnes_hut"):
+        raise ValueError(f"Unknown force layout method '{method}'. Choose from exact, barnes_hut or auto.")
+    repulsion = _barnes_hut_repulsion if method == "barnes_hut" else _repulsion
+
+    rng = np.random.default_rng(seed)
+    positions, warm = _initial_positions(G, nodes, pos, rng)
+
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = list(G.edges(data=weight, default=1)) if weight else [(u, v, 1) for u, v in G.edges]
+    rows = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+    strength = np.fromiter((w for _, _, w in edges), dtype=np.float64, count=len(edges))
+    if len(edges):
+        strength /= strength.max()
+
+    k = np.sqrt(1.0 / n)
+    temperature = 0.02 if warm else 0.1
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        displacement = repulsion(positions, k)
+
+        delta = positions[rows] - positions[cols]
+        distance = np.sqrt((delta ** 2).sum(axis=1))
+        pull = delta * (strength * distance / k)[:, np.newaxis]
+        # Each edge pulls its two ends towards each other
+        for axis in (0, 1):
+            displacement[:, axis] += (np.bincount(cols, pull[:, axis], n)
+                                      - np.bincount(rows, pull[:, axis], n))
+
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 0.01)
+        step = displacement * (temperature / length)[:, np.newaxis]
+        positions += step
+
+        temperature -= cooling
+        if np.sqrt((step ** 2).sum(axis=1)).mean() < tol:
+            break
+
+    return _as_dict(nodes, _rescale(positions))
+
+
+def circular_layout(G):
+    """
+    Nodes evenly spaced around a circle, in G.nodes order.
+
+    Returns:
+    --------
+    dict
+        Node to (x, y)
+    """
+    nodes = list(G)
+    angles = np.linspace(0, 2 * np.pi, len(nodes), endpoint=False)
+    return _as_dict(nodes, np.column_stack([np.cos(angles), np.sin(angles)]))
+
+
+def community_layout(G, pos=None, attribute="Community", seed=LAYOUT_SEED):
+    """
+    Each community laid out by force_layout in its own area, with the areas
+    arranged around a circle and sized by the number of members.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos: dict
+        Previous positions to warm-start each community from
+    attribute: str
+        Node attribute holding the community. Nodes without it are grouped
+        together.
+    seed: int
+
+    Returns:
+    --------
+    dict
+        Node to (x, y)
+    """
+    groups = {}
+    for node, community in G.nodes(data=attribute, default=-1):
+        groups.setdefault(community, []).append(node)
+    if len(groups) < 2:
+        return force_layout(G, pos, seed=seed)
+
+    members = sorted(groups.values(), key=len, reverse=True)
+    radii = np.sqrt([len(group) for group in members])
+    # Space the areas around the circle in proportion to their size
+    angles = 2 * np.pi * (np.cumsum(radii) - radii / 2) / radii.sum()
+    ring = radii.sum() / np.pi
+    extent = ring + radii.max()
+
+    layout = {}
+    for group, radius, angle in zip(members, radii, angles):
+        centre = ring * np.array([np.cos(angle), np.sin(angle)])
+        group_pos = None
+        previous = [node for node in group if node in pos] if pos else []
+        if previous:
+            # Keep the community where it was and start from the shape it had
+            previous_positions = np.array([pos[node] for node in previous])
+            centre = extent * previous_positions.mean(axis=0)
+            group_pos = _as_dict(previous, _rescale(previous_positions))
+        for node, xy in force_layout(G.subgraph(group), group_pos, seed=seed).items():
+            layout[node] = centre + radius * np.array(xy) * 0.9
+
+    nodes = list(G)
+    return _as_dict(nodes, _rescale(np.array([layout[node] for node in nodes])))
+
+
+@timed("compute layout")
+def compute_layout(G, layout, pos=None, seed=LAYOUT_SEED):
+    """
+    Node positions from one of LAYOUTS.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    layout: str
+        One of LAYOUTS
+    pos: dict
+        Previous positions to warm-start from, where the layout uses them
+    seed: int
+
+    Returns:
+    --------
+    dict
+        Node to (x, y)
+    """
+    if layout == "force":
+        return force_layout(G, pos, seed=seed)
+    if layout == "circular":
+        return circular_layout(G)
+    if layout == "community":
+        return community_layout(G, pos, seed=seed)
+    raise ValueError(f"Unknown layout '{layout}'. Choose from {', '.join(LAYOUTS)}.")
+
+
+@timed("layout")
+def load_layout(G, key, layout, session_key=None):
+    """
+    Node positions for a graph.
+
+    When session_key is given and this session has drawn a layout under it
+    before, the new layout is warm-started from those positions, so moving a
+    filter slider keeps the picture stable. Warm-started positions depend on
+    what the session drew before, so they are kept in the session. Otherwise
+    the layout is started from LAYOUT_SEED and cached under key for every
+    session. The returned dict must not be modified.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    key: tuple
+        Hashable key identifying G, for example the dataset's graph_key
+        together with the filter settings that produced G
+    layout: str
+        One of LAYOUTS
+    session_key: str
+        Name for this session's previous positions, e.g. the component key
+
+    Returns:
+    --------
+    dict
+        Node to (x, y)
+    """
+    state_key = f"layout_positions-{session_key}"
+    previous = None
+    if session_key is not None and state_key in st.session_state:
+        previous_layout, previous_key, previous = st.session_state[state_key]
+        if previous_layout == layout and previous_key == key:
+            return previous
+        if previous_layout != layout:
+            previous = None
+
+    if previous is None:
+        positions = layout_cache().get_or_compute(("layout", layout) + tuple(key),
+                                                  lambda: compute_layout(G, layout))
+    else:
+        positions = compute_layout(G, layout, previous)
+
+    if session_key is not None:
+        st.session_state[state_key] = (layout, key, positions)
+    return positions
+
+
+def layout_options(browser_layouts):
+    """
+    The given cytoscape.js layouts, followed by the server-side layouts, as
+    options for a layout picker. The first browser layout stays the default.
+    """
+    return list(browser_layouts) + [PRECOMPUTED_PREFIX + layout for layout in LAYOUTS]
+
+
+def precomputed_layout_name(option):
+    """
+    The LAYOUTS name of a layout picker option, or None if the option is a
+    cytoscape.js layout.
+    """
+    if option.startswith(PRECOMPUTED_PREFIX):
+        return option[len(PRECOMPUTED_PREFIX):]
+    return None
+
+
+def preset_layout(positions, spacing=50):
+    """
+    A cytoscape "preset" layout placing nodes at the given positions.
+
+    Parameters:
+    ----------
+    positions: dict
+        Node to (x, y), within [-1, 1]
+    spacing: float
+        Scale so that nodes are roughly this many pixels apart
+
+    Returns:
+    --------
+    dict
+        Layout to pass to the cytoscape component
+    """
+    scale = spacing * float(np.sqrt(max(len(positions), 1)))
+    return {"name": "preset",
+            "positions": {str(node): {"x": x * scale, "y": y * scale}
+                          for node, (x, y) in positions.items()},
+            "fit": True,
+            "padding": 30}
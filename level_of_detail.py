@@ -0,0 +1,279 @@
+"""
+Level-of-detail reduction of graphs that are too large to draw in full.
+
+Above a render budget of nodes and edges, reduce_graph keeps the most
+connected nodes and the heaviest edges between them. The edges it drops
+between two groups of nodes (communities, or areas of the drawing) are
+folded into one bundle edge per pair of groups, drawn between each group's
+best connected node, so the overall structure stays visible.
+
+Detail is brought back by focusing on nodes: the edges of focused nodes,
+and their neighbours, are kept ahead of everything else. Pages focus on the
+nodes the user selected in the chart, so selecting part of the drawing
+re-expands it in full on the next run.
+"""
+import networkx as nx
+import numpy as np
+import streamlit as st
+
+from instrumentation import timed
+
+# Cytoscape.js slows down beyond a couple of thousand elements
+MAX_RENDER_EDGES = 2_000
+MAX_RENDER_NODES = 1_000
+
+BUNDLE_ATTRIBUTE = "Bundle"
+
+
+def _node_groups(G, nodes, groups):
+    """
+    Group of each node as an integer code, from a node attribute name or a
+    dict of node to group. Nodes without a group share one.
+    """
+    if isinstance(groups, str):
+        values = (G.nodes[node].get(groups) for node in nodes)
+    else:
+        values = (groups.get(node) for node in nodes)
+    codes = {}
+    return np.fromiter((codes.setdefault(value, len(codes)) for value in values),
+                       dtype=np.int64, count=len(nodes))
+
+
+@timed("level of detail")
+def reduce_graph(G, max_edges=MAX_RENDER_EDGES, max_nodes=MAX_RENDER_NODES, weight="Weight",
+                 groups="Community", focus=()):
+    """
+    Reduce a graph to at most max_nodes nodes and max_edges edges for drawing.
+
+    Graphs within budget are returned unchanged. Otherwise:
+
+    - Nodes are kept in order of focus (focused nodes, then their
+      neighbours), then weighted degree.
+    - Edges between kept nodes are kept in order of focus (edges of a
+      focused node), then weight, then the degree of their ends.
+    - Dropped edges between different groups are aggregated into one bundle
+      edge per pair of groups, between the best connected node of each. The
+      bundle has weight attribute set to the total weight, "BundledEdges" to
+      the number of edges in it, and "Bundle" to True. If the two nodes are
+      already linked, the bundle's weight and "BundledEdges" are added to
+      that edge instead. Each group's representative is kept even if it
+      takes the graph over max_nodes.
+
+    Every kept node gets a "HiddenEdges" attribute counting its edges that
+    were dropped, whether or not they went into a bundle.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    max_edges: int
+        Maximum number of edges to keep, not counting bundles
+    max_nodes: int
+        Maximum number of nodes to keep
+    weight: str
+        Edge attribute ranking the edges. Edges without it count as 1.
+    groups: str, dict or None
+        Node attribute, or dict of node to group, to bundle dropped edges by.
+        None drops them without bundling.
+    focus: iterable
+        Nodes to show in full detail. Nodes not in G are ignored.
+
+    Returns:
+    --------
+    nx.Graph
+        G itself if it's within budget, otherwise a new frozen graph of the
+        same type, with a summary of the reduction in
+        H.graph["level_of_detail"]
+    """
+    n_nodes, n_edges = G.number_of_nodes(), G.number_of_edges()
+    if n_nodes <= max_nodes and n_edges <= max_edges:
+        return G
+
+    nodes = list(G)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = list(G.edges(data=True))
+    sources = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=n_edges)
+    targets = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=n_edges)
+    weights = np.fromiter((data.get(weight, 1) for _, _, data in edges), dtype=np.float64, count=n_edges)
+
+    degree = np.bincount(sources, minlength=n_nodes) + np.bincount(targets, minlength=n_nodes)
+    strength = (np.bincount(sources, weights, minlength=n_nodes)
+                + np.bincount(targets, weights, minlength=n_nodes))
+
+    focus_key = tuple(sorted((node for node in set(focus) if node in index), key=str))
+    focused = np.zeros(n_nodes, dtype=bool)
+    focused[[index[node] for node in focus_key]] = True
+
+    keep_node = np.ones(n_nodes, dtype=bool)
+    if n_nodes > max_nodes:
+        near = focused.copy()
+        near[sources[focused[targets]]] = True
+        near[targets[focused[sources]]] = True
+        # lexsort sorts by the last key first
+        order = np.lexsort((-strength, ~near, ~focused))
+        keep_node[:] = False
+        keep_node[order[:max_nodes]] = True
+
+    if groups is not None:
+        group = _node_groups(G, nodes, groups)
+        n_groups = group.max() + 1
+        # Each group is represented by its best connected node, preferring
+        # one that is already kept
+        order = np.lexsort((-strength, ~keep_node))
+        group_ids, first = np.unique(group[order], return_index=True)
+        representative = np.empty(n_groups, dtype=np.int64)
+        representative[group_ids] = order[first]
+        keep_node[representative[group_ids]] = True
+
+    candidates = np.flatnonzero(keep_node[sources] & keep_node[targets])
+    if len(candidates) > max_edges:
+        s, t = sources[candidates], targets[candidates]
+        order = np.lexsort((-(degree[s] + degree[t]), -weights[candidates], ~(focused[s] | focused[t])))
+        candidates = np.sort(candidates[order[:max_edges]])
+    dropped = np.ones(n_edges, dtype=bool)
+    dropped[candidates] = False
+
+    hidden = (np.bincount(sources[dropped], minlength=n_nodes)
+              + np.bincount(targets[dropped], minlength=n_nodes))
+
+    H = G.__class__()
+    H.graph.update(G.graph)
+    H.add_nodes_from((nodes[i], {**G.nodes[nodes[i]], "HiddenEdges": int(hidden[i])})
+                     for i in np.flatnonzero(keep_node))
+    # Copied, so merging a bundle into an edge can't change G
+    H.add_edges_from((u, v, dict(data)) for u, v, data in (edges[i] for i in candidates))
+
+    bundles = bundled_edges = 0
+    if groups is not None:
+        gs, gt = group[sources[dropped]], group[targets[dropped]]
+        if not G.is_directed():
+            gs, gt = np.minimum(gs, gt), np.maximum(gs, gt)
+        between = gs != gt
+        pairs = gs[between] * n_groups + gt[between]
+        pair_ids, inverse, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+        totals = np.bincount(inverse, weights[dropped][between], minlength=len(pair_ids))
+
+        for pair, count, total in zip(pair_ids, counts, totals):
+            u, v = nodes[representative[pair // n_groups]], nodes[representative[pair % n_groups]]
+            if H.has_edge(u, v):
+                # The representatives are linked directly as well, so the
+                # bundle is added to that edge
+                data = H.edges[u, v]
+                data.update({weight: data.get(weight, 1) + float(total), "BundledEdges": int(count)})
+            else:
+                H.add_edge(u, v, **{weight: float(total), "BundledEdges": int(count), BUNDLE_ATTRIBUTE: True})
+        bundles, bundled_edges = len(pair_ids), int(counts.sum())
+
+    H.graph["level_of_detail"] = {
+        "nodes": n_nodes,
+        "edges": n_edges,
+        "shown_nodes": H.number_of_nodes(),
+        "shown_edges": len(candidates),
+        "bundles": bundles,
+        "bundled_edges": bundled_edges,
+        "key": (max_edges, max_nodes, focus_key),
+    }
+    return nx.freeze(H)
+
+
+def level_of_detail_key(H):
+    """
+    Hashable key for the reduction that produced H, to add to cache keys for
+    anything computed from it. Empty if H wasn't reduced.
+    """
+    return tuple(H.graph.get("level_of_detail", {}).get("key", ()))
+
+
+def describe_level_of_detail(H):
+    """
+    Describe the reduction that produced H.
+
+    Returns:
+    --------
+    str
+        Empty if H wasn't reduced
+    """
+    info = H.graph.get("level_of_detail")
+    if info is None:
+        return ""
+    description = (f"Showing {info['shown_nodes']:,} of {info['nodes']:,} nodes and the heaviest "
+                   f"{info['shown_edges']:,} of {info['edges']:,} links.")
+    if info["bundles"]:
+        description += (f" {info['bundled_edges']:,} more links are drawn as {info['bundles']:,} "
+                        f"bundles between groups.")
+    return description + " Select part of the graph to show it in full."
+
+
+def spatial_groups(pos, bins=8):
+    """
+    Group nodes by the cell of a bins x bins grid over their positions, for
+    bundling edges by area of the drawing.
+
+    Parameters:
+    ----------
+    pos: dict
+        Node to (x, y)
+    bins: int
+
+    Returns:
+    --------
+    dict
+        Node to cell number
+    """
+    nodes = list(pos)
+    xy = np.array([pos[node] for node in nodes], dtype=np.float64).reshape(len(nodes), 2)
+    low, high = xy.min(axis=0), xy.max(axis=0)
+    cells = ((xy - low) / np.where(high > low, high - low, 1) * bins).astype(np.int64).clip(0, bins - 1)
+    return dict(zip(nodes, (cells[:, 0] * bins + cells[:, 1]).tolist()))
+
+
+def nodes_in_box(pos, x_range, y_range):
+    """
+    Nodes positioned within a rectangle.
+
+    Parameters:
+    ----------
+    pos: dict
+        Node to (x, y)
+    x_range, y_range: tuple of (float, float)
+        The rectangle's extent, in either order
+
+    Returns:
+    --------
+    list
+    """
+    (x0, x1), (y0, y1) = sorted(x_range), sorted(y_range)
+    return [node for node, (x, y) in pos.items() if x0 <= x <= x1 and y0 <= y <= y1]
+
+
+def selected_nodes(key):
+    """
+    Nodes selected in the cytoscape component with the given key on the
+    previous run, which reruns the page when the selection changes.
+    """
+    selection = st.session_state.get(key)
+    if not isinstance(selection, dict):
+        return ()
+    return tuple(selection.get("nodes", ()))
+
+
+def level_of_detail_settings(max_edges=MAX_RENDER_EDGES, max_nodes=MAX_RENDER_NODES):
+    """
+    Add sidebar controls for the render budget.
+
+    Parameters:
+    ----------
+    max_edges, max_nodes: int
+        Defaults for the controls
+
+    Returns:
+    --------
+    dict
+        max_edges and max_nodes, to pass on to reduce_graph
+    """
+    with st.sidebar.expander("Level of detail"):
+        return {
+            "max_edges": st.number_input("Maximum links to draw", min_value=100, value=max_edges, step=100,
+                                         help="Above this the heaviest links are drawn, and the rest are "
+                                              "bundled between groups"),
+            "max_nodes": st.number_input("Maximum nodes to draw", min_value=100, value=max_nodes, step=100),
+        }
@@ -2,9 +2,11 @@ import networkx as nx
 import pandas as pd
 import numpy as np
 import streamlit as st
-import matplotlib.pyplot as plt
 from helper_functions import add_logo
-import gc
+from graph_pipeline import graph_key, load_graph
+from raster import render_graph
+from static_render import network_image
+from instrumentation import instrumentation_panel, start_run
 
 
 st.set_page_config(
@@ -14,6 +16,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+start_run("Matplotlib")
+
 add_logo()
 
 with open("style.css") as css:
@@ -21,8 +25,6 @@ with open("style.css") as css:
 
 st.title("Static 2D Example: networkx and matplotlib")
 
-gc.collect()
-
 
 st.markdown(
     """
@@ -42,33 +44,8 @@ edges = {'Source':['1','1','2','2','3','3','4','4','5','5'],
 nodes = pd.DataFrame(nodes)
 edges = pd.DataFrame(edges)
 
-#Create graph function - networkX
-def create_graph(nodeData, edgeData):
-    ## Initiate the graph object
-    G = nx.DiGraph()
-    
-    ## Tranform the data into the correct format for use with NetworkX
-    # Node tuples (ID, dict of attributes)
-    idList = nodeData['ID'].tolist()
-    labels =  pd.DataFrame(nodeData['Label'])
-    labelDicts = labels.to_dict(orient='records')
-    nodeTuples = [tuple(r) for r in zip(idList,labelDicts)]
-    
-    # Edge tuples (Source, Target, dict of attributes)
-    sourceList = edgeData['Source'].tolist()
-    targetList = edgeData['Target'].tolist()
-    weights = pd.DataFrame(edgeData['Weight'])
-    weightDicts = weights.to_dict(orient='records')
-    edgeTuples = [tuple(r) for r in zip(sourceList,targetList,weightDicts)]
-    
-    ## Add the nodes and edges to the graph
-    G.add_nodes_from(nodeTuples)
-    G.add_edges_from(edgeTuples)
-    
-    return G
-
 # Create the graph object
-G = create_graph(nodes,edges)
+G = load_graph(nodes, edges, directed=True)
 # Define the node positions
 pos = nx.circular_layout(G)
 # Define the attribute inputs
@@ -85,14 +62,27 @@ alpha = 0.8
 # Draw the graph and add edge labels
 # nx.draw_networkx_edge_labels(G,pos,edge_labels=e_size)
 
-# Has to be written in this way to be threadsafe for streamlit
-# if you just try to use the original code of 
-# plot = nx.draw(G, pos, node_size=n_size, node_color=n_col, node_shape=shape, alpha=alpha, edge_color=e_col,arrows=True)
-# st.pyplot(plot)
-# You will receive a warning as this is a deprecated approach 
-
-fig, ax = plt.subplots()
-
-ax = nx.draw(G, pos, node_size=n_size, node_color=n_col, node_shape=shape, alpha=alpha, edge_color=e_col,arrows=True)
-
-st.pyplot(fig)
+# Drawn on a standalone matplotlib Figure rather than through pyplot, which
+# keeps every figure it creates in a global registry until it is closed.
+# The image is cached for this graph and style, so reruns reuse it.
+style = dict(node_size=n_size, node_color=n_col, node_shape=shape, alpha=alpha, edge_color=e_col, arrows=True)
+image_key = (graph_key(G), "circular")
+
+# The raster renderer draws the whole graph into a single image on the
+# server, so it takes about as long for millions of edges as for thousands
+renderer = st.radio("Renderer", ["matplotlib", "raster"], horizontal=True,
+                    help="Raster rendering is for graphs too large to draw a node or link at a time")
+
+if renderer == "raster":
+    color_by = st.radio("Colour links by", ["community", "weight"], horizontal=True,
+                        format_func=lambda option: "node colour" if option == "community" else option)
+    st.image(render_graph(G, pos, color_by=color_by, node_colors=n_col,
+                          # matplotlib node sizes are areas in square points
+                          node_radius=np.sqrt(n_size) / 1.5,
+                          width=600, height=450))
+else:
+    st.image(network_image(G, pos, image_key, **style))
+    st.download_button("Download as SVG", network_image(G, pos, image_key, fmt="svg", **style),
+                       file_name="network.svg", mime="image/svg+xml")
+
+instrumentation_panel()
@@ -4,6 +4,10 @@ import numpy as np
 import streamlit as st
 import plotly.graph_objects as go
 from helper_functions import add_logo
+from plotly_traces import bundle_trace, network_traces, selected_box
+from level_of_detail import (describe_level_of_detail, level_of_detail_settings, nodes_in_box,
+                             reduce_graph, spatial_groups)
+from instrumentation import instrumentation_panel, span, start_run
 import gc
 
 st.set_page_config(
@@ -13,6 +17,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+start_run("Plotly")
+
 add_logo()
 
 with open("style.css") as css:
@@ -20,6 +26,14 @@ with open("style.css") as css:
 
 st.title("Semi-Interactive 2D Example: networkx and plotly")
 
+
+@st.cache_resource(show_spinner=False)
+def load_geometric_graph(n_nodes, seed=0):
+    # The radius shrinks with the number of nodes so each has around the
+    # same number of neighbours as in the original 200 node example
+    return nx.freeze(nx.random_geometric_graph(n_nodes, 0.125 * np.sqrt(200 / n_nodes), seed=seed))
+
+
 gc.collect()
 
 st.markdown(
@@ -71,38 +85,24 @@ st.markdown(
 # pos = nx.circular_layout(G)
 
 
-G = nx.random_geometric_graph(200, 0.125)
-
-edge_x = []
-edge_y = []
-for edge in G.edges():
-    x0, y0 = G.nodes[edge[0]]['pos']
-    x1, y1 = G.nodes[edge[1]]['pos']
-    edge_x.append(x0)
-    edge_x.append(x1)
-    edge_x.append(None)
-    edge_y.append(y0)
-    edge_y.append(y1)
-    edge_y.append(None)
-
-edge_trace = go.Scatter(
-    x=edge_x, y=edge_y,
-    line=dict(width=0.5, color='#888'),
-    hoverinfo='none',
-    mode='lines')
-
-node_x = []
-node_y = []
-for node in G.nodes():
-    x, y = G.nodes[node]['pos']
-    node_x.append(x)
-    node_y.append(y)
-
-node_trace = go.Scatter(
-    x=node_x, y=node_y,
-    mode='markers',
-    hoverinfo='text',
-    marker=dict(
+n_nodes = st.select_slider("Number of nodes", options=[200, 2_000, 20_000, 100_000], value=200)
+
+with span("geometric graph"):
+    G = load_geometric_graph(n_nodes)
+pos = dict(G.nodes(data="pos"))
+
+# Above the render budget only the best connected nodes and links are drawn,
+# with the rest bundled between areas of the plot. A box selected on the
+# previous run is drawn in full.
+box = selected_box(st.session_state.get("network"))
+G_view = reduce_graph(G, **level_of_detail_settings(max_edges=5_000, max_nodes=20_000),
+                      groups=spatial_groups(pos), focus=nodes_in_box(pos, *box) if box else ())
+
+# Edges are drawn as one NaN-separated line, built in a single array
+# operation, and larger graphs switch to WebGL rendering
+edge_trace, node_trace = network_traces(
+    G_view,
+    node_marker=dict(
         showscale=True,
         # colorscale options
         #'Greys' | 'YlGnBu' | 'Greens' | 'YlOrRd' | 'Bluered' | 'RdBu' |
@@ -110,30 +110,19 @@ node_trace = go.Scatter(
         #'Hot' | 'Blackbody' | 'Earth' | 'Electric' | 'Viridis' |
         colorscale='YlGnBu',
         reversescale=True,
-        color=[],
         size=10,
         colorbar=dict(
             thickness=15,
-            title='Node Connections',
-            xanchor='left',
-            titleside='right'
+            title=dict(text='Node Connections', side='right'),
+            xanchor='left'
         ),
         line_width=2))
 
+bundles = bundle_trace(G_view)
 
-node_adjacencies = []
-node_text = []
-for node, adjacencies in enumerate(G.adjacency()):
-    node_adjacencies.append(len(adjacencies[1]))
-    node_text.append('# of connections: '+str(len(adjacencies[1])))
-
-node_trace.marker.color = node_adjacencies
-node_trace.text = node_text
-
-fig = go.Figure(data=[edge_trace, node_trace],
+fig = go.Figure(data=[edge_trace] + ([bundles] if bundles else []) + [node_trace],
              layout=go.Layout(
-                title='<br>Network graph made with Python',
-                titlefont_size=16,
+                title=dict(text='<br>Network graph made with Python', font_size=16),
                 showlegend=False,
                 hovermode='closest',
                 margin=dict(b=20,l=5,r=5,t=40),
@@ -146,5 +135,14 @@ fig = go.Figure(data=[edge_trace, node_trace],
                 yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
                 )
 
-st.plotly_chart(fig,
-                use_container_width=True)
\ No newline at end of file
+with span("plotly chart"):
+    st.plotly_chart(fig,
+                    use_container_width=True,
+                    key="network",
+                    on_select="rerun",
+                    selection_mode="box")
+
+if describe_level_of_detail(G_view):
+    st.caption(describe_level_of_detail(G_view))
+
+instrumentation_panel()
@@ -4,6 +4,9 @@ import numpy as np
 import streamlit as st
 import matplotlib.pyplot as plt
 from helper_functions import add_logo
+from graph_pipeline import graph_key, load_graph
+from layouts import layout_options, load_layout, precomputed_layout_name, preset_layout
+from instrumentation import instrumentation_panel, span, start_run
 import gc
 from st_cytoscape_extra import cytoscape
 
@@ -14,6 +17,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+start_run("Cytoscape")
+
 add_logo()
 
 with open("style.css") as css:
@@ -53,48 +58,8 @@ edges = pd.DataFrame(edges)
 nodeData = nodes
 edgeData = edges
 
-#Create graph function - networkX
-def create_graph(nodeData, edgeData):
-    ## Initiate the graph object
-    G = nx.DiGraph()
-    
-    ## Tranform the data into the correct format for use with NetworkX
-    
-    # Node tuples (ID, dict of attributes)
-    idList = nodeData['ID'].tolist()
-    
-    labels =  pd.DataFrame(nodeData['Label'])
-    labelDicts = labels.to_dict(orient='records')
-
-    nodeTuples = [tuple(r) for r in zip(idList,labelDicts)]
-    
-    
-    # Edge tuples (Source, Target, dict of attributes)
-    sourceList = edgeData['Source'].tolist()
-    targetList = edgeData['Target'].tolist()
-    
-    weights = pd.DataFrame(edgeData['Weight'])
-    weightDicts = weights.to_dict(orient='records')
-    
-    edgeTuples = [tuple(r) for r in zip(sourceList,targetList,weightDicts)]
-    
-    ## Add the nodes and edges to the graph
-    G.add_nodes_from(nodeTuples)
-    G.add_edges_from(edgeTuples)
-
-    sizeDicts = {}
-    sizeDicts.update(zip(nodeData['ID'], nodeData['Size']))
-
-    colorDicts = {}
-    colorDicts.update(zip(nodeData['ID'], nodeData['Color']))
-
-    nx.set_node_attributes(G, sizeDicts, "Size")
-    nx.set_node_attributes(G, colorDicts, "Color")
-
-    return G
-
 # Create the graph object
-G = create_graph(nodes,edges)
+G = load_graph(nodes, edges, directed=True, node_attributes=("Label", "Size", "Color"))
 # Define the node positions
 # pos = nx.circular_layout(G)
 # Define the attribute inputs
@@ -124,7 +89,8 @@ alpha = 0.8
 
 # st.pyplot(fig)
 
-G_cs = nx.cytoscape_data(G)
+with span("cytoscape data"):
+    G_cs = nx.cytoscape_data(G)
 
 elements = G_cs['elements']
 
@@ -174,11 +140,21 @@ stylesheet = [
 ]
 
 layout = st.radio(label="Select layout",
-                  options=["fcose", "random", "grid", "circle", "concentric",
-                           "breadthfirst", "cose", "klay"], horizontal=True)
-
-selected = cytoscape(elements, 
-                     stylesheet, 
-                     key="graph", 
-                     layout={"name": layout}, 
-                     height="500px")
+                  options=layout_options(["fcose", "random", "grid", "circle", "concentric",
+                                          "breadthfirst", "cose", "klay"]), horizontal=True)
+
+# Layouts prefixed "precomputed" are calculated on the server and cached,
+# the rest are run by cytoscape.js in the browser
+if precomputed_layout_name(layout):
+    layout_dict = preset_layout(load_layout(G, (graph_key(G),), precomputed_layout_name(layout)))
+else:
+    layout_dict = {"name": layout}
+
+with span("cytoscape component"):
+    selected = cytoscape(elements, 
+                         stylesheet, 
+                         key="graph", 
+                         layout=layout_dict, 
+                         height="500px")
+
+instrumentation_panel()
@@ -1,8 +1,16 @@
 import networkx as nx
-import pandas as pd
-import numpy as np
 import streamlit as st
 from helper_functions import add_logo
+from graph_pipeline import built_graph_key, graph_key, is_enriched, load_dataset, load_enriched_graph_in_background
+from graph_filters import load_ego_network, session_threshold_filter
+from csr_graph import load_csr_graph
+from communities import community_index, community_settings, describe_communities
+from centrality import background_betweenness, betweenness_settings, describe_approximation, show_cache_stats
+from level_of_detail import (BUNDLE_ATTRIBUTE, describe_level_of_detail, level_of_detail_key,
+                             level_of_detail_settings, reduce_graph, selected_nodes)
+from layouts import layout_options, load_layout, precomputed_layout_name, preset_layout
+from instrumentation import instrumentation_panel, span, start_run, timed_fragment
+from background_jobs import wait_for_jobs
 import gc
 # from st_cytoscape import cytoscape
 from st_cytoscape_extra import cytoscape
@@ -15,6 +23,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+start_run("Complex Cytoscape")
+
 
 add_logo()
 
@@ -40,14 +50,9 @@ st.markdown(
     """
 )
 
-edges = pd.read_csv("data/got-s1-edges.csv")
-nodes = pd.read_csv("data/got-s1-nodes.csv").rename(columns={"Id": "ID"})
-
-total_interactions_node = pd.concat([edges[['Source', 'Weight']].groupby('Source').sum().reset_index(drop=False),
-                                     edges[['Target', 'Weight']].groupby('Target').sum().reset_index(drop=False).rename(columns={'Target':'Source'})]
-                                     ).groupby('Source').sum().rename(columns={'Weight':'TotalInteractions'})
-
-nodes = nodes.merge(total_interactions_node, how="left", left_on="ID", right_on="Source")
+# Read once per version of the files, with TotalInteractions added. The
+# dataset key identifies the files, so the tables aren't hashed on every run.
+nodes, edges, dataset_hash = load_dataset("data/got-s1-nodes.csv", "data/got-s1-edges.csv")
 # Create some simple graph data
 # nodes = {'ID':['1','2','3','4','5'],
 #          'Label':['Aspirin','Paracetamol','Ibuprofen','Codeine','Naproxen'],
@@ -66,74 +71,16 @@ edgeData = edges
 # t1 = [(list(i)) for i in c]
 
 
-#Create graph function - networkX
-def create_graph(nodeData, edgeData):
-    ## Initiate the graph object
-    G = nx.Graph()
-    # G = nx.DiGraph()
-    
-    ## Tranform the data into the correct format for use with NetworkX
-    
-    # Node tuples (ID, dict of attributes)
-    idList = nodeData['ID'].tolist()
-    
-    labels =  pd.DataFrame(nodeData['Label'])
-    labelDicts = labels.to_dict(orient='records')
-
-    nodeTuples = [tuple(r) for r in zip(idList,labelDicts)]
-    
-    
-    # Edge tuples (Source, Target, dict of attributes)
-    sourceList = edgeData['Source'].tolist()
-    targetList = edgeData['Target'].tolist()
-    
-    weights = pd.DataFrame(edgeData['Weight'])
-    weightDicts = weights.to_dict(orient='records')
-    
-    edgeTuples = [tuple(r) for r in zip(sourceList,targetList,weightDicts)]
-    
-    ## Add the nodes and edges to the graph
-    G.add_nodes_from(nodeTuples)
-    G.add_edges_from(edgeTuples)
-
-    totalInteractionsDicts = {}
-    totalInteractionsDicts.update(zip(nodeData['ID'], nodeData['TotalInteractions']))
-    nx.set_node_attributes(G, totalInteractionsDicts, "TotalInteractions")
-
-    # colorDicts = {}
-    # colorDicts.update(zip(nodeData['ID'], nodeData['Color']))
-    bb = nx.betweenness_centrality(G)
-    nx.set_node_attributes(G, bb, "Size")
-
-    c = nx.community.greedy_modularity_communities(G)
-
-    community_dict = pd.DataFrame(c).reset_index(drop=False).melt(id_vars="index")[['value','index']]
-    community_dict = community_dict[community_dict['value'].notnull()]
-    communityDicts = {}
-    communityDicts.update(zip(community_dict['value'], community_dict['index']))
-
-    nx.set_node_attributes(G, communityDicts, "Community")
-
-    color_df = pd.DataFrame(
-        [{'index': 0, 'color': "#fbf59a"},
-        {'index': 1, 'color': "#674ea7"},
-        {'index': 2, 'color': "#72a45d"},
-        {'index': 3, 'color': "#f2600b"},
-        {'index': 4, 'color': "#2986cc"}]
-    )
-
-    community_dict = community_dict.merge(color_df, how="left", on="index")
-
-    communityColorDicts = {}
-    communityColorDicts.update(zip(community_dict['value'], community_dict['color']))
-
-    nx.set_node_attributes(G, communityColorDicts, "CommunityColor")
-    # nx.set_node_attributes(G, colorDicts, "Color")
+# Create the graph object. Betweenness and communities are calculated in the
+# background, and until they're ready the graphs are drawn without them.
+community_algorithm = community_settings()
+betweenness_options = betweenness_settings()
+G, _ = load_enriched_graph_in_background(nodes, edges, community_algorithm=community_algorithm,
+                                         betweenness_mode=betweenness_options["mode"],
+                                         betweenness_k=betweenness_options["k"],
+                                         dataset_hash=dataset_hash)
 
-    return G, c
-
-# Create the graph object
-G, c = create_graph(nodes,edges)
+detail_options = level_of_detail_settings()
 # Define the node positions
 # pos = nx.circular_layout(G)
 # Define the attribute inputs
@@ -148,24 +95,56 @@ st.markdown(
     
     Colour reflects group membership. 
 
-    Communities were detected using Clauset-Newman-Moore modularity maximisation. 
-    
-    [Source](https://networkx.org/documentation/stable/reference/algorithms/generated/networkx.algorithms.community.modularity_max.greedy_modularity_communities.html) 
     """)
 
 
+if is_enriched(G) and describe_communities(G):
+    st.caption(describe_communities(G))
+
 tab1, tab2, tab3 = st.tabs(["Edge Weight and Total Interaction Filtering", 
                             "Filter to Node Neighbourhood",
                     # "Minimum Spanning Trees Pruning", 
                     "Network Metrics"])
 
-layout_options_list = ["cise", "fcose", "circle", "random", "grid", "concentric",
+# Layouts prefixed "precomputed" are calculated on the server and cached,
+# the rest are run by cytoscape.js in the browser
+layout_options_list = layout_options(["cise", "fcose", "circle", "random", "grid", "concentric",
                            "breadthfirst", "cose", "klay", 
                            "avsdf", "elk","dagre", "cola", 
                             "spread"
                         # , "euler"
-                           ]
-with tab1:
+                           ])
+
+def node_style(bb_result):
+    """
+    Node size and colour for the stylesheet: sized by betweenness and
+    coloured by community once the betweenness has been calculated, and
+    uniform until then.
+    """
+    if bb_result is None:
+        return "9", "#999999"
+    bb = bb_result[0].values()
+    return f"mapData(Size, {min(bb)}, {max(bb)}, 3, 15)", "data(CommunityColor)"
+
+
+def sized_elements(G_view, bb_result):
+    """
+    Cytoscape elements for a graph, with each node's Size set to its
+    betweenness within the graph drawn, so the sizes match the caption
+    under the graph.
+    """
+    elements = nx.cytoscape_data(G_view)["elements"]
+    if bb_result is not None:
+        for node in elements["nodes"]:
+            node["data"]["Size"] = bb_result[0][node["data"]["value"]]
+    return elements
+
+
+# The controls and graph of each tab are a fragment, so moving a slider or
+# selecting characters in one tab reruns just that tab rather than reading
+# the data and drawing both graphs again
+@timed_fragment("threshold tab")
+def threshold_tab(G, nodes, edges, betweenness_options, detail_options, layout_options_list):
     st.markdown("""
         Filtering is done on the weight of the edges (in this case, number of interactions between characters)
 
@@ -197,21 +176,6 @@ with tab1:
         int(edges["Weight"].max())
         )
 
-    # Define the edge filter 
-    def filter_edge(n1, n2):
-
-        return G[n1][n2]['Weight'] >= min_threshold_weight
-
-    G2 = nx.subgraph_view(G, 
-                        filter_edge=filter_edge)
-
-    # Remove any nodes that now don't meet the weight threshold
-    # Have to take a copy of the graph first because the output of the 
-    # filter step is read only
-    G3 = G2.copy()
-    G3.remove_nodes_from(list(nx.isolates(G3)))
-
-
 
     min_total_interactions = st.slider(
         "Filter out characters with fewer than a threshold number of interactions", 
@@ -219,20 +183,26 @@ with tab1:
         int(nodes["TotalInteractions"].max())
         )
 
-    # Define the edge filter 
-    def filter_node(n1):
+    # Keep only the edges that meet the weight threshold, dropping any nodes
+    # left without a link, then the characters below the interaction threshold.
+    # The filter remembers this session's previous thresholds, so moving a
+    # slider only adds or removes the edges and nodes that cross it.
+    G4 = session_threshold_filter(G).update(min_threshold_weight, min_total_interactions)
 
-        return G.nodes[n1]['TotalInteractions'] >= min_total_interactions
 
-    G4 = nx.subgraph_view(G3, 
-                        filter_node=filter_node)
+    # None until the betweenness is ready, which can only start once the
+    # graph's own betweenness and communities are. It depends only on the
+    # edges kept, so it's keyed by the built graph rather than the enriched one
+    bb_result = background_betweenness(G4, key=(built_graph_key(G), "threshold", min_threshold_weight,
+                                                min_total_interactions),
+                                       group="threshold betweenness",
+                                       **betweenness_options) if is_enriched(G) else None
+    node_size, node_color = node_style(bb_result)
 
-
-    G_cs = nx.cytoscape_data(G4)
-
-    bb = nx.betweenness_centrality(G4).values()
-
-    elements = G_cs['elements']
+    # Graphs over the render budget are cut down to their heaviest links,
+    # with characters selected on the previous run shown in full
+    G4_view = reduce_graph(G4, **detail_options, focus=selected_nodes("graph"))
+    threshold_key = (graph_key(G), "threshold", min_threshold_weight, min_total_interactions) + level_of_detail_key(G4_view)
 
     # This is a nice example of how to adjust the stylesheet
     # https://github.com/cytoscape/cytoscape.js/blob/master/documentation/demos/colajs-graph/cy-style.json
@@ -241,10 +211,10 @@ with tab1:
             "selector": "node", 
             "style": {
                 "label": "data(Label)", 
-                "width": f"mapData(Size, {min(bb)}, {max(bb)}, 3, 15)", 
-                "height": f"mapData(Size, {min(bb)}, {max(bb)}, 3, 15)",
+                "width": node_size, 
+                "height": node_size,
                 "font-size": "8px",
-                "background-color": "data(CommunityColor)",
+                "background-color": node_color,
                 # "transparency": f'mapData(Weight, 0, {max(bb)}, 0.4, 1)'
                 }
             },
@@ -258,6 +228,15 @@ with tab1:
                 #"target-arrow-shape": "triangle",
                 #"arrow-scale": f'mapData(Weight, 1, {edges["Weight"].max()}, 0.1, 1)'
             },
+        },
+
+        # Links bundled together by the level of detail reduction
+        {
+            "selector": f"edge[?{BUNDLE_ATTRIBUTE}]",
+            "style": {
+                "line-style": "dashed",
+                "line-color": "#f2600b",
+            },
         }
     ]
 
@@ -267,19 +246,31 @@ with tab1:
     st.subheader("Interactions between characters in Game of Thrones - Series 1")
 
     if layout == "cise": 
-        t1 = [(list(i)) for i in c]
-        #[leaf for branch in tree for leaf in branch]
-        clusters = [[node for node in t1[i] if node in list(G4.nodes)] for i in range(len(t1))]
+        # Each community's members that survived the filters
+        clusters = community_index(G).clusters(G4_view) if is_enriched(G) else []
         layout_dict = {"name": layout, 
                        "clusters": clusters}
+    elif precomputed_layout_name(layout):
+        # Starts from this session's previous positions when the sliders move
+        positions = load_layout(G4_view, threshold_key, precomputed_layout_name(layout), session_key="graph")
+        layout_dict = preset_layout(positions)
     else:
         layout_dict = {"name": layout}
 
-    selected = cytoscape(elements, 
-                        stylesheet, 
-                        key="graph", 
-                        layout=layout_dict, 
-                        height="900px")
+    with span("cytoscape elements"):
+        elements = sized_elements(G4_view, bb_result)
+    with span("cytoscape component"):
+        selected = cytoscape(elements,
+                            stylesheet, 
+                            key="graph", 
+                            layout=layout_dict, 
+                            height="900px")
+
+    if bb_result is not None and bb_result[1]["approximate"]:
+        st.caption(describe_approximation(bb_result[1]))
+
+    if describe_level_of_detail(G4_view):
+        st.caption(describe_level_of_detail(G4_view))
    
     st.markdown(f"""
         Links representing fewer than {min_threshold_weight} interactions have been removed from this graph. 
@@ -292,8 +283,11 @@ with tab1:
 
         """)
 
+    wait_for_jobs("threshold betweenness")
+
 # Add ability to filter down to just the network for an individual
-with tab2: 
+@timed_fragment("neighbourhood tab")
+def neighbourhood_tab(G, nodes, edges, betweenness_options, detail_options, layout_options_list):
     st.subheader("Show full network for particular characters")
 
     layout2 = st.radio(label="Select layout of filtered graph",
@@ -304,27 +298,38 @@ with tab2:
                 options=nodes.sort_values("TotalInteractions", ascending=False)['ID'].drop_duplicates().tolist(),
                 format_func=lambda x: x.title().replace("_", " "))
 
+    radius = st.slider("Include characters up to this many links away", 1, 3, 1)
 
-    def filter_node_neighbour(n1):
-
-        return (character_filter in nx.all_neighbors(G, n1)) or (n1 == character_filter)
+    neighbour_threshold = st.slider(
+        "Only follow links representing at least this many interactions",
+        int(1),
+        int(edges["Weight"].max())
+        )
 
+    # Walks out from the character through the adjacency index, and is
+    # cached for each character and setting
+    G5 = load_ego_network(G, character_filter, radius, neighbour_threshold)
+    neighbourhood_key = (graph_key(G), "neighbourhood", character_filter, radius, neighbour_threshold)
 
-    G5 = nx.subgraph_view(G, 
-                        filter_node=filter_node_neighbour)
 
+    bb_result = background_betweenness(G5, key=(built_graph_key(G), "neighbourhood", character_filter, radius,
+                                                neighbour_threshold),
+                                       group="neighbourhood betweenness",
+                                       **betweenness_options) if is_enriched(G) else None
+    node_size, node_color = node_style(bb_result)
 
-    bb = nx.betweenness_centrality(G5).values()
+    G5_view = reduce_graph(G5, **detail_options, focus=selected_nodes("graph_neighbour"))
+    neighbourhood_view_key = neighbourhood_key + level_of_detail_key(G5_view)
 
     stylesheet = [
         {
             "selector": "node", 
             "style": {
                 "label": "data(Label)", 
-                "width": f"mapData(Size, {min(bb)}, {max(bb)}, 3, 15)", 
-                "height": f"mapData(Size, {min(bb)}, {max(bb)}, 3, 15)",
+                "width": node_size, 
+                "height": node_size,
                 "font-size": "8px",
-                "background-color": "data(CommunityColor)",
+                "background-color": node_color,
                 # "transparency": f'mapData(Weight, 0, {max(bb)}, 0.4, 1)'
                 }
             },
@@ -338,6 +343,15 @@ with tab2:
                 #"target-arrow-shape": "triangle",
                 #"arrow-scale": f'mapData(Weight, 1, {edges["Weight"].max()}, 0.1, 1)'
             },
+        },
+
+        # Links bundled together by the level of detail reduction
+        {
+            "selector": f"edge[?{BUNDLE_ATTRIBUTE}]",
+            "style": {
+                "line-style": "dashed",
+                "line-color": "#f2600b",
+            },
         }
      ]
     
@@ -345,23 +359,46 @@ with tab2:
 
 
     if layout2 == "cise": 
-        t1 = [(list(i)) for i in c]
-        #[leaf for branch in tree for leaf in branch]
-        clusters = [[node for node in t1[i] if node in list(G5.nodes)] for i in range(len(t1))]
+        clusters = community_index(G).clusters(G5_view) if is_enriched(G) else []
 
         layout_dict = {"name": layout2, "clusters": clusters}
+    elif precomputed_layout_name(layout2):
+        positions = load_layout(G5_view, neighbourhood_view_key,
+                                precomputed_layout_name(layout2), session_key="graph_neighbour")
+        layout_dict = preset_layout(positions)
     else:
         layout_dict = {"name": layout2}
 
-    st.markdown(f"{character_filter} interacts with {len(G5.nodes)} characters ({round((len(G5.nodes)/len(G.nodes))*100, 2)}%) of a total of {len(G.nodes)} who appear in this season.")
+    if radius == 1:
+        st.markdown(f"{character_filter} interacts with {len(G5.nodes)} characters ({round((len(G5.nodes)/len(G.nodes))*100, 2)}%) of a total of {len(G.nodes)} who appear in this season.")
+    else:
+        st.markdown(f"{len(G5.nodes)} characters ({round((len(G5.nodes)/len(G.nodes))*100, 2)}%) of a total of {len(G.nodes)} who appear in this season are within {radius} links of {character_filter}.")
 
     st.markdown(f"They had {nodes[nodes['ID'] == character_filter]['TotalInteractions'].values[0]} interactions in total.")
 
-    selected = cytoscape(nx.cytoscape_data(G5)['elements'], 
-                        stylesheet, 
-                        key="graph_neighbour", 
-                        layout=layout_dict, 
-                        height="900px")
+    with span("cytoscape elements"):
+        elements = sized_elements(G5_view, bb_result)
+    with span("cytoscape component"):
+        selected = cytoscape(elements,
+                            stylesheet, 
+                            key="graph_neighbour", 
+                            layout=layout_dict, 
+                            height="900px")
+
+    if bb_result is not None and bb_result[1]["approximate"]:
+        st.caption(describe_approximation(bb_result[1]))
+
+    if describe_level_of_detail(G5_view):
+        st.caption(describe_level_of_detail(G5_view))
+
+    wait_for_jobs("neighbourhood betweenness")
+
+
+with tab1:
+    threshold_tab(G, nodes, edges, betweenness_options, detail_options, layout_options_list)
+
+with tab2:
+    neighbourhood_tab(G, nodes, edges, betweenness_options, detail_options, layout_options_list)
 
 # with tab3:
 #     st.subheader("Pruning with Minimum Spanning Trees Algorithm")
@@ -421,3 +458,20 @@ with tab2:
 with tab3:
     st.subheader("Graphs of network metrics")
 
+    # Metrics for the full graph are computed on the array-based graph, which
+    # is built once per dataset and doesn't need the networkx graph at all
+    G_csr = load_csr_graph(nodes, edges, dataset_hash=dataset_hash)
+    metrics = G_csr.metrics()
+
+    st.markdown(f"""
+        {G_csr.n_nodes} characters and {G_csr.n_edges} links, in {metrics['Component'].nunique()} connected component(s).
+        """)
+
+    st.dataframe(metrics.rename(columns={"WeightedDegree": "TotalInteractions"})
+                        .sort_values("PageRank", ascending=False),
+                 use_container_width=True)
+
+
+show_cache_stats()
+instrumentation_panel()
+wait_for_jobs()
@@ -1,10 +1,13 @@
 import gc
-import networkx as nx
-import pandas as pd
-import numpy as np
 import streamlit as st
 from helper_functions import add_logo
-import gravis as gv
+from graph_pipeline import graph_key, is_enriched, load_dataset, load_enriched_graph_in_background
+from graph_filters import session_threshold_filter
+from communities import community_settings, describe_communities
+from centrality import betweenness_settings, describe_approximation, show_cache_stats
+from gravis_cache import d3_html
+from instrumentation import instrumentation_panel, span, start_run, timed_fragment
+from background_jobs import wait_for_jobs
 #from streamlit_d3graph import d3graph
 import streamlit.components.v1 as components
 
@@ -15,6 +18,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+start_run("Gravis")
+
 add_logo()
 
 with open("style.css") as css:
@@ -37,14 +42,9 @@ st.markdown(
     """
 )
 
-edges = pd.read_csv("data/got-s1-edges.csv")
-nodes = pd.read_csv("data/got-s1-nodes.csv").rename(columns={"Id": "ID"})
-
-total_interactions_node = pd.concat([edges[['Source', 'Weight']].groupby('Source').sum().reset_index(drop=False),
-                                     edges[['Target', 'Weight']].groupby('Target').sum().reset_index(drop=False).rename(columns={'Target':'Source'})]
-                                     ).groupby('Source').sum().rename(columns={'Weight':'TotalInteractions'})
-
-nodes = nodes.merge(total_interactions_node, how="left", left_on="ID", right_on="Source")
+# Read once per version of the files, with TotalInteractions added. The
+# dataset key identifies the files, so the tables aren't hashed on every run.
+nodes, edges, dataset_hash = load_dataset("data/got-s1-nodes.csv", "data/got-s1-edges.csv")
 # Create some simple graph data
 # nodes = {'ID':['1','2','3','4','5'],
 #          'Label':['Aspirin','Paracetamol','Ibuprofen','Codeine','Naproxen'],
@@ -60,74 +60,16 @@ nodes = nodes.merge(total_interactions_node, how="left", left_on="ID", right_on=
 nodeData = nodes
 edgeData = edges
 
-#Create graph function - networkX
-def create_graph(nodeData, edgeData):
-    ## Initiate the graph object
-    G = nx.Graph()
-    # G = nx.DiGraph()
-    
-    ## Tranform the data into the correct format for use with NetworkX
-    
-    # Node tuples (ID, dict of attributes)
-    idList = nodeData['ID'].tolist()
-    
-    labels =  pd.DataFrame(nodeData['Label'])
-    labelDicts = labels.to_dict(orient='records')
-
-    nodeTuples = [tuple(r) for r in zip(idList,labelDicts)]
-    
-    
-    # Edge tuples (Source, Target, dict of attributes)
-    sourceList = edgeData['Source'].tolist()
-    targetList = edgeData['Target'].tolist()
-    
-    weights = pd.DataFrame(edgeData['Weight'])
-    weightDicts = weights.to_dict(orient='records')
-    
-    edgeTuples = [tuple(r) for r in zip(sourceList,targetList,weightDicts)]
-    
-    ## Add the nodes and edges to the graph
-    G.add_nodes_from(nodeTuples)
-    G.add_edges_from(edgeTuples)
-
-    totalInteractionsDicts = {}
-    totalInteractionsDicts.update(zip(nodeData['ID'], nodeData['TotalInteractions']))
-    nx.set_node_attributes(G, totalInteractionsDicts, "TotalInteractions")
-
-    # colorDicts = {}
-    # colorDicts.update(zip(nodeData['ID'], nodeData['Color']))
-    bb = nx.betweenness_centrality(G)
-    nx.set_node_attributes(G, bb, "Size")
-
-    c = nx.community.greedy_modularity_communities(G)
-
-    community_dict = pd.DataFrame(c).reset_index(drop=False).melt(id_vars="index")[['value','index']]
-    community_dict = community_dict[community_dict['value'].notnull()]
-    communityDicts = {}
-    communityDicts.update(zip(community_dict['value'], community_dict['index']))
+# Create the graph object. Betweenness and communities are calculated in the
+# background, and until they're ready gravis draws every node the same size
+# and colour.
+community_algorithm = community_settings()
+betweenness_options = betweenness_settings()
+G, _ = load_enriched_graph_in_background(nodes, edges, color_attribute="color", community_algorithm=community_algorithm,
+                                         betweenness_mode=betweenness_options["mode"],
+                                         betweenness_k=betweenness_options["k"],
+                                         dataset_hash=dataset_hash)
 
-    nx.set_node_attributes(G, communityDicts, "Community")
-
-    color_df = pd.DataFrame(
-        [{'index': 0, 'color': "#fbf59a"},
-        {'index': 1, 'color': "#674ea7"},
-        {'index': 2, 'color': "#72a45d"},
-        {'index': 3, 'color': "#f2600b"},
-        {'index': 4, 'color': "#2986cc"}]
-    )
-
-    community_dict = community_dict.merge(color_df, how="left", on="index")
-
-    communityColorDicts = {}
-    communityColorDicts.update(zip(community_dict['value'], community_dict['color']))
-
-    nx.set_node_attributes(G, communityColorDicts, "color")
-    # nx.set_node_attributes(G, colorDicts, "Color")
-
-    return G
-
-# Create the graph object
-G = create_graph(nodes,edges)
 # Define the node positions
 # pos = nx.circular_layout(G)
 # Define the attribute inputs
@@ -142,9 +84,6 @@ st.markdown(
     
     Colour reflects group membership. 
 
-    Communities were detected using Clauset-Newman-Moore modularity maximisation. 
-    
-    [Source](https://networkx.org/documentation/stable/reference/algorithms/generated/networkx.algorithms.community.modularity_max.greedy_modularity_communities.html) 
     
     Filtering is done on the weight of the edges (in this case, number of interactions between characters)
 
@@ -165,87 +104,88 @@ st.markdown(
 
 
 
+if is_enriched(G) and G.graph["betweenness"]["approximate"]:
+    st.caption(describe_approximation(G.graph["betweenness"]))
+
+if is_enriched(G) and describe_communities(G):
+    st.caption(describe_communities(G))
+
 # add streamlit inputs
 # layout = st.radio(label="Select layout",
 #                   options=["fcose", "circle", "random", "grid", "concentric",
 #                            "breadthfirst", "cose", "klay"],
 #                   horizontal=True)
 
-min_threshold_weight = st.slider(
-    "Filter out edges that don't meet this threshold weight", 
-    int(1),
-    int(edges["Weight"].max())
-    )
-
-# Define the edge filter 
-def filter_edge(n1, n2):
-
-    return G[n1][n2]['Weight'] >= min_threshold_weight
-
-G2 = nx.subgraph_view(G, 
-                     filter_edge=filter_edge)
+# The sliders and graph are a fragment, so moving a slider reruns just this
+# part of the page rather than reading the data again
+@timed_fragment("filtered graph")
+def filtered_graph(G, nodes, edges):
+    min_threshold_weight = st.slider(
+        "Filter out edges that don't meet this threshold weight", 
+        int(1),
+        int(edges["Weight"].max())
+        )
 
-# Remove any nodes that now don't meet the weight threshold
-# Have to take a copy of the graph first because the output of the 
-# filter step is read only
-G3 = G2.copy()
-G3.remove_nodes_from(list(nx.isolates(G3)))
 
+    min_total_interactions = st.slider(
+        "Filter out characters with fewer than a threshold number of interactions", 
+        int(1),
+        int(nodes["TotalInteractions"].max())
+        )
 
+    # Keep only the edges that meet the weight threshold, dropping any nodes
+    # left without a link, then the characters below the interaction threshold.
+    # The filter remembers this session's previous thresholds, so moving a
+    # slider only adds or removes the edges and nodes that cross it.
+    G4 = session_threshold_filter(G).update(min_threshold_weight, min_total_interactions)
 
-min_total_interactions = st.slider(
-    "Filter out characters with fewer than a threshold number of interactions", 
-    int(1),
-    int(nodes["TotalInteractions"].max())
-    )
 
-# Define the edge filter 
-def filter_node(n1):
 
-    return G.nodes[n1]['TotalInteractions'] >= min_total_interactions
+    # G_cs = nx.cytoscape_data(G4)
 
-G4 = nx.subgraph_view(G3, 
-                     filter_node=filter_node)
+    # elements = G_cs['elements']
 
 
+    # Deal with the output on the page
 
-# G_cs = nx.cytoscape_data(G4)
+    st.subheader("Interactions between characters in Game of Thrones - Series 1")
 
-bb = nx.betweenness_centrality(G4).values()
 
-# elements = G_cs['elements']
 
+    # Rendered once per filter setting and shared between sessions
+    d3_G4_html = d3_html(G4,
+                         key=(graph_key(G), "threshold", min_threshold_weight, min_total_interactions),
+                         graph_height=800,
+                         node_hover_neighborhood =True,
+                         node_size_data_source="Size",
+                         edge_size_data_source="Weight",
+                         use_node_size_normalization=True,
+                         node_size_factor=0.1,
+                       #   node_size_normalization_min=1,
+                       #   node_size_normalization_max=5
+                         )
 
-# Deal with the output on the page
 
-st.subheader("Interactions between characters in Game of Thrones - Series 1")
+    with span("gravis component"):
+        components.html(d3_G4_html,
+                        height=800)
 
 
+    st.markdown(f"""
+        Links representing fewer than {min_threshold_weight} interactions have been removed from this graph. 
+    
+        Characters with fewer than than {min_total_interactions} interactions have been removed from this graph. 
 
-d3_G4 = gv.d3(G4, 
-              graph_height=800,
-              node_hover_neighborhood =True,
-              node_size_data_source="Size",
-              edge_size_data_source="Weight",
-              use_node_size_normalization=True,
-              node_size_factor=0.1,
-            #   node_size_normalization_min=1,
-            #   node_size_normalization_max=5
-              )              
-
-
-components.html(d3_G4.to_html(),
-                height=800)
+        {len(G4.nodes)} of {len(nodes)} nodes in original dataset displayed after filtering.
 
+        **Interpret with caution.**
 
-st.markdown(f"""
-    Links representing fewer than {min_threshold_weight} interactions have been removed from this graph. 
-    
-    Characters with fewer than than {min_total_interactions} interactions have been removed from this graph. 
+        """)
 
-    {len(G4.nodes)} of {len(nodes)} nodes in original dataset displayed after filtering.
 
-    **Interpret with caution.**
+filtered_graph(G, nodes, edges)
 
-    """)
 
+show_cache_stats()
+instrumentation_panel()
+wait_for_jobs()
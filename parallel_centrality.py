@@ -0,0 +1,230 @@
+"""
+Betweenness centrality split across a pool of worker processes.
+
+Kept free of streamlit imports so that worker processes start quickly.
+"""
+import multiprocessing
+import os
+import pickle
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+
+
+def available_cpus():
+    """
+    Number of CPUs this process can actually run on: those in its affinity
+    mask, limited by any cgroup CPU quota (as set on containers), rather than
+    every CPU in the machine.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+# Number of worker processes. Defaults to the CPUs available, and can be
+# overridden with the CENTRALITY_WORKERS environment variable.
+DEFAULT_WORKERS = int(os.environ.get("CENTRALITY_WORKERS", available_cpus()))
+
+# Graphs with fewer nodes than this are computed serially, as sending them
+# to the workers costs more than it saves
+PARALLEL_MIN_NODES = 2_000
+
+# Each worker is given several chunks of sources so that a chunk full of
+# expensive high-degree nodes doesn't leave the other workers idle
+CHUNKS_PER_WORKER = 4
+
+# The graph most recently sent to this worker, as (token, graph)
+_worker_graph = (None, None)
+
+
+class WorkerPool:
+    """
+    Worker processes for betweenness, started once and reused for every
+    calculation, as starting them takes a second or more.
+
+    Parameters:
+    ----------
+    workers: int
+        Number of worker processes
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        # spawn rather than fork, as forking the multithreaded streamlit
+        # server is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+
+def worker_pool(workers=None):
+    """
+    Start a WorkerPool, or return None if there is only one worker to run
+    on, so calculations run serially.
+
+    Parameters:
+    ----------
+    workers: int
+        Defaults to DEFAULT_WORKERS
+
+    Returns:
+    --------
+    WorkerPool or None
+    """
+    workers = workers or DEFAULT_WORKERS
+    return WorkerPool(workers) if workers > 1 else None
+
+
+def _dependencies(G, sources, weight):
+    """
+    Sum of the (unscaled) dependency of every node on shortest paths from the
+    given sources to all other nodes.
+    """
+    return nx.betweenness_centrality_subset(G, sources, list(G), normalized=False, weight=weight)
+
+
+def _worker_dependencies(token, graph_path, sources, weight):
+    # Chunks carry only the path of the pickled graph, which each worker
+    # reads the first time it sees the token
+    global _worker_graph
+    if _worker_graph[0] != token:
+        with open(graph_path, "rb") as f:
+            _worker_graph = (token, pickle.load(f))
+    return _dependencies(_worker_graph[1], sources, weight)
+
+
+def _rescale(betweenness, n, normalized, directed, sources):
+    # Matches the scaling nx.betweenness_centrality (networkx 3.5 onwards)
+    # applies to its raw totals. Endpoints are excluded, so a node can lie on
+    # paths between n - 1 other nodes, and when sampling, sampled sources
+    # can't count paths starting from themselves.
+    N = n - 1
+    if N < 2:
+        return betweenness
+
+    correction = 1 if directed else 2
+    if sources is None:
+        scale_source = scale_nonsource = 1 / (N * (N - 1)) if normalized else 1 / correction
+    else:
+        k = len(sources)
+        if normalized:
+            scale_source = 1 / ((k - 1) * (N - 1)) if k > 1 else float("nan")
+            scale_nonsource = 1 / (k * (N - 1))
+        else:
+            scale_source = N / ((k - 1) * correction) if k > 1 else float("nan")
+            scale_nonsource = N / (k * correction)
+
+    sources = set(sources or ())
+    for node in betweenness:
+        betweenness[node] *= scale_source if node in sources else scale_nonsource
+    return betweenness
+
+
+def parallel_betweenness_centrality(G, sources=None, normalized=True, weight=None,
+                                    pool=None, min_nodes=PARALLEL_MIN_NODES):
+    """
+    Betweenness centrality computed by splitting the source nodes between
+    worker processes and summing their partial dependency scores.
+
+    Gives the same values as nx.betweenness_centrality (to within floating
+    point rounding). With sources set, this matches nx.betweenness_centrality
+    with k = len(sources) when it samples those same pivots.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    sources: list
+        Source nodes to accumulate from. Defaults to every node (exact
+        betweenness).
+    normalized: bool
+        Normalise as nx.betweenness_centrality does
+    weight: str
+        Edge attribute to use as the path length. None for unweighted.
+    pool: WorkerPool
+        Worker processes to use. If None the calculation runs serially.
+    min_nodes: int
+        Graphs with fewer nodes are computed serially
+
+    Returns:
+    --------
+    dict
+        Node to betweenness centrality
+    """
+    return betweenness_batches(G, [sources], normalized, weight, pool, min_nodes)[0]
+
+
+def betweenness_batches(G, batches, normalized=True, weight=None, pool=None, min_nodes=PARALLEL_MIN_NODES):
+    """
+    Betweenness centrality from each of several batches of source nodes, as
+    parallel_betweenness_centrality gives for each batch on its own.
+
+    The chunks of every batch are sent to the pool together, so the workers
+    stay busy from one batch to the next. The graph is pickled once to a
+    temporary file, which each worker reads once, and the chunks carry only
+    its path and their source nodes.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    batches: list of lists
+        Source nodes of each batch. None in place of a list means every node.
+    normalized, weight, pool, min_nodes:
+        See parallel_betweenness_centrality
+
+    Returns:
+    --------
+    list of dict
+        Node to betweenness centrality, for each batch
+    """
+    n = len(G)
+    # Sampling every node is the exact calculation
+    batches = [None if sources is not None and len(sources) == n else sources for sources in batches]
+    batch_nodes = [list(G) if sources is None else list(sources) for sources in batches]
+
+    if pool is None or n < min_nodes:
+        totals = [_dependencies(G, nodes, weight) for nodes in batch_nodes]
+    else:
+        token = uuid.uuid4().hex
+        with tempfile.NamedTemporaryFile(prefix="betweenness-", suffix=".pickle", delete=False) as f:
+            pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+        jobs = []
+        try:
+            n_chunks = pool.workers * CHUNKS_PER_WORKER
+            for i, nodes in enumerate(batch_nodes):
+                # Deal the sources out in turn so each chunk gets a similar
+                # mix of cheap and expensive nodes
+                chunks = min(len(nodes), max(1, n_chunks // len(batch_nodes)))
+                jobs.extend((i, pool.executor.submit(_worker_dependencies, token, f.name, nodes[j::chunks], weight))
+                            for j in range(chunks))
+
+            totals = [dict.fromkeys(G, 0.0) for _ in batch_nodes]
+            for i, job in jobs:
+                for node, value in job.result().items():
+                    totals[i][node] += value
+        finally:
+            # Drop the chunks still queued if one of them failed; otherwise
+            # they have all finished and no worker needs the file any more
+            for _, job in jobs:
+                job.cancel()
+            os.remove(f.name)
+
+    results = []
+    for raw, sources in zip(totals, batches):
+        # betweenness_centrality_subset halves undirected totals, undo that
+        # so the raw totals match those nx.betweenness_centrality rescales
+        if not G.is_directed():
+            for node in raw:
+                raw[node] *= 2
+        results.append(_rescale(raw, n, normalized, G.is_directed(), sources))
+    return results
@@ -0,0 +1,197 @@
+"""
+Plotly traces for drawing networks, built with array operations.
+
+Edges are drawn as a single line trace, with the two ends of each edge
+followed by a NaN so that plotly breaks the line between edges. Above
+WEBGL_ELEMENT_THRESHOLD nodes plus edges the traces switch from SVG
+(go.Scatter) to WebGL (go.Scattergl), as SVG rendering stalls beyond a few
+thousand elements.
+"""
+import numpy as np
+import plotly.graph_objects as go
+
+from instrumentation import timed
+from level_of_detail import BUNDLE_ATTRIBUTE
+
+WEBGL_ELEMENT_THRESHOLD = 2_000
+
+
+def graph_arrays(G, pos=None, pos_attribute="pos"):
+    """
+    Node positions and edge endpoints of a graph as arrays.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos: dict
+        Node to (x, y). Defaults to each node's pos_attribute.
+    pos_attribute: str
+        Node attribute holding the position, if pos isn't given
+
+    Returns:
+    --------
+    tuple of (list, np.ndarray, np.ndarray, np.ndarray)
+        The nodes, their positions as an n x 2 array, and the source and
+        target of each edge as positions in the node list
+    """
+    nodes = list(G)
+    if pos is None:
+        pos = dict(G.nodes(data=pos_attribute))
+    xy = np.array([pos[node] for node in nodes], dtype=np.float64).reshape(len(nodes), 2)
+
+    index = {node: i for i, node in enumerate(nodes)}
+    endpoints = np.fromiter((index[node] for edge in G.edges for node in edge),
+                            dtype=np.int64, count=2 * G.number_of_edges()).reshape(-1, 2)
+
+    return nodes, xy, endpoints[:, 0], endpoints[:, 1]
+
+
+def edge_coordinates(xy, sources, targets):
+    """
+    x and y coordinates for drawing every edge as one line trace.
+
+    Parameters:
+    ----------
+    xy: np.ndarray
+        n x 2 array of node positions
+    sources, targets: np.ndarray
+        Positions in xy of the two ends of each edge
+
+    Returns:
+    --------
+    tuple of (np.ndarray, np.ndarray)
+        x and y, each holding start, end, NaN for every edge in turn
+    """
+    segments = np.full((len(sources), 3, 2), np.nan)
+    segments[:, 0] = xy[sources]
+    segments[:, 1] = xy[targets]
+    return segments[:, :, 0].ravel(), segments[:, :, 1].ravel()
+
+
+def neighbour_counts(n_nodes, sources, targets, directed=False):
+    """
+    Number of neighbours of each node (successors, for a directed graph), as
+    len(G.adj[node]) would give.
+    """
+    counts = np.bincount(sources, minlength=n_nodes)
+    if not directed:
+        # A self loop makes the node its own neighbour once, not twice
+        counts += np.bincount(targets[targets != sources], minlength=n_nodes)
+    return counts
+
+
+def reduced_connections(G, nodes, sources, targets):
+    """
+    Number of connections of each node of a graph from
+    level_of_detail.reduce_graph, counting the edges it hid rather than the
+    bundles standing in for them.
+    """
+    drawn = np.fromiter((not bundle for _, _, bundle in G.edges(data=BUNDLE_ATTRIBUTE, default=False)),
+                        dtype=bool, count=len(sources))
+    hidden = np.fromiter((hidden for _, hidden in G.nodes(data="HiddenEdges", default=0)),
+                         dtype=np.int64, count=len(nodes))
+    return neighbour_counts(len(nodes), sources[drawn], targets[drawn], G.is_directed()) + hidden
+
+
+def scatter_type(n_elements, webgl_threshold=WEBGL_ELEMENT_THRESHOLD):
+    """
+    go.Scattergl for more than webgl_threshold elements, otherwise go.Scatter.
+    """
+    return go.Scattergl if n_elements > webgl_threshold else go.Scatter
+
+
+@timed("plotly traces")
+def network_traces(G, pos=None, pos_attribute="pos", webgl_threshold=WEBGL_ELEMENT_THRESHOLD,
+                   edge_line=None, node_marker=None):
+    """
+    Edge and node traces for a network, coloured by each node's number of
+    connections, as in the plotly network graph example.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos, pos_attribute:
+        See graph_arrays
+    webgl_threshold: int
+        Render with WebGL when the graph has more nodes plus edges than this
+    edge_line: dict
+        Line properties for the edge trace
+    node_marker: dict
+        Marker properties for the node trace. The colour is set to the
+        number of connections, including any hidden by
+        level_of_detail.reduce_graph.
+
+    Returns:
+    --------
+    tuple of (go.Scatter, go.Scatter) or (go.Scattergl, go.Scattergl)
+        The edge trace and the node trace
+    """
+    nodes, xy, sources, targets = graph_arrays(G, pos, pos_attribute)
+    Scatter = scatter_type(len(nodes) + len(sources), webgl_threshold)
+
+    edge_x, edge_y = edge_coordinates(xy, sources, targets)
+    edge_trace = Scatter(x=edge_x, y=edge_y,
+                         line=edge_line or dict(width=0.5, color='#888'),
+                         hoverinfo='none',
+                         mode='lines')
+
+    connections = neighbour_counts(len(nodes), sources, targets, G.is_directed())
+    if "level_of_detail" in G.graph:
+        connections = reduced_connections(G, nodes, sources, targets)
+    node_trace = Scatter(x=xy[:, 0], y=xy[:, 1],
+                         mode='markers',
+                         hoverinfo='text',
+                         text=np.char.add('# of connections: ', connections.astype(str)),
+                         marker={**(node_marker or {}), "color": connections})
+
+    return edge_trace, node_trace
+
+
+def bundle_trace(G, pos=None, pos_attribute="pos", webgl_threshold=WEBGL_ELEMENT_THRESHOLD, line=None):
+    """
+    Line trace of the bundle edges of a graph from
+    level_of_detail.reduce_graph, to draw over the edge trace.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos, pos_attribute, webgl_threshold:
+        See network_traces
+    line: dict
+        Line properties for the bundles
+
+    Returns:
+    --------
+    go.Scatter, go.Scattergl or None
+        None if G has no bundles
+    """
+    bundles = [(u, v) for u, v, bundle in G.edges(data=BUNDLE_ATTRIBUTE, default=False) if bundle]
+    if not bundles:
+        return None
+    if pos is None:
+        pos = dict(G.nodes(data=pos_attribute))
+
+    xy = np.array([pos[node] for edge in bundles for node in edge], dtype=np.float64).reshape(-1, 2)
+    ends = np.arange(len(bundles)) * 2
+    x, y = edge_coordinates(xy, ends, ends + 1)
+    Scatter = scatter_type(len(G) + G.number_of_edges(), webgl_threshold)
+    return Scatter(x=x, y=y,
+                   line=line or dict(width=2, color='#f2600b', dash='dot'),
+                   hoverinfo='none',
+                   mode='lines')
+
+
+def selected_box(selection):
+    """
+    The extent of a plotly chart's box selection, from the selection state
+    st.plotly_chart keeps in st.session_state under the chart's key.
+
+    Returns:
+    --------
+    tuple of (tuple, tuple) or None
+        The x and y range of the most recent box, or None if there isn't one
+    """
+    boxes = (selection or {}).get("selection", {}).get("box", [])
+    if not boxes:
+        return None
+    return tuple(boxes[-1]["x"]), tuple(boxes[-1]["y"])
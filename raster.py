@@ -0,0 +1,337 @@
+"""
+Server-side raster rendering of graphs too large to draw element by element.
+
+Rather than creating a matplotlib artist or a browser element per node and
+edge, every edge is sampled about once per pixel along its length and the
+samples are accumulated into a density canvas with np.bincount. Each sample
+is split between the two pixels either side of the line, weighted by how
+close it falls to each, which antialiases the lines as Xiaolin Wu's
+algorithm does. Colours are accumulated alongside the density, so where
+lines of different colours cross the pixel takes their average colour.
+
+Density is shaded on a log scale, so single lines stay visible next to
+areas where thousands overlap. Nodes are drawn as discs on top. The result
+is an RGB image array, which st.image displays directly.
+"""
+import numpy as np
+import pandas as pd
+from matplotlib import colormaps
+from matplotlib.colors import to_rgb
+
+from instrumentation import timed
+from plotly_traces import graph_arrays
+
+CANVAS_SIZE = 800
+BACKGROUND = "#ffffff"
+NODE_COLOR = "#888888"
+WEIGHT_COLORMAP = "viridis"
+
+# Points sampled along the edges, about one per pixel of their length.
+# Beyond this the longest edges are sampled more sparsely.
+MAX_EDGE_SAMPLES = 10_000_000
+
+# Samples processed at once, to bound memory on very large graphs
+_CHUNK_SAMPLES = 2_000_000
+
+# Levels weights are rounded to when colouring by weight
+_WEIGHT_LEVELS = 256
+
+# Opacity of the faintest line, so isolated edges don't disappear next to
+# the densest areas
+_MIN_ALPHA = 0.25
+
+
+def palette_codes(colors, default=NODE_COLOR):
+    """
+    Code a sequence of matplotlib colours (names, hex strings or RGB tuples)
+    as positions in a palette of the distinct colours. Missing colours are
+    replaced by default.
+
+    Returns:
+    --------
+    tuple of (np.ndarray, np.ndarray)
+        The code of each colour, and the palette as a 3 x k array of RGB
+        values between 0 and 1
+    """
+    codes, uniques = pd.factorize(pd.Series(list(colors), dtype=object), use_na_sentinel=False)
+    palette = np.array([to_rgb(default if color is None or color != color else color) for color in uniques],
+                       dtype=np.float64).reshape(-1, 3)
+    return codes, palette.T.copy()
+
+
+def weight_codes(weights, colormap=WEIGHT_COLORMAP):
+    """
+    Code weights as positions in a palette sampled from a matplotlib
+    colormap, on a log scale as interaction counts are heavy tailed.
+
+    Returns:
+    --------
+    tuple of (np.ndarray, np.ndarray)
+        As palette_codes
+    """
+    scaled = np.log1p(np.asarray(weights, dtype=np.float64))
+    span = scaled.max() - scaled.min() if len(scaled) else 0
+    scaled = (scaled - scaled.min()) / span if span > 0 else np.zeros_like(scaled)
+    codes = np.minimum((scaled * _WEIGHT_LEVELS).astype(np.int64), _WEIGHT_LEVELS - 1)
+    palette = colormaps[colormap]((np.arange(_WEIGHT_LEVELS) + 0.5) / _WEIGHT_LEVELS)[:, :3]
+    return codes, palette.T.copy()
+
+
+def _to_pixels(xy, width, height, padding):
+    """
+    Scale positions to fit the canvas, keeping their aspect ratio, with y
+    increasing up the image.
+
+    Returns:
+    --------
+    tuple of (np.ndarray, np.ndarray)
+        x and y pixel coordinates
+    """
+    if len(xy) == 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    low, high = xy.min(axis=0), xy.max(axis=0)
+    extent = np.where(high > low, high - low, 1)
+    scale = min((width - 2 * padding) / extent[0], (height - 2 * padding) / extent[1])
+    centre = (low + high) / 2
+    x = (xy[:, 0] - centre[0]) * scale + width / 2
+    y = (centre[1] - xy[:, 1]) * scale + height / 2
+    return x.astype(np.float32), y.astype(np.float32)
+
+
+def _sample_cap(samples, max_samples):
+    """
+    Largest number of samples per edge that keeps the total within
+    max_samples.
+    """
+    # Number of edges wanting each number of samples
+    wanting = np.bincount(samples)
+    cap = np.arange(len(wanting))
+    edges_over = len(samples) - np.cumsum(wanting)
+    # Total if every edge were capped at each number of samples in turn
+    totals = np.cumsum(wanting * cap) + cap * edges_over
+    return max(int(np.searchsorted(totals, max_samples, side="right")) - 1, 1)
+
+
+def _accumulate_edges(x0, y0, x1, y1, codes, palette, width, height, max_samples):
+    """
+    Sample edges about one pixel apart along their longer axis and spread
+    each sample over the two pixels either side of the line on the shorter
+    axis.
+
+    If that would take more than max_samples samples, the longest edges are
+    sampled more sparsely, each sample standing for the length of line it
+    skips.
+
+    Parameters:
+    ----------
+    x0, y0, x1, y1: np.ndarray
+        Pixel coordinates of each edge's ends, at least one pixel in from
+        the edge of the canvas
+    codes: tuple of (np.ndarray, np.ndarray)
+        Palette position of the colour of each edge's first and second half
+    palette: np.ndarray
+        3 x k array of RGB colours
+    width, height: int
+    max_samples: int
+
+    Returns:
+    --------
+    tuple of (np.ndarray, np.ndarray)
+        Density of each pixel, and the density-weighted sum of the colours
+        drawn on it as a 3 x pixels array
+    """
+    n_pixels = width * height
+    density = np.zeros(n_pixels)
+    color_sum = np.zeros((3, n_pixels))
+    if len(x0) == 0:
+        return density, color_sum
+
+    dx, dy = x1 - x0, y1 - y0
+    x_major = np.abs(dx) >= np.abs(dy)
+    d_major, d_minor = np.where(x_major, dx, dy), np.where(x_major, dy, dx)
+    length = np.abs(d_major)
+
+    # Samples are taken at the middle of equal steps along the edge, so an
+    # edge shorter than a pixel is a single sample
+    samples = np.maximum(np.ceil(length).astype(np.int64), 1)
+    if samples.sum() > max_samples:
+        samples = np.minimum(samples, _sample_cap(samples, max_samples))
+
+    # Per edge: where sampling starts, how far each sample moves, and the
+    # step in flat pixel index for one pixel along and across the line.
+    # Each sample counts for the length of line it stands for.
+    spacing = length / samples
+    major_step = np.copysign(spacing, d_major)
+    minor_step = np.divide(d_minor, length, out=np.zeros_like(length), where=length > 0) * spacing
+    major_start = np.where(x_major, x0, y0) + major_step / 2
+    minor_start = np.where(x_major, y0, x0) + minor_step / 2 - 0.5
+    along_stride = np.where(x_major, 1, width)
+    across_stride = np.where(x_major, width, 1)
+
+    ends = np.cumsum(samples)
+    first = ends - samples
+    start = 0
+    while start < len(samples):
+        stop = max(int(np.searchsorted(ends, first[start] + _CHUNK_SAMPLES, side="right")), start + 1)
+        counts = samples[start:stop]
+        edge = np.repeat(np.arange(start, stop), counts)
+        step = (np.arange(first[start], ends[stop - 1]) - np.repeat(first[start:stop], counts)).astype(np.float32)
+
+        along = (major_start.take(edge) + step * major_step.take(edge)).astype(np.int64)
+        across = minor_start.take(edge) + step * minor_step.take(edge)
+        low = across.astype(np.int64)
+        fraction = across - low
+        weight = spacing.take(edge)
+
+        # Each half of the edge takes its own colour
+        second_half = 2 * step >= np.repeat(counts, counts)
+        code = np.where(second_half, codes[1].take(edge), codes[0].take(edge))
+
+        pixel = along * along_stride.take(edge) + low * across_stride.take(edge)
+        for pixels, share in ((pixel, (1 - fraction) * weight),
+                              (pixel + across_stride.take(edge), fraction * weight)):
+            density += np.bincount(pixels, share, minlength=n_pixels)
+            for channel in range(3):
+                color_sum[channel] += np.bincount(pixels, share * palette[channel].take(code),
+                                                  minlength=n_pixels)
+
+        start = stop
+
+    return density, color_sum
+
+
+def _accumulate_nodes(x, y, codes, palette, radius, width, height):
+    """
+    Draw nodes as discs, averaging the colours of overlapping nodes.
+    """
+    n_pixels = width * height
+    count = np.zeros(n_pixels)
+    color_sum = np.zeros((3, n_pixels))
+
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), len(x))
+    column_centre, row_centre = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+    reach = int(np.ceil(radius.max())) if len(radius) else 0
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            # Every node covers at least its own pixel
+            hit = (dx * dx + dy * dy <= radius * radius) | ((dx == 0) & (dy == 0))
+            column, row = column_centre[hit] + dx, row_centre[hit] + dy
+            inside = (column >= 0) & (column < width) & (row >= 0) & (row < height)
+            pixel = row[inside] * width + column[inside]
+            code = codes[hit][inside]
+            count += np.bincount(pixel, minlength=n_pixels)
+            for channel in range(3):
+                color_sum[channel] += np.bincount(pixel, palette[channel].take(code), minlength=n_pixels)
+
+    return count, color_sum
+
+
+def rasterize(xy, sources, targets, node_colors=None, edge_weights=None, colormap=WEIGHT_COLORMAP,
+              node_radius=1.5, width=CANVAS_SIZE, height=CANVAS_SIZE, padding=10, background=BACKGROUND,
+              max_samples=MAX_EDGE_SAMPLES):
+    """
+    Render a graph given as arrays to an RGB image.
+
+    Parameters:
+    ----------
+    xy: np.ndarray
+        n x 2 node positions
+    sources, targets: np.ndarray
+        Positions in xy of the two ends of each edge
+    node_colors: list
+        Matplotlib colour of each node. Defaults to grey.
+    edge_weights: np.ndarray
+        Weight of each edge. If given, edges are coloured by weight with
+        colormap. Otherwise each half of an edge takes the colour of the
+        node at that end.
+    colormap: str
+        Matplotlib colormap for edge_weights
+    node_radius: float or np.ndarray
+        Radius of each node in pixels. 0 draws only the edges.
+    width, height: int
+        Image size in pixels
+    padding: int
+        Space left around the graph in pixels, widened if needed to fit the
+        nodes
+    background: str
+        Matplotlib colour of the background
+    max_samples: int
+        Limit on the number of points sampled along the edges, which sets
+        the time taken. Graphs needing more are drawn with the longest
+        edges sampled more sparsely.
+
+    Returns:
+    --------
+    np.ndarray
+        height x width x 3 array of uint8
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+    node_codes, node_palette = palette_codes([NODE_COLOR] * len(xy) if node_colors is None else node_colors)
+
+    # Lines are spread onto the pixels either side, which must be on the
+    # canvas, and nodes are kept whole
+    padding = max(padding, 2, int(np.ceil(np.max(node_radius, initial=0))) + 1)
+    x, y = _to_pixels(xy, width, height, padding)
+
+    if edge_weights is None:
+        codes, palette = (node_codes.take(sources), node_codes.take(targets)), node_palette
+    else:
+        edge_codes, palette = weight_codes(edge_weights, colormap)
+        codes = (edge_codes, edge_codes)
+    density, color_sum = _accumulate_edges(x.take(sources), y.take(sources), x.take(targets), y.take(targets),
+                                           codes, palette, width, height, max_samples)
+
+    image = np.broadcast_to(np.array(to_rgb(background)), (width * height, 3)).copy()
+    drawn = density > 0
+    if drawn.any():
+        alpha = _MIN_ALPHA + (1 - _MIN_ALPHA) * np.log1p(density[drawn]) / np.log1p(density.max())
+        color = color_sum[:, drawn].T / density[drawn, None]
+        image[drawn] = image[drawn] * (1 - alpha[:, None]) + color * alpha[:, None]
+
+    if np.any(node_radius):
+        count, color_sum = _accumulate_nodes(x, y, node_codes, node_palette, node_radius, width, height)
+        covered = count > 0
+        image[covered] = color_sum[:, covered].T / count[covered, None]
+
+    return (image.reshape(height, width, 3) * 255).round().astype(np.uint8)
+
+
+@timed("raster image")
+def render_graph(G, pos=None, pos_attribute="pos", color_by="community", color_attribute="CommunityColor",
+                 node_colors=None, weight="Weight", **options):
+    """
+    Render a networkx graph to an RGB image with rasterize.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos, pos_attribute:
+        See plotly_traces.graph_arrays
+    color_by: str
+        "community" colours each half of an edge with the colour of the node
+        at that end, "weight" colours edges by their weight
+    color_attribute: str
+        Node attribute holding each node's colour
+    node_colors: list
+        Colour for each node, in G's node order, instead of color_attribute
+    weight: str
+        Edge attribute holding the weight, for color_by="weight"
+    **options:
+        Passed on to rasterize
+
+    Returns:
+    --------
+    np.ndarray
+        height x width x 3 array of uint8
+    """
+    nodes, xy, sources, targets = graph_arrays(G, pos, pos_attribute)
+    if node_colors is None:
+        node_colors = [color for _, color in G.nodes(data=color_attribute)]
+
+    edge_weights = None
+    if color_by == "weight":
+        edge_weights = np.fromiter((w for _, _, w in G.edges(data=weight, default=1)),
+                                   dtype=np.float64, count=len(sources))
+
+    return rasterize(xy, sources, targets, node_colors, edge_weights, **options)
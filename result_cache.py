@@ -0,0 +1,140 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def estimate_size(obj):
+    """
+    Estimate the memory used by an object and everything it contains, in bytes.
+
+    Handles the containers results are usually made of (dicts, lists, tuples,
+    sets, numpy arrays, strings and bytes). Objects shared between entries are
+    counted every time they appear, so this errs on the side of overestimating.
+
+    Parameters:
+    ----------
+    obj: object
+
+    Returns:
+    --------
+    int
+    """
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+
+class ResultCache:
+    """
+    Least-recently-used cache bounded by the estimated memory of its entries.
+
+    Safe to share between the threads streamlit runs sessions in. Cached values
+    are returned as-is rather than copied, so they should not be modified.
+
+    Parameters:
+    ----------
+    max_bytes: int
+        Memory budget. The least recently used entries are evicted once the
+        total estimated size of the cached values exceeds it.
+    sizeof: callable
+        Function returning the size of a value in bytes
+    """
+
+    def __init__(self, max_bytes, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under key, or default if there is none.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting older entries if that takes the cache over
+        its budget. Values larger than the whole budget are not cached.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the value cached under key, calling compute() and caching its
+        result if there is none.
+
+        Parameters:
+        ----------
+        key: hashable
+        compute: callable
+            Called with no arguments to produce the value on a miss
+
+        Returns:
+        --------
+        object
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        Return the hit, miss and eviction counts and current memory use.
+
+        Returns:
+        --------
+        dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions,
+                    "size_mb": self.current_bytes / 1024 ** 2,
+                    "max_size_mb": self.max_bytes / 1024 ** 2}
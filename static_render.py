@@ -0,0 +1,172 @@
+"""
+Static network images drawn with matplotlib's object-oriented API.
+
+Figures are created as matplotlib.figure.Figure objects with an Agg canvas
+rather than through pyplot, so they are never added to pyplot's global
+figure registry and are freed as soon as they go out of scope. Edges, arrow
+heads and nodes are each drawn as a single collection rather than an artist
+per element, as nx.draw does for directed graphs.
+
+Rendered PNG and SVG bytes are cached per graph and style, so reruns and
+other sessions viewing the same graph don't draw it again.
+"""
+import io
+
+import numpy as np
+import streamlit as st
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
+
+from instrumentation import timed
+from result_cache import ResultCache
+
+STATIC_CACHE_MB = 32
+
+
+@st.cache_resource(show_spinner=False)
+def static_cache():
+    """
+    Return the process-wide cache of rendered network images, shared by every
+    session.
+
+    Returns:
+    --------
+    ResultCache
+    """
+    return ResultCache(max_bytes=STATIC_CACHE_MB * 1024 ** 2)
+
+
+def _arrow_heads(ax, start, end, node_size, arrowsize):
+    """
+    Triangles for arrow heads touching the edge of each target node, in data
+    coordinates.
+
+    Arrow heads are sized in points, so they are laid out in display
+    coordinates once the axes limits are fixed and then converted back.
+    """
+    points = ax.figure.dpi / 72
+    to_display = ax.transData
+    start, end = to_display.transform(start), to_display.transform(end)
+
+    direction = end - start
+    length = np.linalg.norm(direction, axis=1, keepdims=True)
+    direction = np.divide(direction, length, out=np.zeros_like(direction), where=length > 0)
+    normal = direction[:, ::-1] * [-1, 1]
+
+    # Marker sizes are areas in square points
+    tip = end - direction * (np.sqrt(node_size)[:, None] / 2 * points)
+    base = tip - direction * 0.4 * arrowsize * points
+    half_width = normal * 0.2 * arrowsize * points
+
+    triangles = np.stack([tip, base + half_width, base - half_width], axis=1)
+    return to_display.inverted().transform(triangles.reshape(-1, 2)).reshape(-1, 3, 2)
+
+
+def draw_network(ax, G, pos, node_size=300, node_color="#1f78b4", node_shape="o", alpha=None,
+                 edge_color="k", width=1.0, arrows=None, arrowsize=10):
+    """
+    Draw a network onto matplotlib axes, as nx.draw does, with one
+    collection each for the edges, arrow heads and nodes.
+
+    Parameters:
+    ----------
+    ax: matplotlib.axes.Axes
+    G: nx.Graph
+    pos: dict
+        Node to (x, y)
+    node_size, node_color, node_shape, alpha, edge_color, width, arrows, arrowsize:
+        As nx.draw. Per node and per edge values follow G.nodes and G.edges
+        order. arrows defaults to drawing arrow heads on directed graphs.
+    """
+    nodes = list(G)
+    index = {node: i for i, node in enumerate(nodes)}
+    xy = np.array([pos[node] for node in nodes], dtype=np.float64).reshape(len(nodes), 2)
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    start, end = xy[edges[:, 0]], xy[edges[:, 1]]
+
+    ax.add_collection(LineCollection(np.stack([start, end], axis=1), colors=edge_color, linewidths=width,
+                                     alpha=alpha, zorder=1))
+    ax.scatter(xy[:, 0], xy[:, 1], s=node_size, c=node_color, marker=node_shape, alpha=alpha, zorder=3)
+
+    ax.update_datalim(xy)
+    ax.autoscale_view()
+    ax.set_axis_off()
+    # Fix the limits now, as arrow heads are laid out from them
+    ax.set(xlim=ax.get_xlim(), ylim=ax.get_ylim())
+
+    if (G.is_directed() if arrows is None else arrows) and len(edges):
+        target_size = np.broadcast_to(np.asarray(node_size, dtype=np.float64), len(nodes))[edges[:, 1]]
+        ax.add_collection(PolyCollection(_arrow_heads(ax, start, end, target_size, arrowsize),
+                                         facecolors=edge_color, edgecolors="none", alpha=alpha, zorder=2))
+
+
+@timed("draw image")
+def render_network(G, pos, fmt="png", figsize=(6.4, 4.8), dpi=100, **style):
+    """
+    Draw a network to an image file in memory.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos: dict
+        Node to (x, y)
+    fmt: str
+        Any format matplotlib can save, e.g. "png" or "svg"
+    figsize: tuple of (float, float)
+        Size in inches
+    dpi: int
+    **style:
+        Passed on to draw_network
+
+    Returns:
+    --------
+    bytes
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    try:
+        draw_network(fig.add_subplot(), G, pos, **style)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt)
+        return buffer.getvalue()
+    finally:
+        # Drop the artists straight away rather than waiting for the figure
+        # to be garbage collected
+        fig.clear()
+
+
+def _hashable(value):
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+@timed("static image")
+def network_image(G, pos, key, fmt="png", **options):
+    """
+    Image of a network from render_network, cached under key and the
+    rendering options.
+
+    Parameters:
+    ----------
+    G: nx.Graph
+    pos: dict
+    key: tuple
+        Hashable key identifying G and pos, for example the dataset's
+        graph_key together with the layout name
+    fmt: str
+        "png" or "svg"
+    **options:
+        Passed on to render_network. Lists and arrays are converted to
+        tuples for the cache key.
+
+    Returns:
+    --------
+    bytes
+    """
+    cache_key = ("network_image", fmt) + tuple(key) + tuple(sorted((name, _hashable(value))
+                                                                  for name, value in options.items()))
+    return static_cache().get_or_compute(cache_key, lambda: render_network(G, pos, fmt, **options))